@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from .models import User, Conversation, Message, KnowledgeBase, SystemSettings
+from .models import User, Conversation, Message, KnowledgeBase, SystemSettings, AnswerJob
 from django.utils.translation import gettext_lazy as _
 
 
@@ -38,6 +38,13 @@ class MessageAdmin(admin.ModelAdmin):
     truncated_text.short_description = 'Text'
 
 
+@admin.register(AnswerJob)
+class AnswerJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'conversation', 'status', 'attempts', 'worker', 'created_at', 'started_at', 'finished_at')
+    list_filter = ('status',)
+    raw_id_fields = ('conversation', 'user_message', 'ai_message')
+
+
 @admin.register(KnowledgeBase)
 class KnowledgeBaseAdmin(admin.ModelAdmin):
     list_display = ('truncated_question', 'truncated_answer', 'confidence_score', 'last_used', 'usage_count')
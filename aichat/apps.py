@@ -1,6 +1,13 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_save
 
 
 class AichatConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'aichat'
+
+    def ready(self):
+        from .models import Message
+        from .notify import message_saved
+        # Новые сообщения оповещают открытые потоки сообщений беседы
+        post_save.connect(message_saved, sender=Message, dispatch_uid='aichat_message_saved')
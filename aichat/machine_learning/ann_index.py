@@ -0,0 +1,300 @@
+import logging
+import os
+import tempfile
+import threading
+import time
+import numpy as np
+
+# Инициализация логирования
+logger = logging.getLogger(__name__)
+
+ANN_DTYPE = np.float32
+
+
+def _normalize_rows(vectors):
+    """
+    L2-нормализация строк матрицы.
+    """
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class _InvertedList:
+    """
+    Список векторов одного кластера с удвоением емкости при вставке.
+    """
+
+    def __init__(self, dim):
+        self.vectors = np.zeros((0, dim), dtype=ANN_DTYPE)
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.size = 0
+
+    def append(self, item_id, vector):
+        if self.size == self.vectors.shape[0]:
+            capacity = max(8, self.size * 2)
+            vectors = np.zeros((capacity, self.vectors.shape[1]), dtype=ANN_DTYPE)
+            vectors[:self.size] = self.vectors[:self.size]
+            ids = np.zeros(capacity, dtype=np.int64)
+            ids[:self.size] = self.ids[:self.size]
+            self.vectors, self.ids = vectors, ids
+        self.vectors[self.size] = vector
+        self.ids[self.size] = item_id
+        self.size += 1
+        return self.size - 1
+
+    def pop(self, position):
+        """
+        Удаление строки переносом последней строки на ее место.
+        Возвращает:
+            int: ID перенесенного элемента или None, если удалялась последняя строка.
+        """
+        last = self.size - 1
+        moved = None
+        if position != last:
+            self.vectors[position] = self.vectors[last]
+            self.ids[position] = self.ids[last]
+            moved = int(self.ids[position])
+        self.size = last
+        return moved
+
+
+class IVFIndex:
+    """
+    Приближенный поиск ближайших соседей по косинусной схожести (IVF-Flat на NumPy).
+    Векторы разбиваются на кластеры сферическим k-means; запрос сравнивается с центроидами
+    и просматривает только n_probe ближайших кластеров. n_probe управляет балансом
+    полноты и задержки: n_probe = n_lists дает точный поиск.
+    """
+
+    def __init__(self, dim, n_lists=1, n_probe=8):
+        """
+        Аргументы:
+            dim (int): Размерность векторов.
+            n_lists (int): Количество кластеров.
+            n_probe (int): Количество просматриваемых кластеров при поиске.
+        """
+        self.dim = dim
+        self.n_probe = n_probe
+        self.centroids = np.zeros((max(1, n_lists), dim), dtype=ANN_DTYPE)
+        self.lists = [_InvertedList(dim) for _ in range(max(1, n_lists))]
+        self._locations = {}
+        self._lock = threading.RLock()
+        self.trained = n_lists <= 1
+
+    @property
+    def n_lists(self):
+        return len(self.lists)
+
+    @staticmethod
+    def suggested_lists(count):
+        """
+        Рекомендуемое количество кластеров для заданного числа векторов (~4 * sqrt(N)).
+        """
+        return int(max(1, min(65536, 4 * np.sqrt(max(count, 1)))))
+
+    def train(self, vectors, n_lists=None, iterations=10, sample_size=None, seed=0):
+        """
+        Обучение центроидов сферическим k-means на выборке векторов.
+        Ранее добавленные векторы перераспределяются по новым кластерам.
+        Аргументы:
+            vectors (numpy array): Матрица обучающих векторов N x dim.
+            n_lists (int): Количество кластеров (по умолчанию ~4 * sqrt(N)).
+            iterations (int): Количество итераций k-means.
+            sample_size (int): Размер выборки для обучения (по умолчанию 64 вектора на кластер).
+            seed (int): Зерно генератора случайных чисел.
+        """
+        started = time.perf_counter()
+        vectors = _normalize_rows(np.asarray(vectors, dtype=ANN_DTYPE))
+        n_lists = n_lists or self.suggested_lists(vectors.shape[0])
+        n_lists = max(1, min(n_lists, vectors.shape[0]))
+        rng = np.random.default_rng(seed)
+        sample_size = sample_size or n_lists * 64
+        if vectors.shape[0] > sample_size:
+            sample = vectors[rng.choice(vectors.shape[0], sample_size, replace=False)]
+        else:
+            sample = vectors
+        centroids = sample[rng.choice(sample.shape[0], n_lists, replace=False)].copy()
+        for _ in range(iterations):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            counts = np.bincount(assignment, minlength=n_lists)
+            order = np.argsort(assignment, kind='stable')
+            sums = np.zeros_like(centroids)
+            nonempty = counts > 0
+            starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[nonempty]
+            sums[nonempty] = np.add.reduceat(sample[order], starts, axis=0)
+            empty = ~nonempty
+            # Пустые кластеры переинициализируются случайными векторами выборки
+            sums[empty] = sample[rng.choice(sample.shape[0], int(empty.sum()))]
+            centroids = _normalize_rows(sums)
+
+        with self._lock:
+            existing = [(item_id, self.get(item_id)) for item_id in list(self._locations)]
+            self.centroids = centroids.astype(ANN_DTYPE)
+            self.lists = [_InvertedList(self.dim) for _ in range(n_lists)]
+            self._locations = {}
+            self.trained = True
+            if existing:
+                self.add([item_id for item_id, _ in existing], np.vstack([vector for _, vector in existing]))
+        logger.debug(f"IVF индекс обучен: {n_lists} кластеров за {round(time.perf_counter() - started, 3)} с")
+
+    def add(self, ids, vectors):
+        """
+        Добавление или замена векторов.
+        Аргументы:
+            ids (list): ID элементов.
+            vectors (numpy array): Матрица векторов len(ids) x dim.
+        """
+        vectors = _normalize_rows(np.atleast_2d(np.asarray(vectors, dtype=ANN_DTYPE)))
+        with self._lock:
+            assignment = np.argmax(vectors @ self.centroids.T, axis=1)
+            for item_id, vector, list_no in zip(ids, vectors, assignment):
+                item_id = int(item_id)
+                self.remove(item_id)
+                position = self.lists[list_no].append(item_id, vector)
+                self._locations[item_id] = (int(list_no), position)
+
+    def remove(self, item_id):
+        """
+        Удаление вектора по ID элемента.
+        """
+        with self._lock:
+            location = self._locations.pop(int(item_id), None)
+            if location is None:
+                return
+            list_no, position = location
+            moved = self.lists[list_no].pop(position)
+            if moved is not None:
+                self._locations[moved] = (list_no, position)
+
+    def get(self, item_id):
+        """
+        Получение нормализованного вектора по ID элемента или None.
+        """
+        with self._lock:
+            location = self._locations.get(int(item_id))
+            if location is None:
+                return None
+            list_no, position = location
+            return self.lists[list_no].vectors[position].copy()
+
+    def search(self, query, k=1, n_probe=None):
+        """
+        Поиск k ближайших векторов.
+        Аргументы:
+            query (numpy array): Вектор запроса.
+            k (int): Количество результатов.
+            n_probe (int): Количество просматриваемых кластеров (по умолчанию self.n_probe).
+        Возвращает:
+            list: Список кортежей (id элемента, схожесть) по убыванию схожести.
+        """
+        query = np.asarray(query, dtype=ANN_DTYPE)
+        norm = np.linalg.norm(query)
+        if norm:
+            query = query / norm
+        with self._lock:
+            if not self._locations:
+                return []
+            n_probe = max(1, min(n_probe or self.n_probe, self.n_lists))
+            centroid_scores = self.centroids @ query
+            if n_probe < self.n_lists:
+                probe = np.argpartition(-centroid_scores, n_probe - 1)[:n_probe]
+            else:
+                probe = np.arange(self.n_lists)
+            scores, ids = [], []
+            for list_no in probe:
+                inverted = self.lists[list_no]
+                if inverted.size:
+                    scores.append(inverted.vectors[:inverted.size] @ query)
+                    ids.append(inverted.ids[:inverted.size])
+            if not scores:
+                return []
+            scores = np.concatenate(scores)
+            ids = np.concatenate(ids)
+        k = min(k, scores.shape[0])
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(ids[i]), float(scores[i])) for i in top]
+
+    def ids(self):
+        with self._lock:
+            return set(self._locations)
+
+    def __len__(self):
+        return len(self._locations)
+
+    def snapshot(self):
+        """
+        Копия всех векторов индекса.
+        Возвращает:
+            tuple: (массив ID элементов, матрица нормализованных векторов).
+        """
+        with self._lock:
+            ids = [inverted.ids[:inverted.size] for inverted in self.lists]
+            vectors = [inverted.vectors[:inverted.size] for inverted in self.lists]
+            return np.concatenate(ids), np.vstack(vectors)
+
+    def save(self, path):
+        """
+        Сохранение индекса на диск в формате .npz (запись через временный файл процесса).
+        Аргументы:
+            path (str): Путь к файлу.
+        """
+        with self._lock:
+            sizes = np.array([inverted.size for inverted in self.lists], dtype=np.int64)
+            ids, vectors = self.snapshot()
+            centroids = self.centroids.copy()
+            n_probe, trained = self.n_probe, self.trained
+        # Запись идет вне блокировки индекса, чтобы не задерживать поиск
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix=f"{os.path.basename(path)}.", suffix='.tmp', dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as tmp_file:
+                np.savez(
+                    tmp_file,
+                    centroids=centroids,
+                    sizes=sizes,
+                    vectors=vectors,
+                    ids=ids,
+                    n_probe=np.array(n_probe),
+                    trained=np.array(trained),
+                )
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        logger.debug(f"IVF индекс сохранен в {path}: {len(ids)} векторов")
+
+    @classmethod
+    def load(cls, path):
+        """
+        Загрузка индекса с диска.
+        Аргументы:
+            path (str): Путь к файлу.
+        Возвращает:
+            IVFIndex: Загруженный индекс.
+        """
+        with np.load(path) as data:
+            centroids = data['centroids']
+            index = cls(centroids.shape[1], n_lists=centroids.shape[0], n_probe=int(data['n_probe']))
+            index.centroids = centroids.astype(ANN_DTYPE)
+            index.trained = bool(data['trained'])
+            # Каждое обращение data[...] заново читает массив из файла: читаем массивы один раз
+            sizes = data['sizes']
+            vectors = data['vectors'].astype(ANN_DTYPE, copy=False)
+            ids = data['ids'].astype(np.int64, copy=False)
+            offset = 0
+            for list_no, size in enumerate(sizes):
+                size = int(size)
+                inverted = index.lists[list_no]
+                # Срезы без копирования: запись идет в пределах среза, рост списка выделяет новый массив
+                inverted.vectors = vectors[offset:offset + size]
+                inverted.ids = ids[offset:offset + size]
+                inverted.size = size
+                for position, item_id in enumerate(inverted.ids):
+                    index._locations[int(item_id)] = (list_no, position)
+                offset += size
+        logger.debug(f"IVF индекс загружен из {path}: {len(index)} векторов")
+        return index
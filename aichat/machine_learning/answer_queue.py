@@ -0,0 +1,265 @@
+import logging
+import os
+import socket
+import threading
+from collections import Counter
+from datetime import timedelta
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Count, F, Min
+from django.utils import timezone
+from aichat.models import AnswerJob, Message
+from .model_manager import get_ai_manager
+
+# Инициализация логирования
+logger = logging.getLogger(__name__)
+
+# Ответ, сохраняемый в беседу, если задание не удалось выполнить за все попытки
+FAILED_ANSWER = "Извините, произошла ошибка. Пожалуйста, попробуйте позже."
+
+
+class AnswerQueue:
+    """
+    Очередь заданий генерации ответов ИИ в базе данных.
+    Представление сохраняет сообщение пользователя вместе с заданием и сразу возвращает ответ,
+    обработчики (команда run_answer_worker) забирают задания с арендой на ANSWER_JOB_LEASE секунд
+    и сохраняют ответ ИИ отдельным сообщением, которое страница чата получает опросом новых сообщений.
+    Задания упавшего обработчика возвращаются в очередь по истечении аренды.
+    """
+
+    def __init__(self):
+        self.counters = Counter()
+
+    @property
+    def max_attempts(self):
+        return getattr(settings, 'ANSWER_JOB_MAX_ATTEMPTS', 3)
+
+    @property
+    def lease(self):
+        return timedelta(seconds=getattr(settings, 'ANSWER_JOB_LEASE', 300))
+
+    @staticmethod
+    def enabled():
+        return getattr(settings, 'AI_ANSWER_QUEUE', False)
+
+    @staticmethod
+    def enqueue(conversation, text):
+        """
+        Сохранение сообщения пользователя и задания на ответ в одной короткой транзакции.
+        Аргументы:
+            conversation (Conversation): Беседа.
+            text (str): Текст сообщения пользователя.
+        Возвращает:
+            tuple: Сообщение пользователя и задание.
+        """
+        with transaction.atomic():
+            user_message = Message.objects.create(conversation=conversation, text=text, is_user_message=True)
+            job = AnswerJob.objects.create(conversation=conversation, user_message=user_message)
+        logger.debug(f"Поставлено в очередь задание {job.id} для сообщения {user_message.id}")
+        return user_message, job
+
+    def requeue_expired(self):
+        """
+        Возврат в очередь заданий, аренда которых истекла (обработчик упал или завис).
+        Возвращает:
+            int: Количество возвращенных заданий.
+        """
+        requeued = AnswerJob.objects.filter(
+            status=AnswerJob.STATUS_RUNNING, lease_expires_at__lt=timezone.now()
+        ).update(status=AnswerJob.STATUS_PENDING, worker='', lease_expires_at=None, error='Истекла аренда обработчика')
+        if requeued:
+            self.counters['requeued'] += requeued
+            logger.warning(f"Возвращено в очередь {requeued} заданий с истекшей арендой")
+        return requeued
+
+    def claim(self, worker):
+        """
+        Захват самого старого ожидающего задания.
+        Захват - условное обновление статуса, поэтому одно задание получает только один обработчик
+        (без блокировок строк, одинаково для SQLite и PostgreSQL).
+        Аргументы:
+            worker (str): Имя обработчика.
+        Возвращает:
+            AnswerJob: Захваченное задание или None, если очередь пуста.
+        """
+        candidates = list(
+            AnswerJob.objects.filter(status=AnswerJob.STATUS_PENDING)
+            .order_by('created_at').values_list('id', flat=True)[:10]
+        )
+        for job_id in candidates:
+            now = timezone.now()
+            claimed = AnswerJob.objects.filter(id=job_id, status=AnswerJob.STATUS_PENDING).update(
+                status=AnswerJob.STATUS_RUNNING,
+                worker=worker,
+                started_at=now,
+                lease_expires_at=now + self.lease,
+                attempts=F('attempts') + 1,
+            )
+            if claimed:
+                return AnswerJob.objects.select_related('conversation__user', 'user_message').get(id=job_id)
+        return None
+
+    @staticmethod
+    def _owned(job):
+        """
+        Задание, пока оно принадлежит захватившему его обработчику: после истечения аренды задание
+        возвращается в очередь и захватывается заново (другой обработчик, следующая попытка),
+        и запись устаревшего обработчика не должна изменить его.
+        """
+        return AnswerJob.objects.filter(
+            id=job.id, status=AnswerJob.STATUS_RUNNING, worker=job.worker, attempts=job.attempts
+        )
+
+    def _save_answer(self, job, text, sources, status, error=''):
+        """
+        Сохранение ответа и завершение задания, если обработчик все еще владеет им.
+        Возвращает:
+            Message: Сохраненный ответ ИИ или None, если аренда задания потеряна.
+        """
+        with transaction.atomic():
+            # Условное обновление блокирует строку задания до конца транзакции: возврат в очередь ждет ее
+            if not self._owned(job).update(
+                status=status, error=error, lease_expires_at=None, finished_at=timezone.now()
+            ):
+                self._lease_lost(job)
+                return None
+            ai_message = Message.objects.create(
+                conversation=job.conversation,
+                text=text,
+                is_user_message=False,
+                is_ai_generated=True,
+                sources=sources
+            )
+            AnswerJob.objects.filter(id=job.id).update(ai_message=ai_message)
+        return ai_message
+
+    def _lease_lost(self, job):
+        self.counters['lease_lost'] += 1
+        logger.warning(
+            f"Задание {job.id} (попытка {job.attempts}) больше не принадлежит обработчику {job.worker}, "
+            f"результат отброшен"
+        )
+
+    def process(self, job):
+        """
+        Генерация ответа на сообщение задания.
+        При ошибке задание возвращается в очередь, после ANSWER_JOB_MAX_ATTEMPTS попыток
+        в беседу сохраняется сообщение об ошибке, чтобы страница чата не ждала ответ бесконечно.
+        Аргументы:
+            job (AnswerJob): Захваченное задание.
+        Возвращает:
+            bool: True, если ответ сохранен.
+        """
+        error = None
+        if job.attempts > self.max_attempts:
+            error = job.error or 'Превышено количество попыток'
+        else:
+            try:
+                response = get_ai_manager().process_message(
+                    job.user_message.text, job.conversation.user, job.conversation_id
+                )
+                if not response['success']:
+                    raise Exception(response.get('error', 'Ошибка обработки сообщения'))
+                if self._save_answer(job, response['answer'], response.get('sources', []), AnswerJob.STATUS_DONE) is None:
+                    return False
+                self.counters['done'] += 1
+                logger.debug(f"Задание {job.id} выполнено за попыток: {job.attempts}")
+                return True
+            except Exception as e:
+                logger.error(f"Ошибка выполнения задания {job.id} (попытка {job.attempts}): {str(e)}")
+                error = str(e)
+                if job.attempts < self.max_attempts:
+                    if self._owned(job).update(
+                        status=AnswerJob.STATUS_PENDING, worker='', lease_expires_at=None, error=error
+                    ):
+                        self.counters['retried'] += 1
+                    else:
+                        self._lease_lost(job)
+                    return False
+        if self._save_answer(job, FAILED_ANSWER, [], AnswerJob.STATUS_FAILED, error) is not None:
+            self.counters['failed'] += 1
+        return False
+
+    def run_pending(self, worker):
+        """
+        Выполнение заданий до опустошения очереди.
+        Возвращает:
+            int: Количество обработанных заданий.
+        """
+        processed = 0
+        self.requeue_expired()
+        while True:
+            job = self.claim(worker)
+            if job is None:
+                return processed
+            self.process(job)
+            processed += 1
+
+    def work(self, worker, stop_event, poll_interval=None):
+        """
+        Цикл обработчика: выполнение заданий и ожидание новых до установки stop_event.
+        Аргументы:
+            worker (str): Имя обработчика.
+            stop_event (threading.Event): Событие остановки.
+            poll_interval (float): Пауза при пустой очереди (по умолчанию ANSWER_WORKER_POLL_INTERVAL).
+        """
+        poll_interval = poll_interval or getattr(settings, 'ANSWER_WORKER_POLL_INTERVAL', 1)
+        logger.info(f"Обработчик заданий {worker} запущен")
+        while not stop_event.is_set():
+            try:
+                self.run_pending(worker)
+            except Exception as e:
+                logger.error(f"Ошибка обработчика заданий {worker}: {str(e)}")
+            finally:
+                close_old_connections()
+            stop_event.wait(poll_interval)
+        logger.info(f"Обработчик заданий {worker} остановлен")
+
+    @staticmethod
+    def worker_name(index):
+        return f'{socket.gethostname()}:{os.getpid()}:{index}'
+
+    def start_workers(self, count, stop_event):
+        """
+        Запуск локального пула обработчиков в потоках процесса.
+        Возвращает:
+            list: Запущенные потоки.
+        """
+        threads = []
+        for index in range(count):
+            thread = threading.Thread(
+                target=self.work, args=(self.worker_name(index), stop_event), name=f'answer-worker-{index}', daemon=True
+            )
+            thread.start()
+            threads.append(thread)
+        return threads
+
+    def stats(self):
+        """
+        Глубина очереди и время ожидания заданий.
+        Возвращает:
+            dict: Количество заданий по статусам, возраст самого старого ожидающего задания
+                  и среднее ожидание последних начатых заданий в секундах.
+        """
+        now = timezone.now()
+        by_status = dict(AnswerJob.objects.order_by().values_list('status').annotate(count=Count('id')))
+        oldest = AnswerJob.objects.filter(status=AnswerJob.STATUS_PENDING).aggregate(oldest=Min('created_at'))['oldest']
+        recent = AnswerJob.objects.filter(started_at__isnull=False).order_by('-started_at').values_list(
+            'created_at', 'started_at'
+        )[:100]
+        waits = [(started_at - created_at).total_seconds() for created_at, started_at in recent]
+        return {
+            'enabled': self.enabled(),
+            'depth': by_status.get(AnswerJob.STATUS_PENDING, 0),
+            'running': by_status.get(AnswerJob.STATUS_RUNNING, 0),
+            'done': by_status.get(AnswerJob.STATUS_DONE, 0),
+            'failed': by_status.get(AnswerJob.STATUS_FAILED, 0),
+            'oldest_wait_seconds': round((now - oldest).total_seconds(), 3) if oldest else 0,
+            'avg_wait_seconds': round(sum(waits) / len(waits), 3) if waits else None,
+            # Счетчики обработчиков этого процесса
+            'workers': dict(self.counters),
+        }
+
+
+# Общая очередь заданий процесса
+answer_queue = AnswerQueue()
@@ -0,0 +1,161 @@
+import logging
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+import torch
+
+# Инициализация логирования
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingService:
+    """
+    Сервис вложений BERT с микро-батчингом запросов от параллельных потоков.
+    Тексты складываются в очередь, рабочий поток собирает их в батч, ограниченный
+    максимальным размером и временем ожидания, выполняет один проход модели
+    с усреднением по маске внимания и разрешает future каждого вызывающего.
+    """
+
+    def __init__(self, tokenizer, model, max_batch_size=16, max_wait_ms=10, max_length=512):
+        """
+        Аргументы:
+            tokenizer: Токенизатор BERT.
+            model: Модель BERT.
+            max_batch_size (int): Максимальное количество текстов в одном проходе модели.
+            max_wait_ms (float): Максимальное ожидание добора батча после первого текста (мс).
+            max_length (int): Максимальная длина последовательности в токенах.
+        """
+        self.tokenizer = tokenizer
+        self.model = model
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000
+        self.max_length = max_length
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.batch_size_histogram = Counter()
+        self.batches = 0
+        self.texts = 0
+        self.errors = 0
+        self.total_wait_seconds = 0.0
+        self.total_forward_seconds = 0.0
+
+    def _ensure_worker(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='bert-embedding-service', daemon=True)
+                    self._thread.start()
+
+    def submit(self, text):
+        """
+        Постановка текста в очередь на вычисление вложения.
+        Аргументы:
+            text (str): Текст для вложения.
+        Возвращает:
+            Future: Future с numpy array вложения.
+        """
+        future = Future()
+        self._ensure_worker()
+        self._queue.put((text, future, time.perf_counter()))
+        return future
+
+    def embed(self, text, timeout=None):
+        """
+        Синхронное получение вложения текста через общую очередь.
+        Аргументы:
+            text (str): Текст для вложения.
+            timeout (float): Максимальное ожидание результата в секундах (опционально).
+        Возвращает:
+            numpy array: Вложение BERT.
+        """
+        return self.submit(text).result(timeout=timeout)
+
+    def embed_many(self, texts, timeout=None):
+        """
+        Получение вложений для списка текстов; тексты попадают в общие батчи.
+        Аргументы:
+            texts (list): Список текстов.
+            timeout (float): Максимальное ожидание каждого результата в секундах (опционально).
+        Возвращает:
+            list: Список numpy array вложений в порядке текстов.
+        """
+        futures = [self.submit(text) for text in texts]
+        return [future.result(timeout=timeout) for future in futures]
+
+    def _collect_batch(self):
+        """
+        Ожидание первого текста и добор батча до max_batch_size или истечения max_wait.
+        """
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                if remaining <= 0:
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _encode(self, texts):
+        """
+        Один проход модели по батчу с дополнением и усреднением по маске внимания.
+        """
+        inputs = self.tokenizer(
+            texts, return_tensors='pt', padding=True, truncation=True, max_length=self.max_length
+        )
+        with torch.no_grad():
+            outputs = self.model(**inputs)
+        mask = inputs['attention_mask'].unsqueeze(-1).to(outputs.last_hidden_state.dtype)
+        summed = (outputs.last_hidden_state * mask).sum(dim=1)
+        counts = mask.sum(dim=1).clamp(min=1)
+        return (summed / counts).numpy()
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            # Отмененные вызывающими запросы не тратят место в проходе модели
+            batch = [entry for entry in batch if entry[1].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            started = time.perf_counter()
+            try:
+                embeddings = self._encode([text for text, _, _ in batch])
+                for (_, future, _), embedding in zip(batch, embeddings):
+                    future.set_result(embedding)
+            except Exception as e:
+                logger.error(f"Ошибка вычисления батча вложений BERT из {len(batch)} текстов: {str(e)}")
+                self.errors += 1
+                for _, future, _ in batch:
+                    future.set_exception(e)
+            finished = time.perf_counter()
+            self.batches += 1
+            self.texts += len(batch)
+            self.batch_size_histogram[len(batch)] += 1
+            self.total_forward_seconds += finished - started
+            self.total_wait_seconds += sum(started - enqueued for _, _, enqueued in batch)
+            logger.debug(f"Батч вложений BERT: {len(batch)} текстов за {round(finished - started, 3)} с")
+
+    def stats(self):
+        """
+        Статистика очереди и батчей.
+        Возвращает:
+            dict: Глубина очереди, гистограмма размеров батчей и средние задержки.
+        """
+        return {
+            'queue_depth': self._queue.qsize(),
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait * 1000,
+            'batches': self.batches,
+            'texts': self.texts,
+            'errors': self.errors,
+            'batch_size_histogram': {str(size): count for size, count in sorted(self.batch_size_histogram.items())},
+            'avg_batch_size': round(self.texts / self.batches, 2) if self.batches else 0.0,
+            'avg_queue_wait_ms': round(self.total_wait_seconds / self.texts * 1000, 2) if self.texts else 0.0,
+            'avg_forward_ms': round(self.total_forward_seconds / self.batches * 1000, 2) if self.batches else 0.0,
+        }
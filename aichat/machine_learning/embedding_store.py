@@ -0,0 +1,446 @@
+import logging
+import os
+import threading
+import time
+import numpy as np
+from django.conf import settings
+from django.db import close_old_connections
+from aichat.models import KnowledgeBase
+from .ann_index import IVFIndex
+
+# Инициализация логирования
+logger = logging.getLogger(__name__)
+
+EMBEDDING_DTYPE = np.float32
+
+
+def embedding_to_bytes(embedding):
+    """
+    Сериализация вложения BERT для хранения в поле KnowledgeBase.question_embedding.
+    Аргументы:
+        embedding (numpy array): Вложение BERT.
+    Возвращает:
+        bytes: Вложение в формате float32.
+    """
+    return np.asarray(embedding, dtype=EMBEDDING_DTYPE).tobytes()
+
+
+def embedding_from_bytes(data):
+    """
+    Десериализация вложения BERT из поля KnowledgeBase.question_embedding.
+    Аргументы:
+        data (bytes | memoryview): Сохраненное вложение.
+    Возвращает:
+        numpy array: Вложение в формате float32 или None, если данных нет.
+    """
+    if not data:
+        return None
+    return np.frombuffer(bytes(data), dtype=EMBEDDING_DTYPE)
+
+
+def _normalize(vector):
+    """
+    L2-нормализация вектора, чтобы косинусная схожесть сводилась к скалярному произведению.
+    """
+    norm = np.linalg.norm(vector)
+    if norm == 0:
+        return vector
+    return vector / norm
+
+
+class EmbeddingStore:
+    """
+    Хранилище вложений BERT вопросов базы знаний в виде одной непрерывной матрицы float32.
+    Вложения вычисляются один раз при записи элемента базы знаний и сохраняются в БД,
+    поэтому поиск стоит одного прохода BERT для запроса и одного умножения матрицы на вектор.
+    Когда база знаний вырастает до KB_ANN_MIN_SIZE элементов, полный перебор заменяется
+    приближенным IVF индексом, который сохраняется на диск между перезапусками.
+    Построение и переобучение индекса (k-means) и сохранение изменений на диск выполняет фоновый поток
+    раз в KB_ANN_MAINTENANCE_INTERVAL секунд, не задерживая запросы.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._matrix = None
+        self._ids = None
+        self._positions = {}
+        self._size = 0
+        self._loaded = False
+        self._ann = None
+        self._ann_trained_size = 0
+        # Изменения, внесенные во время фонового построения индекса: (ID, вложение или None при удалении)
+        self._journal = None
+        self._dirty = False
+        self._thread = None
+        self._backfill_thread = None
+        self._loads = 0
+        self.rebuilds = 0
+
+    @property
+    def ann_min_size(self):
+        return getattr(settings, 'KB_ANN_MIN_SIZE', 20000)
+
+    @property
+    def ann_path(self):
+        return getattr(settings, 'KB_ANN_INDEX_PATH', None)
+
+    def _reset_flat_locked(self):
+        self._matrix = None
+        self._ids = None
+        self._positions = {}
+        self._size = 0
+
+    def needs_rebuild(self):
+        """
+        Признак того, что индекс нужно построить (база выросла до KB_ANN_MIN_SIZE)
+        или переобучить (индекс вырос в несколько раз с момента обучения).
+        """
+        if self._ann is None:
+            return self._size >= self.ann_min_size
+        return len(self._ann) > 4 * max(self._ann_trained_size, 1)
+
+    def rebuild_ann(self):
+        """
+        Построение или переобучение IVF индекса вне блокировки хранилища:
+        k-means выполняется по копии вложений, изменения за это время переносятся в новый индекс.
+        Возвращает:
+            bool: True, если новый индекс установлен.
+        """
+        with self._lock:
+            if self._journal is not None:
+                return False
+            loads = self._loads
+            source = self._ann
+            if source is not None:
+                ids, vectors = source.snapshot()
+            elif self._size:
+                ids, vectors = self._ids[:self._size].copy(), self._matrix[:self._size].copy()
+            else:
+                return False
+            self._journal = []
+        try:
+            logger.debug(f"Построение IVF индекса по {len(ids)} вложениям")
+            ann = IVFIndex(vectors.shape[1], n_probe=getattr(settings, 'KB_ANN_N_PROBE', 16))
+            ann.train(vectors)
+            ann.add(ids, vectors)
+        except BaseException:
+            with self._lock:
+                self._journal = None
+            raise
+        with self._lock:
+            journal, self._journal = self._journal, None
+            if self._loads != loads:
+                # Хранилище перезагружено во время построения
+                return False
+            for item_id, embedding in journal:
+                if embedding is None:
+                    ann.remove(item_id)
+                else:
+                    ann.add([item_id], embedding)
+            self._ann = ann
+            self._ann_trained_size = len(ids)
+            self._reset_flat_locked()
+            self._dirty = True
+            self.rebuilds += 1
+        self.save()
+        return True
+
+    def start_maintenance(self, interval):
+        """
+        Запуск фонового потока обслуживания IVF индекса: построение, переобучение и сохранение на диск.
+        Аргументы:
+            interval (float): Интервал в секундах; 0 отключает обслуживание.
+        """
+        if not interval or self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+
+            def run():
+                while True:
+                    time.sleep(interval)
+                    try:
+                        if self.needs_rebuild():
+                            self.rebuild_ann()
+                        elif self._dirty:
+                            self.save()
+                    except Exception as e:
+                        logger.error(f"Ошибка обслуживания IVF индекса: {str(e)}")
+
+            self._thread = threading.Thread(target=run, name='kb-ann-maintenance', daemon=True)
+            self._thread.start()
+
+    def save(self):
+        """
+        Сохранение IVF индекса на диск, если он используется и путь задан в настройках.
+        """
+        with self._lock:
+            ann = self._ann
+            self._dirty = False
+        if ann is not None and self.ann_path:
+            try:
+                ann.save(self.ann_path)
+            except Exception as e:
+                self._dirty = True
+                logger.error(f"Ошибка сохранения IVF индекса в {self.ann_path}: {str(e)}")
+
+    def _load_ann_from_disk_locked(self):
+        """
+        Загрузка IVF индекса с диска и сверка с базой знаний:
+        удаленные элементы убираются, отсутствующие в индексе вложения дочитываются из БД.
+        Возвращает:
+            bool: True, если индекс загружен.
+        """
+        path = self.ann_path
+        if not path or not os.path.exists(path):
+            return False
+        try:
+            ann = IVFIndex.load(path)
+        except Exception as e:
+            logger.error(f"Ошибка загрузки IVF индекса из {path}: {str(e)}")
+            return False
+        db_ids = set(
+            KnowledgeBase.objects.filter(question_embedding__isnull=False).values_list('id', flat=True)
+        )
+        indexed_ids = ann.ids()
+        for item_id in indexed_ids - db_ids:
+            ann.remove(item_id)
+        new_ids = list(db_ids - indexed_ids)
+        for start in range(0, len(new_ids), 1000):
+            rows = KnowledgeBase.objects.filter(id__in=new_ids[start:start + 1000]).values_list(
+                'id', 'question_embedding'
+            )
+            for item_id, stored in rows:
+                embedding = embedding_from_bytes(stored)
+                if embedding is not None:
+                    ann.add([item_id], embedding)
+        self._reset_flat_locked()
+        self._ann = ann
+        self._ann_trained_size = len(ann)
+        logger.debug(f"IVF индекс загружен с диска: {len(ann)} вложений, дочитано {len(new_ids)}")
+        return True
+
+    def _ensure_capacity(self, dim, extra=1):
+        """
+        Выделение места под новые строки с удвоением емкости, чтобы вставка была амортизированно O(1).
+        """
+        required = self._size + extra
+        if self._matrix is None:
+            capacity = max(required, 64)
+            self._matrix = np.zeros((capacity, dim), dtype=EMBEDDING_DTYPE)
+            self._ids = np.zeros(capacity, dtype=np.int64)
+        elif required > self._matrix.shape[0]:
+            capacity = max(required, self._matrix.shape[0] * 2)
+            matrix = np.zeros((capacity, dim), dtype=EMBEDDING_DTYPE)
+            matrix[:self._size] = self._matrix[:self._size]
+            ids = np.zeros(capacity, dtype=np.int64)
+            ids[:self._size] = self._ids[:self._size]
+            self._matrix, self._ids = matrix, ids
+
+    def load(self):
+        """
+        Загрузка сохраненных вложений из базы знаний в матрицу.
+        Элементы без сохраненного вложения не загружаются: их дозаполняет backfill.
+        """
+        with self._lock:
+            logger.debug("Загрузка вложений базы знаний в EmbeddingStore")
+            self._loads += 1
+            self._reset_flat_locked()
+            self._ann = None
+            if not self._load_ann_from_disk_locked():
+                rows = KnowledgeBase.objects.filter(question_embedding__isnull=False).values_list(
+                    'id', 'question_embedding'
+                )
+                for item_id, stored in rows.iterator():
+                    embedding = embedding_from_bytes(stored)
+                    if embedding is not None:
+                        self._add_locked(item_id, embedding)
+            # Индекс строится фоновым потоком обслуживания (или командой build_kb_embeddings),
+            # а до этого поиск идет полным перебором
+            self._loaded = True
+        self.save()
+        self.start_maintenance(getattr(settings, 'KB_ANN_MAINTENANCE_INTERVAL', 300))
+        logger.debug(f"EmbeddingStore загружен: {len(self)} вложений")
+
+    def backfill(self, nlp_processor, batch_size=256):
+        """
+        Вычисление и сохранение вложений элементов базы знаний, у которых их нет (после миграции или импорта).
+        Кодирование идет батчами вне блокировки хранилища, поэтому поиск в это время не ждет.
+        Аргументы:
+            nlp_processor (NLPProcessor): Процессор для вычисления вложений.
+            batch_size (int): Количество вопросов в одном батче.
+        Возвращает:
+            int: Количество дозаполненных элементов.
+        """
+        filled = 0
+        last_id = 0
+        while True:
+            batch = list(
+                KnowledgeBase.objects.filter(question_embedding__isnull=True, id__gt=last_id)
+                .order_by('id').values_list('id', 'question_pattern')[:batch_size]
+            )
+            if not batch:
+                break
+            last_id = batch[-1][0]
+            embeddings = nlp_processor.get_bert_embeddings([question for _, question in batch])
+            for (item_id, _), embedding in zip(batch, embeddings):
+                if embedding is None:
+                    continue
+                KnowledgeBase.objects.filter(id=item_id).update(question_embedding=embedding_to_bytes(embedding))
+                self.add(item_id, embedding)
+                filled += 1
+        if filled:
+            logger.debug(f"Дозаполнено вложений базы знаний: {filled}")
+        return filled
+
+    def _start_backfill(self, nlp_processor):
+        """
+        Запуск дозаполнения недостающих вложений в фоновом потоке (однократно за время жизни процесса).
+        """
+        if self._backfill_thread is not None:
+            return
+
+        def run():
+            try:
+                self.backfill(nlp_processor)
+            except Exception as e:
+                logger.error(f"Ошибка дозаполнения вложений базы знаний: {str(e)}")
+            finally:
+                close_old_connections()
+
+        self._backfill_thread = threading.Thread(target=run, name='kb-embedding-backfill', daemon=True)
+        self._backfill_thread.start()
+
+    def ensure_loaded(self, nlp_processor=None):
+        """
+        Ленивая загрузка хранилища при первом обращении.
+        Недостающие вложения дозаполняются в фоне, если передан процессор; до этого такие элементы
+        находит только TF-IDF.
+        Аргументы:
+            nlp_processor (NLPProcessor): Процессор для вычисления недостающих вложений (опционально).
+        """
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self.load()
+                    if nlp_processor is not None:
+                        self._start_backfill(nlp_processor)
+
+    def _add_locked(self, item_id, embedding):
+        if self._journal is not None:
+            self._journal.append((item_id, embedding))
+        if self._ann is not None:
+            self._ann.add([item_id], embedding)
+            self._dirty = True
+            return
+        vector = _normalize(np.asarray(embedding, dtype=EMBEDDING_DTYPE))
+        position = self._positions.get(item_id)
+        if position is not None:
+            self._matrix[position] = vector
+            return
+        self._ensure_capacity(vector.shape[0])
+        self._matrix[self._size] = vector
+        self._ids[self._size] = item_id
+        self._positions[item_id] = self._size
+        self._size += 1
+
+    def add(self, item_id, embedding):
+        """
+        Добавление или замена вложения элемента базы знаний.
+        Аргументы:
+            item_id (int): ID элемента KnowledgeBase.
+            embedding (numpy array): Вложение BERT.
+        """
+        if embedding is None:
+            return
+        with self._lock:
+            self._add_locked(item_id, embedding)
+
+    def remove(self, item_id):
+        """
+        Удаление вложения элемента базы знаний (последняя строка переносится на место удаленной).
+        Аргументы:
+            item_id (int): ID элемента KnowledgeBase.
+        """
+        with self._lock:
+            if self._journal is not None:
+                self._journal.append((item_id, None))
+            if self._ann is not None:
+                self._ann.remove(item_id)
+                self._dirty = True
+                return
+            position = self._positions.pop(item_id, None)
+            if position is None:
+                return
+            last = self._size - 1
+            if position != last:
+                self._matrix[position] = self._matrix[last]
+                self._ids[position] = self._ids[last]
+                self._positions[int(self._ids[position])] = position
+            self._size = last
+
+    def get(self, item_id):
+        """
+        Получение нормализованного вложения элемента базы знаний.
+        Аргументы:
+            item_id (int): ID элемента KnowledgeBase.
+        Возвращает:
+            numpy array: Вложение или None, если элемента нет в хранилище.
+        """
+        with self._lock:
+            if self._ann is not None:
+                return self._ann.get(item_id)
+            position = self._positions.get(item_id)
+            if position is None:
+                return None
+            return self._matrix[position].copy()
+
+    def search(self, query_embedding, k=1, n_probe=None):
+        """
+        Поиск ближайших по косинусной схожести вопросов базы знаний.
+        Аргументы:
+            query_embedding (numpy array): Вложение BERT запроса.
+            k (int): Количество результатов.
+            n_probe (int): Количество просматриваемых кластеров IVF индекса (опционально).
+        Возвращает:
+            list: Список кортежей (id элемента, схожесть) по убыванию схожести.
+        """
+        if query_embedding is None:
+            return []
+        if self._ann is not None:
+            return self._ann.search(query_embedding, k=k, n_probe=n_probe)
+        with self._lock:
+            if self._size == 0:
+                return []
+            query = _normalize(np.asarray(query_embedding, dtype=EMBEDDING_DTYPE))
+            scores = self._matrix[:self._size] @ query
+            k = min(k, self._size)
+            if k == 1:
+                top = np.array([np.argmax(scores)])
+            else:
+                top = np.argpartition(-scores, k - 1)[:k]
+                top = top[np.argsort(-scores[top])]
+            return [(int(self._ids[i]), float(scores[i])) for i in top]
+
+    def __len__(self):
+        if self._ann is not None:
+            return len(self._ann)
+        return self._size
+
+    def stats(self):
+        """
+        Статистика хранилища вложений.
+        """
+        return {
+            'size': len(self),
+            'mode': 'ivf' if self._ann is not None else 'flat',
+            'ann_lists': self._ann.n_lists if self._ann is not None else None,
+            'ann_n_probe': self._ann.n_probe if self._ann is not None else None,
+            'ann_rebuilds': self.rebuilds,
+            'ann_unsaved': self._dirty,
+        }
+
+
+# Общее хранилище вложений процесса
+embedding_store = EmbeddingStore()
@@ -0,0 +1,161 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.db import IntegrityError
+from django.db.models import F
+from django.utils import timezone
+from aichat.models import KnowledgeBase, KnowledgeBaseQuestion
+from .utils import question_hash
+
+# Инициализация логирования
+logger = logging.getLogger(__name__)
+
+
+class ExactMatchCache:
+    """
+    Быстрый путь для повторяющихся вопросов: поиск ответа по хешу нормализованного вопроса
+    в словаре процесса, а при промахе - по индексу KnowledgeBase.question_hash и сопоставлениям
+    других формулировок KnowledgeBaseQuestion. Не использует spaCy, TF-IDF и BERT.
+    Записи словаря живут KB_EXACT_CACHE_TTL секунд: ответы, измененные другим процессом
+    (фоновое обновление базы знаний), перечитываются из базы не позже этого срока.
+    """
+
+    def __init__(self, max_entries=None, ttl=None):
+        self._lock = threading.Lock()
+        # Ключ -> (момент истечения по time.monotonic, запись)
+        self._entries = OrderedDict()
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self.hits = 0
+        self.db_hits = 0
+        self.misses = 0
+        self.expirations = 0
+
+    @property
+    def max_entries(self):
+        return self._max_entries or getattr(settings, 'KB_EXACT_CACHE_SIZE', 10000)
+
+    @property
+    def ttl(self):
+        return self._ttl or getattr(settings, 'KB_EXACT_CACHE_TTL', 300)
+
+    @staticmethod
+    def _entry(item):
+        return {
+            'id': item.id,
+            'answer': item.answer,
+            'sources': item.sources or [],
+            'confidence': item.confidence_score,
+        }
+
+    def _put(self, key, entry):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, entry)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def lookup(self, question):
+        """
+        Поиск точного совпадения нормализованного вопроса.
+        Аргументы:
+            question (str): Исходный вопрос пользователя.
+        Возвращает:
+            dict: Словарь с ключами 'id', 'answer', 'sources', 'confidence' или None.
+        """
+        key = question_hash(question)
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None:
+                expires_at, entry = cached
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry
+                del self._entries[key]
+                self.expirations += 1
+        fields = ('id', 'answer', 'sources', 'confidence_score')
+        item = KnowledgeBase.objects.filter(question_hash=key).only(*fields).order_by('-confidence_score').first()
+        if item is None:
+            item = KnowledgeBase.objects.filter(question_hashes__question_hash=key).only(*fields).first()
+        if item is None:
+            self.misses += 1
+            return None
+        self.db_hits += 1
+        entry = self._entry(item)
+        self._put(key, entry)
+        return entry
+
+    def remember(self, item, question=None):
+        """
+        Запись или обновление элемента базы знаний в кеше после его сохранения.
+        Аргументы:
+            item (KnowledgeBase): Сохраненный элемент.
+            question (str): Исходный вопрос, по которому элемент должен находиться (опционально).
+        """
+        key = question_hash(question) if question else item.question_hash
+        if key:
+            self._put(key, self._entry(item))
+        # Ответ элемента мог измениться: обновляем и другие ключи, указывающие на него
+        with self._lock:
+            for other_key, (expires_at, entry) in self._entries.items():
+                if entry['id'] == item.id and other_key != key:
+                    self._entries[other_key] = (expires_at, self._entry(item))
+
+    def link(self, item, question):
+        """
+        Привязка вопроса к повторно использованному элементу базы знаний (найденному как похожий вопрос).
+        Хеш сохраняется в базе, чтобы точное совпадение находили все процессы и после перезапуска:
+        элемент без хеша получает его сам, для остальных записывается сопоставление KnowledgeBaseQuestion.
+        Аргументы:
+            item (KnowledgeBase): Сохраненный элемент.
+            question (str): Исходный вопрос пользователя.
+        """
+        key = question_hash(question)
+        if not key:
+            return
+        if key != item.question_hash:
+            try:
+                if not item.question_hash and KnowledgeBase.objects.filter(id=item.id, question_hash='').update(
+                    question_hash=key
+                ):
+                    item.question_hash = key
+                else:
+                    KnowledgeBaseQuestion.objects.update_or_create(question_hash=key, defaults={'knowledge_item': item})
+            except IntegrityError as e:
+                logger.warning(f"Не удалось сохранить хеш вопроса для элемента KnowledgeBase {item.id}: {str(e)}")
+        self.remember(item, question)
+
+    def forget(self, item_id):
+        """
+        Удаление всех записей кеша, указывающих на элемент базы знаний.
+        """
+        with self._lock:
+            for key in [key for key, (_, entry) in self._entries.items() if entry['id'] == item_id]:
+                del self._entries[key]
+
+    @staticmethod
+    def touch(item_id):
+        """
+        Обновление статистики использования элемента без загрузки его из базы.
+        """
+        KnowledgeBase.objects.filter(id=item_id).update(usage_count=F('usage_count') + 1, last_used=timezone.now())
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'db_hits': self.db_hits,
+            'misses': self.misses,
+            'expirations': self.expirations,
+        }
+
+
+# Общий кеш точных совпадений процесса
+exact_match_cache = ExactMatchCache()
@@ -0,0 +1,116 @@
+import logging
+import random
+from collections import Counter, defaultdict
+import httpx
+from django.conf import settings
+
+# Инициализация логирования
+logger = logging.getLogger(__name__)
+
+# Список User-Agent'ов: один выбирается на все время жизни сессии поисковой системы
+USER_AGENTS = [
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/125.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/125.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:127.0) Gecko/20100101 Firefox/127.0",
+]
+
+
+def http2_available():
+    """
+    Проверка наличия пакета h2, необходимого httpx для HTTP/2.
+    """
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+class SearchHTTPPool:
+    """
+    Долгоживущие пулы keep-alive соединений httpx.AsyncClient, по одному на поисковую систему.
+    Клиенты привязаны к циклу событий поиска (utils.get_search_loop) и используются только из него,
+    поэтому запросы из любых потоков переиспользуют одни и те же соединения.
+    """
+
+    def __init__(self):
+        self._clients = {}
+        self.requests = Counter()
+        self.new_connections = Counter()
+        self.http_versions = defaultdict(Counter)
+
+    @staticmethod
+    def _limits():
+        return httpx.Limits(
+            max_connections=getattr(settings, 'SEARCH_POOL_MAX_CONNECTIONS', 20),
+            max_keepalive_connections=getattr(settings, 'SEARCH_POOL_MAX_KEEPALIVE', 10),
+            keepalive_expiry=getattr(settings, 'SEARCH_POOL_KEEPALIVE_EXPIRY', 60),
+        )
+
+    def client(self, name):
+        """
+        Клиент поисковой системы, создаваемый при первом обращении.
+        Аргументы:
+            name (str): Имя поисковой системы.
+        Возвращает:
+            httpx.AsyncClient: Клиент с общим пулом соединений.
+        """
+        client = self._clients.get(name)
+        if client is None or client.is_closed:
+            http2 = getattr(settings, 'SEARCH_HTTP2', True)
+            if http2 and not http2_available():
+                logger.warning(f"SEARCH_HTTP2 включен, но пакет h2 не установлен: {name} использует HTTP/1.1")
+                http2 = False
+            client = httpx.AsyncClient(
+                headers={"User-Agent": random.choice(USER_AGENTS)},
+                timeout=httpx.Timeout(getattr(settings, 'SEARCH_ENGINE_TIMEOUT', 15)),
+                limits=self._limits(),
+                http2=http2,
+                follow_redirects=True,
+            )
+            self._clients[name] = client
+            logger.debug(f"Создан пул соединений для {name} (HTTP/2: {http2})")
+        return client
+
+    async def get(self, name, url, **kwargs):
+        """
+        GET-запрос через пул поисковой системы с учетом новых и переиспользованных соединений.
+        Аргументы:
+            name (str): Имя поисковой системы.
+            url (str): URL запроса.
+        Возвращает:
+            httpx.Response: Ответ сервера.
+        """
+        connected = False
+
+        async def trace(event_name, info):
+            nonlocal connected
+            if event_name == 'connection.connect_tcp.started':
+                connected = True
+
+        response = await self.client(name).get(url, extensions={'trace': trace}, **kwargs)
+        self.requests[name] += 1
+        if connected:
+            self.new_connections[name] += 1
+        self.http_versions[name][response.http_version] += 1
+        return response
+
+    async def aclose(self):
+        for client in self._clients.values():
+            await client.aclose()
+        self._clients.clear()
+
+    def stats(self):
+        return {
+            name: {
+                'requests': self.requests[name],
+                'new_connections': self.new_connections[name],
+                'reused_connections': self.requests[name] - self.new_connections[name],
+                'http_versions': dict(self.http_versions[name]),
+            }
+            for name in self.requests
+        }
+
+
+# Общие пулы соединений поисковых систем
+search_http_pool = SearchHTTPPool()
@@ -0,0 +1,155 @@
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from datetime import timedelta
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Q
+from django.utils import timezone
+from filelock import FileLock, Timeout
+from aichat.models import KnowledgeBase
+from .exact_match import exact_match_cache
+
+# Инициализация логирования
+logger = logging.getLogger(__name__)
+
+
+class KnowledgeRefresher:
+    """
+    Фоновое обновление ответов базы знаний, полученных из интернета (stale-while-revalidate).
+    Пользователи всегда получают сохраненный ответ сразу, а самые используемые ответы старше
+    KB_REFRESH_MAX_AGE обновляются повторным поиском вне обработки сообщений.
+    """
+
+    def __init__(self, response_handler):
+        """
+        Аргументы:
+            response_handler (ResponseHandler): Обработчик, выполняющий поиск и формирующий ответ.
+        """
+        self.response_handler = response_handler
+        self.counters = Counter()
+        self.last_run = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def stale_items(limit=None, max_age=None):
+        """
+        Самые используемые ответы из интернета, не обновлявшиеся дольше max_age.
+        Аргументы:
+            limit (int): Максимальное количество элементов (по умолчанию KB_REFRESH_BATCH).
+            max_age (int): Возраст ответа в секундах (по умолчанию KB_REFRESH_MAX_AGE).
+        Возвращает:
+            QuerySet: Элементы KnowledgeBase по убыванию использования.
+        """
+        limit = limit or getattr(settings, 'KB_REFRESH_BATCH', 20)
+        max_age = max_age or getattr(settings, 'KB_REFRESH_MAX_AGE', 7 * 24 * 3600)
+        cutoff = timezone.now() - timedelta(seconds=max_age)
+        return (
+            KnowledgeBase.objects.exclude(search_query='')
+            .filter(Q(refreshed_at__isnull=True) | Q(refreshed_at__lt=cutoff))
+            .order_by('-usage_count', '-last_used')
+            .only('id', 'search_query', 'question_hash', 'confidence_score')[:limit]
+        )
+
+    def refresh_item(self, item):
+        """
+        Обновление ответа элемента повторным поиском без кеша результатов.
+        При неудаче поиска сохраненный ответ остается без изменений.
+        Аргументы:
+            item (KnowledgeBase): Элемент базы знаний.
+        Возвращает:
+            bool: True, если ответ обновлен.
+        """
+        # Фоновое обновление не ограничено ожиданием пользователя: объединяются ответы всех поисковых систем
+        collected_data = self.response_handler.collect_data_via_parsing(item.search_query, refresh=True, policy='merge')
+        search_answer = self.response_handler.build_search_answer(collected_data)
+        if not search_answer:
+            self.counters['failed'] += 1
+            logger.warning(f"Не удалось обновить элемент KnowledgeBase {item.id}: нет результатов поиска")
+            return False
+        item.answer, item.sources = search_answer
+        item.refreshed_at = timezone.now()
+        # update() не изменяет last_used (auto_now) и счетчик использований
+        KnowledgeBase.objects.filter(id=item.id).update(
+            answer=item.answer, sources=item.sources, refreshed_at=item.refreshed_at
+        )
+        exact_match_cache.remember(item)
+        self.counters['refreshed'] += 1
+        logger.debug(f"Обновлен ответ элемента KnowledgeBase {item.id}")
+        return True
+
+    def refresh(self, limit=None, max_age=None):
+        """
+        Обновление устаревших ответов.
+        Возвращает:
+            int: Количество обновленных элементов.
+        """
+        refreshed = 0
+        for item in self.stale_items(limit, max_age):
+            try:
+                refreshed += self.refresh_item(item)
+            except Exception as e:
+                self.counters['failed'] += 1
+                logger.error(f"Ошибка обновления элемента KnowledgeBase {item.id}: {str(e)}")
+        self.last_run = timezone.now()
+        self.counters['runs'] += 1
+        return refreshed
+
+    def run_once(self, limit=None, max_age=None):
+        """
+        Одно обновление, выполняемое только одним процессом: остальные пропускают цикл.
+        Аргументы:
+            limit (int): Максимальное количество элементов (по умолчанию KB_REFRESH_BATCH).
+            max_age (int): Возраст ответа в секундах (по умолчанию KB_REFRESH_MAX_AGE).
+        Возвращает:
+            int: Количество обновленных элементов или None, если обновление выполняет другой процесс.
+        """
+        lock_dir = getattr(settings, 'SINGLE_FLIGHT_LOCK_DIR', None) or os.path.join(settings.BASE_DIR, 'data', 'locks')
+        os.makedirs(lock_dir, exist_ok=True)
+        lock = FileLock(os.path.join(lock_dir, 'knowledge_refresh.lock'))
+        try:
+            lock.acquire(timeout=0)
+        except Timeout:
+            self.counters['skipped'] += 1
+            return None
+        try:
+            return self.refresh(limit, max_age)
+        finally:
+            lock.release()
+
+    def start_scheduler(self, interval):
+        """
+        Запуск фонового потока периодического обновления.
+        Аргументы:
+            interval (float): Интервал в секундах; 0 отключает обновление.
+        """
+        if not interval or self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+
+            def run():
+                while True:
+                    time.sleep(interval)
+                    try:
+                        refreshed = self.run_once()
+                        if refreshed is not None:
+                            logger.debug(f"Фоновое обновление базы знаний: обновлено {refreshed} ответов")
+                    except Exception as e:
+                        logger.error(f"Ошибка фонового обновления базы знаний: {str(e)}")
+                    finally:
+                        close_old_connections()
+
+            self._thread = threading.Thread(target=run, name='knowledge-refresh', daemon=True)
+            self._thread.start()
+
+    def stats(self):
+        return {
+            'scheduler': self._thread is not None,
+            'last_run': self.last_run.isoformat() if self.last_run else None,
+            **self.counters,
+        }
@@ -1,8 +1,11 @@
 import logging
 from datetime import datetime
 from django.db import IntegrityError
+from django.utils import timezone
 from aichat.models import KnowledgeBase, Message
 from .nlp_processor import NLPProcessor
+from .exact_match import exact_match_cache
+from .utils import question_hash
 
 # Инициализация логирования
 logger = logging.getLogger(__name__)
@@ -19,7 +22,7 @@ class LearningModule:
             logger.error(f"Ошибка инициализации NLPProcessor в LearningModule: {str(e)}")
             raise
 
-    def update_knowledge_base(self, question, answer, sources=None, confidence=1.0):
+    def update_knowledge_base(self, question, answer, sources=None, confidence=1.0, context=None, search_query=''):
         """
         Обновление базы знаний новым парой вопрос-ответ.
         Аргументы:
@@ -27,34 +30,45 @@ class LearningModule:
             answer (str): Ответ для хранения.
             sources (list): Список источников (опционально).
             confidence (float): Уровень уверенности в ответе.
+            context (PipelineContext): Контекст обработки сообщения (опционально).
+            search_query (str): Поисковый запрос, если ответ получен из интернета (для фонового обновления).
         Возвращает:
             KnowledgeBase: Обновленный или новый элемент базы знаний, или None при ошибке.
         """
         logger.debug(f"Обновление базы знаний для вопроса: {question}")
         try:
-            processed_question = self.nlp_processor.preprocess_text(question)
+            processed_question = self.nlp_processor.preprocess_text(question, context=context)
             logger.debug(f"Обработанный вопрос: {processed_question}")
 
             # Проверка наличия похожего вопроса
-            similar_item = self.nlp_processor.find_similar_question(question, threshold=0.8)
-            if similar_item:
+            matches = self.nlp_processor.find_similar_question(question, threshold=0.8, context=context)
+            if matches:
+                similar_item = matches[0][0]
                 similar_item.usage_count += 1
                 similar_item.last_used = datetime.now()
                 if confidence > similar_item.confidence_score:
                     similar_item.answer = answer
                     similar_item.confidence_score = confidence
                     similar_item.sources = sources or []
+                    similar_item.search_query = search_query
+                    similar_item.refreshed_at = timezone.now() if search_query else None
                 similar_item.save()
+                exact_match_cache.link(similar_item, question)
                 logger.debug(f"Обновлен элемент KnowledgeBase: {similar_item.id}")
                 return similar_item
             else:
                 # Создание нового элемента базы знаний, если похожий вопрос не найден
                 new_item = KnowledgeBase.objects.create(
                     question_pattern=processed_question,
+                    question_hash=question_hash(question),
+                    search_query=search_query,
+                    refreshed_at=timezone.now() if search_query else None,
                     answer=answer,
                     sources=sources or [],
                     confidence_score=confidence
                 )
+                exact_match_cache.remember(new_item)
+                self.nlp_processor.index_knowledge_item(new_item)
                 logger.debug(f"Создан новый элемент KnowledgeBase: {new_item.id}")
                 return new_item
         except IntegrityError as e:
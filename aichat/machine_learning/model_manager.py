@@ -1,10 +1,19 @@
 import logging
+import threading
+import time
 from datetime import datetime
+from django.conf import settings
 from aichat.models import KnowledgeBase
 from .nlp_processor import NLPProcessor
 from .learning import LearningModule
 from .response_handler import ResponseHandler
-from .utils import search_internet
+from .exact_match import exact_match_cache
+from .knowledge_refresh import KnowledgeRefresher
+from .pipeline_context import PipelineContext, memoize
+from .registry import model_registry
+from .search_cache import negative_search_cache
+from .single_flight import answer_flight
+from .utils import is_placeholder_result, search_answered, search_internet, question_hash
 
 # Инициализация логирования
 logger = logging.getLogger(__name__)
@@ -21,6 +30,7 @@ class AIModelManager:
             self.nlp_processor = NLPProcessor(load_immediately=load_immediately)
             self.learning_module = LearningModule()
             self.response_handler = ResponseHandler()
+            self.knowledge_refresher = KnowledgeRefresher(self.response_handler)
         except Exception as e:
             logger.error(f"Ошибка инициализации AIModelManager: {str(e)}")
             raise
@@ -47,36 +57,99 @@ class AIModelManager:
                     'title': result.get('title', '')
                 }
                 for result in results
-                if 'snippet' in result and result['snippet']
+                if 'snippet' in result and result['snippet'] and not is_placeholder_result(result)
             ]
             logger.debug(f"Поиск в интернете вернул {len(answer_snippets)} выдержек")
             return {
                 'success': bool(answer_snippets),
                 'results': answer_snippets,
-                'raw_response': {'organic_results': results}
+                'raw_response': {'organic_results': results},
+                # False - ни один источник не ответил: отсутствие результатов не означает пустую выдачу
+                'answered': search_answered(results)
             }
         except Exception as e:
             logger.error(f"Поиск в интернете для запроса '{query}' завершился неудачей: {str(e)}")
             return {
                 'success': False,
                 'results': [],
-                'raw_response': {}
+                'raw_response': {},
+                'answered': False
             }
 
-    def generate_answer(self, question, conversation_id=None):
+    @staticmethod
+    def _exact_answer(exact):
+        """
+        Ответ из точного совпадения в базе знаний.
+        """
+        exact_match_cache.touch(exact['id'])
+        logger.debug(f"Найден точный ответ в базе знаний: {exact['id']}")
+        return {
+            'success': True,
+            'answer': exact['answer'],
+            'sources': exact['sources'],
+            'confidence': exact['confidence'],
+            'source': 'knowledge_base'
+        }
+
+    def _recheck_exact_answer(self, question):
+        """
+        Повторная проверка базы знаний без кешей контекста: ответ мог быть сохранен другим процессом.
+        """
+        exact = exact_match_cache.lookup(question)
+        return self._exact_answer(exact) if exact else None
+
+    @staticmethod
+    def _no_answer(question):
+        """
+        Ответ при отсутствии результатов поиска.
+        """
+        # Предоставление более конкретного ответа для неконкретных запросов
+        if question.lower() in ["что нового?", "что нового"]:
+            return {
+                'success': True,
+                'answer': "Пожалуйста, уточните, что именно вы хотите узнать о новостях. Например, новости в Москве или новости технологий?",
+                'sources': [],
+                'confidence': 0.0,
+                'source': 'no_answer'
+            }
+        return {
+            'success': True,
+            'answer': f"Не удалось найти информацию по запросу '{question}'. Попробуйте уточнить.",
+            'sources': [],
+            'confidence': 0.0,
+            'source': 'no_answer'
+        }
+
+    def generate_answer(self, question, conversation_id=None, context=None):
         """
         Генерация ответа на заданный вопрос.
+        Одновременные запросы с одинаковым нормализованным вопросом ждут одну генерацию и получают ее ответ.
         Аргументы:
             question (str): Вопрос пользователя.
             conversation_id (int): ID беседы (опционально).
+            context (PipelineContext): Контекст обработки сообщения (опционально).
         Возвращает:
             dict: Словарь с статусом успеха, ответом, источниками, уверенностью и типом источника.
         """
         logger.debug(f"Генерация ответа на вопрос '{question}' в беседе {conversation_id}")
+        return answer_flight.do(
+            question_hash(question),
+            lambda: self._generate_answer(question, conversation_id, context),
+            recheck=lambda: self._recheck_exact_answer(question)
+        )
+
+    def _generate_answer(self, question, conversation_id=None, context=None):
         try:
-            # Сначала проверяем базу знаний на наличие похожего вопроса
-            knowledge_item = self.nlp_processor.find_similar_question(question)
-            if knowledge_item:
+            # Точное совпадение нормализованного вопроса проверяется до любой обработки NLP
+            exact = memoize(context, 'exact', question, lambda: exact_match_cache.lookup(question))
+            if exact:
+                return self._exact_answer(exact)
+
+            # Затем проверяем базу знаний на наличие похожего вопроса
+            matches = self.nlp_processor.find_similar_question(question, context=context)
+            if matches:
+                knowledge_item, similarity, stage = matches[0]
+                logger.debug(f"Похожий вопрос найден на стадии '{stage}' (схожесть: {similarity})")
                 knowledge_item.usage_count += 1
                 knowledge_item.last_used = datetime.now()
                 knowledge_item.save()
@@ -89,26 +162,20 @@ class AIModelManager:
                     'source': 'knowledge_base'
                 }
 
+            # Поиск по вопросу недавно не дал результатов: повторный поиск не выполняется
+            negative_key = question_hash(question)
+            if negative_search_cache.get(negative_key) is not None:
+                logger.debug(f"Поиск для вопроса '{question}' пропущен: недавно не дал результатов")
+                return self._no_answer(question)
+
             # Если ответа в базе знаний нет, выполняем поиск в интернете
             search_result = self.search_internet(question)
             if not search_result['success']:
                 logger.warning(f"Нет результатов поиска для вопроса '{question}'")
-                # Предоставление более конкретного ответа для неконкретных запросов
-                if question.lower() in ["что нового?", "что нового"]:
-                    return {
-                        'success': True,
-                        'answer': "Пожалуйста, уточните, что именно вы хотите узнать о новостях. Например, новости в Москве или новости технологий?",
-                        'sources': [],
-                        'confidence': 0.0,
-                        'source': 'no_answer'
-                    }
-                return {
-                    'success': True,
-                    'answer': f"Не удалось найти информацию по запросу '{question}'. Попробуйте уточнить.",
-                    'sources': [],
-                    'confidence': 0.0,
-                    'source': 'no_answer'
-                }
+                # Запрос запоминается только при пустой выдаче: недоступность поиска не кешируется
+                if search_result['answered']:
+                    negative_search_cache.set(negative_key, True)
+                return self._no_answer(question)
 
             # Обработка результатов поиска, если они есть
             if search_result['results']:
@@ -119,7 +186,9 @@ class AIModelManager:
                         question=question,
                         answer=answer,
                         sources=sources,
-                        confidence=0.8
+                        confidence=0.8,
+                        context=context,
+                        search_query=question
                     )
                 logger.debug(f"Сгенерирован ответ из поиска: {answer}")
                 return {
@@ -159,6 +228,7 @@ class AIModelManager:
             dict: Словарь с статусом успеха, ответом, источниками и уверенностью.
         """
         logger.debug(f"Обработка сообщения '{message_text}' для пользователя {user.id}, беседа {conversation_id}")
+        context = None
         try:
             # Валидация сообщения
             if not message_text or not isinstance(message_text, str):
@@ -168,14 +238,17 @@ class AIModelManager:
             if len(message_text) < 2:
                 raise ValueError("Сообщение слишком короткое")
 
+            # Один контекст на сообщение: лемматизация, векторы и поиск похожих вопросов выполняются один раз
+            context = PipelineContext(message_text)
+
             # Сначала пробуем обработчик ответа
-            handler_response = self.response_handler.process_input(message_text, conversation_id, user)
+            handler_response = self.response_handler.process_input(message_text, conversation_id, user, context=context)
             if handler_response.get('success'):
                 logger.debug(f"Ответ от ResponseHandler: {handler_response['answer']}")
                 return handler_response
 
             # Если обработчик ответа не сработал, генерируем ответ с помощью модели ИИ
-            ai_response = self.generate_answer(message_text, conversation_id)
+            ai_response = self.generate_answer(message_text, conversation_id, context=context)
             if not ai_response.get('success'):
                 raise ValueError(ai_response.get('error', 'Ошибка генерации ответа'))
 
@@ -192,4 +265,128 @@ class AIModelManager:
                 'error': str(e),
                 'answer': "Извините, произошла ошибка. Пожалуйста, попробуйте позже.",
                 'sources': []
-            }
\ No newline at end of file
+            }
+        finally:
+            if context is not None:
+                logger.debug(f"Статистика контекста сообщения: {context.stats()}")
+                model_registry.record_pipeline(context)
+
+    async def astream_message(self, message_text, user, conversation_id=None):
+        """
+        Асинхронная обработка сообщения с промежуточными результатами для потоковой выдачи ответа.
+        Ожидание поиска в интернете не занимает поток, вычисления моделей выполняются
+        в ограниченном пуле потоков реестра моделей.
+        Аргументы:
+            message_text (str): Сообщение пользователя.
+            user: Объект пользователя.
+            conversation_id (int): ID беседы (опционально).
+        Возвращает:
+            async generator: События ResponseHandler.astream_input ('status', 'partial')
+                и последнее {'type': 'final', 'result': результат как у process_message}.
+        """
+        logger.debug(f"Обработка сообщения '{message_text}' для пользователя {user.id}, беседа {conversation_id}")
+        started = time.perf_counter()
+        first_content = None
+        partials = 0
+        context = None
+        try:
+            # Валидация сообщения
+            if not message_text or not isinstance(message_text, str):
+                raise ValueError("Неверный формат сообщения")
+
+            message_text = message_text.strip()
+            if len(message_text) < 2:
+                raise ValueError("Сообщение слишком короткое")
+
+            context = PipelineContext(message_text)
+
+            handler_response = None
+            async for event in self.response_handler.astream_input(message_text, conversation_id, user, context=context):
+                if event['type'] == 'final':
+                    handler_response = event['result']
+                    continue
+                if event['type'] == 'partial':
+                    partials += 1
+                    if first_content is None:
+                        first_content = time.perf_counter() - started
+                yield event
+            if handler_response.get('success'):
+                logger.debug(f"Ответ от ResponseHandler: {handler_response['answer']}")
+                result = handler_response
+            else:
+                ai_response = await model_registry.run_inference(
+                    self.generate_answer, message_text, conversation_id, context=context
+                )
+                if not ai_response.get('success'):
+                    raise ValueError(ai_response.get('error', 'Ошибка генерации ответа'))
+                result = {
+                    'success': True,
+                    'answer': ai_response.get('answer', ''),
+                    'sources': ai_response.get('sources', []),
+                    'confidence': ai_response.get('confidence', 0.0)
+                }
+        except Exception as e:
+            logger.error(f"Ошибка обработки сообщения '{message_text}': {str(e)}")
+            result = {
+                'success': False,
+                'error': str(e),
+                'answer': "Извините, произошла ошибка. Пожалуйста, попробуйте позже.",
+                'sources': []
+            }
+        finally:
+            if context is not None:
+                logger.debug(f"Статистика контекста сообщения: {context.stats()}")
+                model_registry.record_pipeline(context)
+        total = time.perf_counter() - started
+        model_registry.record_first_content(first_content if first_content is not None else total, total, partials)
+        yield {'type': 'final', 'result': result}
+
+    async def aprocess_message(self, message_text, user, conversation_id=None):
+        """
+        Асинхронная обработка сообщения пользователя для ASGI представлений.
+        Результат совпадает с process_message.
+        Аргументы:
+            message_text (str): Сообщение пользователя.
+            user: Объект пользователя.
+            conversation_id (int): ID беседы (опционально).
+        Возвращает:
+            dict: Словарь с статусом успеха, ответом, источниками и уверенностью.
+        """
+        result = None
+        async for event in self.astream_message(message_text, user, conversation_id):
+            if event['type'] == 'final':
+                result = event['result']
+        return result
+
+
+_shared_manager = None
+_shared_manager_lock = threading.Lock()
+
+
+def get_ai_manager():
+    """
+    Получение общего для процесса менеджера модели ИИ.
+    Представления и Telegram бот используют один экземпляр вместо создания нового на каждый запрос.
+    Возвращает:
+        AIModelManager: Общий экземпляр менеджера.
+    """
+    global _shared_manager
+    if _shared_manager is None:
+        with _shared_manager_lock:
+            if _shared_manager is None:
+                _shared_manager = AIModelManager()
+                # Популярные ответы из интернета обновляются в фоне, не задерживая ответы пользователям
+                _shared_manager.knowledge_refresher.start_scheduler(getattr(settings, 'KB_REFRESH_INTERVAL', 0))
+    return _shared_manager
+
+
+async def aget_ai_manager():
+    """
+    Получение общего менеджера модели ИИ из асинхронного кода.
+    Первое создание менеджера обращается к базе знаний и выполняется в пуле потоков моделей.
+    Возвращает:
+        AIModelManager: Общий экземпляр менеджера.
+    """
+    if _shared_manager is not None:
+        return _shared_manager
+    return await model_registry.run_inference(get_ai_manager)
@@ -1,176 +1,268 @@
 import logging
 import numpy as np
-import spacy
-import torch
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-from transformers import BertTokenizer, BertModel
+from django.conf import settings
 from aichat.models import KnowledgeBase
+from .embedding_store import embedding_store, embedding_to_bytes
+from .registry import model_registry
+from .pipeline_context import memoize
 
 # Инициализация логирования
 logger = logging.getLogger(__name__)
 
-# Загрузка модели spaCy для русского текста с обработкой ошибок
-try:
-    logger.debug("Загрузка модели spaCy 'ru_core_news_sm'")
-    nlp = spacy.load('ru_core_news_sm')
-except Exception as e:
-    logger.error(f"Ошибка загрузки модели spaCy 'ru_core_news_sm': {str(e)}")
-    nlp = None
-
 class NLPProcessor:
     def __init__(self, load_immediately=True):
         """
         Инициализация процессора обработки текста с моделями TF-IDF и BERT.
+        Модели берутся из общего реестра процесса и не загружаются повторно.
         Аргументы:
             load_immediately (bool): Загружать модели сразу или нет.
         """
         logger.debug("Инициализация NLPProcessor")
-        self.tfidf_vectorizer = TfidfVectorizer()
-        try:
-            logger.debug("Загрузка модели BERT 'bert-base-multilingual-cased'")
-            self.bert_tokenizer = BertTokenizer.from_pretrained('bert-base-multilingual-cased')
-            self.bert_model = BertModel.from_pretrained('bert-base-multilingual-cased')
-        except Exception as e:
-            logger.error(f"Ошибка загрузки модели BERT: {str(e)}")
-            self.bert_tokenizer = None
-            self.bert_model = None
-        if load_immediately:
+        self.registry = model_registry
+        if load_immediately and not self.registry.tfidf_fitted:
             self._init_tfidf()
 
+    @property
+    def tfidf_vectorizer(self):
+        return self.registry.tfidf_vectorizer
+
+    @property
+    def bert_tokenizer(self):
+        return self.registry.bert_tokenizer
+
+    @property
+    def bert_model(self):
+        return self.registry.bert_model
+
     def _init_tfidf(self):
         """
         Инициализация векторайзера TF-IDF на основе вопросов из базы знаний.
         """
-        try:
-            logger.debug("Инициализация TF-IDF векторайзера")
-            questions = list(KnowledgeBase.objects.values_list('question_pattern', flat=True))
-            if questions:
-                self.tfidf_vectorizer.fit(questions)
-                logger.debug(f"Векторайзер TF-IDF инициализирован с {len(questions)} вопросами")
-            else:
-                logger.warning("Вопросы в KnowledgeBase для инициализации TF-IDF не найдены")
-                self.tfidf_vectorizer.fit([""])
-        except Exception as e:
-            logger.error(f"Ошибка инициализации векторайзера TF-IDF: {str(e)}")
-            self.tfidf_vectorizer.fit([""])
+        logger.debug("Инициализация TF-IDF векторайзера")
+        self.registry.fit_tfidf()
 
-    def preprocess_text(self, text):
+    def preprocess_text(self, text, context=None):
         """
         Предварительная обработка текста с токенизацией, лемматизацией и удалением стоп-слов и пунктуации.
         Аргументы:
             text (str): Текст для обработки.
+            context (PipelineContext): Контекст сообщения для повторного использования результата (опционально).
         Возвращает:
             str: Обработанный текст.
         """
+        return memoize(context, 'lemmas', text, lambda: self._preprocess_text(text))
+
+    def _preprocess_text(self, text):
         try:
-            if nlp is None:
-                logger.warning("Модель spaCy не загружена, используется простая обработка текста")
+            preprocessor = self.registry.preprocessor
+            if preprocessor is None:
+                logger.warning("Движок предобработки не загружен, используется простая обработка текста")
                 return text.lower()
-            doc = nlp(text.lower())
-            tokens = [token.lemma_ for token in doc if not token.is_stop and not token.is_punct]
-            return ' '.join(tokens)
+            return preprocessor.preprocess(text)
         except Exception as e:
             logger.error(f"Ошибка обработки текста '{text}': {str(e)}")
             return text.lower()
 
-    def get_tfidf_embedding(self, text):
+    def get_tfidf_embedding(self, text, context=None):
         """
         Получение вложения TF-IDF для заданного текста.
         Аргументы:
-            text (str): Текст для вложения.
+            text (str): Исходный текст для вложения; обрабатывается через preprocess_text.
+            context (PipelineContext): Контекст сообщения для повторного использования результата (опционально).
         Возвращает:
             sparse matrix: Вложение TF-IDF.
         """
+        processed_text = self.preprocess_text(text, context=context)
+        return memoize(context, 'tfidf', processed_text, lambda: self._get_tfidf_embedding(processed_text))
+
+    def _get_tfidf_embedding(self, processed_text):
         try:
-            processed_text = self.preprocess_text(text)
-            return self.tfidf_vectorizer.transform([processed_text])
+            return self.registry.tfidf_index.transform(processed_text)
         except ValueError as e:
-            logger.error(f"Ошибка получения вложения TF-IDF для текста '{text}': {str(e)}")
+            logger.error(f"Ошибка получения вложения TF-IDF для текста '{processed_text}': {str(e)}")
             self._init_tfidf()  # Повторная инициализация при ошибке
-            return self.tfidf_vectorizer.transform([processed_text])
+            return self.registry.tfidf_index.transform(processed_text)
         except Exception as e:
-            logger.error(f"Ошибка получения вложения TF-IDF для текста '{text}': {str(e)}")
+            logger.error(f"Ошибка получения вложения TF-IDF для текста '{processed_text}': {str(e)}")
             return None
 
-    def get_bert_embedding(self, text):
+    def get_bert_embedding(self, text, context=None):
         """
         Получение вложения BERT для заданного текста.
+        Текст проходит через общий сервис микро-батчинга вместе с текстами параллельных запросов.
         Аргументы:
             text (str): Текст для вложения.
+            context (PipelineContext): Контекст сообщения для повторного использования результата (опционально).
         Возвращает:
             numpy array: Вложение BERT.
         """
+        return memoize(context, 'bert', text, lambda: self._get_bert_embedding(text))
+
+    def _get_bert_embedding(self, text):
         try:
-            if self.bert_tokenizer is None or self.bert_model is None:
+            embedding_service = self.registry.embedding_service
+            if embedding_service is None:
                 logger.warning("Модель BERT не загружена, вложение BERT недоступно")
                 return None
-            inputs = self.bert_tokenizer(text, return_tensors='pt', truncation=True, max_length=512)
-            with torch.no_grad():
-                outputs = self.bert_model(**inputs)
-            return outputs.last_hidden_state.mean(dim=1).squeeze().numpy()
+            return embedding_service.embed(text)
         except Exception as e:
             logger.error(f"Ошибка получения вложения BERT для текста '{text}': {str(e)}")
             return None
 
-    def find_similar_question(self, query, threshold=0.7):
+    def get_bert_embeddings(self, texts):
+        """
+        Получение вложений BERT для списка текстов батчами.
+        Аргументы:
+            texts (list): Список текстов.
+        Возвращает:
+            list: Список numpy array вложений или None для текстов, которые не удалось обработать.
+        """
+        embedding_service = self.registry.embedding_service
+        if embedding_service is None:
+            logger.warning("Модель BERT не загружена, вложения BERT недоступны")
+            return [None] * len(texts)
+        futures = [embedding_service.submit(text) for text in texts]
+        embeddings = []
+        for text, future in zip(texts, futures):
+            try:
+                embeddings.append(future.result())
+            except Exception as e:
+                logger.error(f"Ошибка получения вложения BERT для текста '{text}': {str(e)}")
+                embeddings.append(None)
+        return embeddings
+
+    def _load_ranked_items(self, scored_ids, stage):
         """
-        Поиск похожего вопроса в базе знаний с использованием вложений TF-IDF и BERT.
+        Загрузка элементов базы знаний для ранжированного списка (id, схожесть) с сохранением порядка.
+        Элементы, удаленные из базы в обход модуля обучения, убираются из индексов.
+        """
+        items = KnowledgeBase.objects.defer('question_embedding').in_bulk([item_id for item_id, _ in scored_ids])
+        ranked = []
+        for item_id, score in scored_ids:
+            item = items.get(item_id)
+            if item is None:
+                self.registry.tfidf_index.remove(item_id)
+                embedding_store.remove(item_id)
+                continue
+            ranked.append((item, score, stage))
+        if ranked:
+            self.registry.retrieval_stages[stage] += 1
+        return ranked
+
+    def find_similar_question(self, query, threshold=0.7, top_k=None, bert_threshold=None, limit=None,
+                              context=None):
+        """
+        Каскадный поиск похожих вопросов в базе знаний.
+        Стадия 1: TF-IDF индекс отбирает top_k кандидатов; если схожесть лучших не ниже threshold,
+        поиск завершается без BERT. Стадия 2: только отобранные кандидаты переранжируются
+        по вложениям BERT. Стадия 3 (KB_DENSE_FALLBACK, по умолчанию выключена): если кандидаты не подошли,
+        выполняется поиск по всем вложениям (IVF индекс на больших базах).
         Аргументы:
             query (str): Запрос для поиска.
-            threshold (float): Порог схожести.
+            threshold (float): Порог схожести TF-IDF для раннего выхода.
+            top_k (int): Размер списка кандидатов TF-IDF (по умолчанию KB_TFIDF_TOP_K).
+            bert_threshold (float): Порог схожести BERT (по умолчанию KB_BERT_THRESHOLD или threshold).
+            limit (int): Максимальное количество результатов (по умолчанию KB_RESULTS_LIMIT).
+            context (PipelineContext): Контекст сообщения для повторного использования результатов (опционально).
         Возвращает:
-            KnowledgeBase: Самый похожий элемент базы знаний или None, если не найден.
+            list: Список кортежей (KnowledgeBase, схожесть, стадия) по убыванию схожести;
+                стадия - 'tfidf', 'bert_rerank' или 'bert'. Пустой список, если ничего не найдено.
         """
+        top_k = top_k or getattr(settings, 'KB_TFIDF_TOP_K', 20)
+        limit = limit or getattr(settings, 'KB_RESULTS_LIMIT', 5)
+        if bert_threshold is None:
+            bert_threshold = getattr(settings, 'KB_BERT_THRESHOLD', None)
+        if bert_threshold is None:
+            bert_threshold = threshold
+        return memoize(
+            context, 'matches', (query, threshold, top_k, bert_threshold, limit),
+            lambda: self._find_similar_question(query, threshold, top_k, bert_threshold, limit, context)
+        )
+
+    def _find_similar_question(self, query, threshold, top_k, bert_threshold, limit, context):
         try:
             logger.debug(f"Поиск похожего вопроса для запроса: {query}")
-            processed_query = self.preprocess_text(query)
-            knowledge_items = KnowledgeBase.objects.all()
-            if not knowledge_items:
+            processed_query = self.preprocess_text(query, context=context)
+            tfidf_index = self.registry.tfidf_index
+            if not self.registry.tfidf_fitted:
+                self._init_tfidf()
+            if not len(tfidf_index):
                 logger.debug("База знаний пуста")
-                return None
+                return []
 
-            questions = [item.question_pattern for item in knowledge_items]
-
-            # Использование TF-IDF для начальной фильтрации
-            query_vec = self.get_tfidf_embedding(processed_query)
+            # Стадия 1: список кандидатов TF-IDF одним скалярным произведением с матрицей индекса
+            query_vec = self.get_tfidf_embedding(query, context=context)
             if query_vec is None:
                 logger.warning("Не удалось получить TF-IDF вложение для запроса")
-                return None
+                return []
 
-            question_vecs = self.tfidf_vectorizer.transform(questions)
-            similarities = cosine_similarity(query_vec, question_vecs).flatten()
-            max_idx = np.argmax(similarities)
-            max_similarity = similarities[max_idx]
+            candidates = tfidf_index.search(processed_query, k=top_k, query_vec=query_vec)
+            accepted = [(item_id, score) for item_id, score in candidates if score >= threshold]
+            if accepted:
+                ranked = self._load_ranked_items(accepted[:limit], 'tfidf')
+                if ranked:
+                    logger.debug(f"Найден похожий вопрос с помощью TF-IDF: {ranked[0][0].question_pattern} (схожесть: {ranked[0][1]})")
+                    return ranked
 
-            # Если схожесть TF-IDF выше порога, возвращаем элемент
-            if max_similarity >= threshold:
-                logger.debug(f"Найден похожий вопрос с помощью TF-IDF: {questions[max_idx]} (схожесть: {max_similarity})")
-                return knowledge_items[max_idx]
-
-            # Если TF-IDF не сработал, пробуем вложения BERT
-            query_embedding = self.get_bert_embedding(query)
+            query_embedding = self.get_bert_embedding(query, context=context)
             if query_embedding is None:
                 logger.warning("Не удалось получить BERT вложение для запроса")
-                return None
+                return []
+            query_embedding = np.asarray(query_embedding, dtype=np.float32)
+            query_embedding = query_embedding / (np.linalg.norm(query_embedding) or 1.0)
+            embedding_store.ensure_loaded(self)
 
-            max_similarity = 0
-            best_item = None
-            for idx, item in enumerate(knowledge_items):
-                item_embedding = self.get_bert_embedding(item.question_pattern)
-                if item_embedding is None:
-                    continue
-                similarity = cosine_similarity([query_embedding], [item_embedding])[0][0]
-                if similarity > max_similarity and similarity >= threshold:
-                    max_similarity = similarity
-                    best_item = item
-
-            if best_item:
-                logger.debug(f"Найден похожий вопрос с помощью BERT: {best_item.question_pattern} (схожесть: {max_similarity})")
-                return best_item
+            # Стадия 2: переранжирование BERT только для кандидатов с общими словами
+            shortlist = [item_id for item_id, score in candidates if score > 0]
+            reranked = []
+            for item_id in shortlist:
+                item_embedding = embedding_store.get(item_id)
+                if item_embedding is not None:
+                    reranked.append((item_id, float(item_embedding @ query_embedding)))
+            reranked = sorted(
+                [(item_id, score) for item_id, score in reranked if score >= bert_threshold],
+                key=lambda pair: pair[1], reverse=True
+            )
+            if reranked:
+                ranked = self._load_ranked_items(reranked[:limit], 'bert_rerank')
+                if ranked:
+                    logger.debug(f"Найден похожий вопрос с помощью BERT среди кандидатов TF-IDF: {ranked[0][0].question_pattern} (схожесть: {ranked[0][1]})")
+                    return ranked
+
+            # Стадия 3: поиск по всем вложениям, если кандидаты TF-IDF не подошли
+            if getattr(settings, 'KB_DENSE_FALLBACK', False):
+                matches = [
+                    (item_id, score) for item_id, score in embedding_store.search(query_embedding, k=limit)
+                    if score >= bert_threshold
+                ]
+                if matches:
+                    ranked = self._load_ranked_items(matches, 'bert')
+                    if ranked:
+                        logger.debug(f"Найден похожий вопрос с помощью BERT: {ranked[0][0].question_pattern} (схожесть: {ranked[0][1]})")
+                        return ranked
 
             logger.debug(f"Похожий вопрос для запроса: {query} не найден")
-            return None
+            return []
         except Exception as e:
             logger.error(f"Ошибка в find_similar_question для запроса '{query}': {str(e)}")
-            return None
\ No newline at end of file
+            return []
+
+    def index_knowledge_item(self, item):
+        """
+        Индексация элемента базы знаний: добавление в TF-IDF индекс, вычисление и сохранение вложения BERT.
+        Вызывается при записи элемента, чтобы поиск не кодировал вопросы базы знаний повторно.
+        Аргументы:
+            item (KnowledgeBase): Новый или обновленный элемент базы знаний.
+        """
+        try:
+            self.registry.tfidf_index.add(item.id, item.question_pattern)
+            embedding = self.get_bert_embedding(item.question_pattern)
+            if embedding is None:
+                logger.warning(f"Не удалось вычислить вложение BERT для элемента KnowledgeBase {item.id}")
+                return
+            item.question_embedding = embedding_to_bytes(embedding)
+            KnowledgeBase.objects.filter(id=item.id).update(question_embedding=item.question_embedding)
+            embedding_store.add(item.id, embedding)
+            logger.debug(f"Сохранено вложение BERT для элемента KnowledgeBase {item.id}")
+        except Exception as e:
+            logger.error(f"Ошибка сохранения вложения BERT для элемента KnowledgeBase {item.id}: {str(e)}")
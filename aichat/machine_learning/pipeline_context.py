@@ -0,0 +1,64 @@
+from collections import Counter
+
+
+class PipelineContext:
+    """
+    Контекст обработки одного сообщения.
+    Передается через ResponseHandler, AIModelManager и LearningModule и запоминает
+    лемматизированный текст, векторы TF-IDF и BERT, точные совпадения и результаты поиска похожих вопросов,
+    чтобы каждое из них вычислялось не более одного раза за сообщение.
+    """
+
+    def __init__(self, message_text=None):
+        """
+        Аргументы:
+            message_text (str): Текст обрабатываемого сообщения (для логирования).
+        """
+        self.message_text = message_text
+        self._values = {}
+        self.computed = Counter()
+        self.reused = Counter()
+
+    def memoize(self, kind, key, compute):
+        """
+        Возвращает сохраненное значение или вычисляет и сохраняет его.
+        Аргументы:
+            kind (str): Вид значения ('lemmas', 'tfidf', 'bert', 'exact', 'matches').
+            key: Хешируемый ключ значения внутри вида.
+            compute (callable): Функция вычисления значения без аргументов.
+        Возвращает:
+            Значение, возвращенное compute при первом вызове.
+        """
+        cache_key = (kind, key)
+        if cache_key in self._values:
+            self.reused[kind] += 1
+            return self._values[cache_key]
+        value = compute()
+        self._values[cache_key] = value
+        self.computed[kind] += 1
+        return value
+
+    @property
+    def avoided_recomputations(self):
+        return sum(self.reused.values())
+
+    def stats(self):
+        """
+        Статистика вычислений контекста.
+        Возвращает:
+            dict: Количество вычисленных и повторно использованных значений по видам.
+        """
+        return {
+            'computed': dict(self.computed),
+            'reused': dict(self.reused),
+            'avoided_recomputations': self.avoided_recomputations,
+        }
+
+
+def memoize(context, kind, key, compute):
+    """
+    Вычисление значения через контекст, если он передан, иначе напрямую.
+    """
+    if context is None:
+        return compute()
+    return context.memoize(kind, key, compute)
@@ -0,0 +1,188 @@
+import json
+import logging
+import os
+import time
+from collections import Counter, defaultdict
+from django.conf import settings
+from filelock import FileLock
+
+# Инициализация логирования
+logger = logging.getLogger(__name__)
+
+CIRCUIT_CLOSED = 'closed'
+CIRCUIT_OPEN = 'open'
+CIRCUIT_HALF_OPEN = 'half_open'
+
+# Бюджет запросов по умолчанию: запросов в секунду и допустимая пачка запросов
+DEFAULT_RATE_LIMIT = {'rate': 0.5, 'burst': 5}
+
+
+class EngineRateLimiter:
+    """
+    Ограничение частоты запросов к поисковым системам и автоматический выключатель.
+    Состояние каждой системы (корзина токенов и выключатель) хранится в JSON файле
+    под межпроцессной блокировкой, поэтому бюджет соблюдается всеми потоками и воркерами.
+    Запрос ждет только тогда, когда бюджет действительно исчерпан.
+    """
+
+    def __init__(self, state_dir=None):
+        """
+        Аргументы:
+            state_dir (str): Каталог файлов состояния (по умолчанию SEARCH_RATE_LIMIT_DIR).
+        """
+        self._state_dir = state_dir
+        self.counters = defaultdict(Counter)
+
+    @property
+    def state_dir(self):
+        return (
+            self._state_dir
+            or getattr(settings, 'SEARCH_RATE_LIMIT_DIR', None)
+            or os.path.join(settings.BASE_DIR, 'data', 'rate_limit')
+        )
+
+    @staticmethod
+    def limits(engine):
+        """
+        Бюджет и параметры выключателя поисковой системы из SEARCH_RATE_LIMITS.
+        """
+        limits = dict(DEFAULT_RATE_LIMIT)
+        limits.update(getattr(settings, 'SEARCH_RATE_LIMITS', {}).get(engine, {}))
+        return limits
+
+    def _path(self, engine):
+        return os.path.join(self.state_dir, f'{engine}.json')
+
+    def _update(self, engine, change):
+        """
+        Атомарное чтение, изменение и запись состояния поисковой системы.
+        Аргументы:
+            engine (str): Имя поисковой системы.
+            change (callable): Функция (state, now) -> результат, изменяющая state на месте.
+        Возвращает:
+            Результат change.
+        """
+        os.makedirs(self.state_dir, exist_ok=True)
+        path = self._path(engine)
+        with FileLock(f'{path}.lock', timeout=5):
+            try:
+                with open(path, encoding='utf-8') as f:
+                    state = json.load(f)
+            except (FileNotFoundError, ValueError):
+                state = {}
+            now = time.time()
+            state.setdefault('tokens', float(self.limits(engine)['burst']))
+            state.setdefault('updated_at', now)
+            state.setdefault('circuit', CIRCUIT_CLOSED)
+            state.setdefault('failures', 0)
+            state.setdefault('opened_at', 0)
+            state.setdefault('probe_until', 0)
+            result = change(state, now)
+            tmp_path = f'{path}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(state, f)
+            os.replace(tmp_path, path)
+        return result
+
+    def acquire(self, engine, max_wait):
+        """
+        Резервирование запроса к поисковой системе.
+        Аргументы:
+            engine (str): Имя поисковой системы.
+            max_wait (float): Максимальное допустимое ожидание токена в секундах.
+        Возвращает:
+            float: Время ожидания перед запросом в секундах или None, если запрос выполнять нельзя
+                (выключатель разомкнут или бюджет не восстановится за max_wait).
+        """
+        limits = self.limits(engine)
+
+        def change(state, now):
+            if state['circuit'] == CIRCUIT_OPEN:
+                if now - state['opened_at'] < limits.get('cooldown', 60):
+                    return 'open'
+                state['circuit'] = CIRCUIT_HALF_OPEN
+            if state['circuit'] == CIRCUIT_HALF_OPEN:
+                # В полуоткрытом состоянии пропускается один пробный запрос за раз
+                if state['probe_until'] > now:
+                    return 'open'
+                state['probe_until'] = now + limits.get('probe_timeout', 15)
+            tokens = min(limits['burst'], state['tokens'] + (now - state['updated_at']) * limits['rate'])
+            wait = 0.0 if tokens >= 1 else (1 - tokens) / limits['rate']
+            state['updated_at'] = now
+            if wait > max_wait:
+                state['tokens'] = tokens
+                if state['circuit'] == CIRCUIT_HALF_OPEN:
+                    state['probe_until'] = 0
+                return 'budget'
+            # Токен резервируется сразу, ожидание выполняет вызывающий код
+            state['tokens'] = tokens - 1
+            return wait
+
+        result = self._update(engine, change)
+        if result == 'open':
+            self.counters[engine]['rejected_open'] += 1
+            logger.debug(f"Выключатель {engine} разомкнут, запрос пропущен")
+            return None
+        if result == 'budget':
+            self.counters[engine]['rejected_budget'] += 1
+            logger.debug(f"Бюджет запросов {engine} исчерпан, запрос пропущен")
+            return None
+        self.counters[engine]['allowed'] += 1
+        if result:
+            self.counters[engine]['delayed'] += 1
+        return result
+
+    def record_success(self, engine):
+        """
+        Успешный ответ поисковой системы: выключатель замыкается.
+        """
+        def change(state, now):
+            state['circuit'] = CIRCUIT_CLOSED
+            state['failures'] = 0
+            state['probe_until'] = 0
+
+        self._update(engine, change)
+        self.counters[engine]['successes'] += 1
+
+    def release_probe(self, engine):
+        """
+        Запрос завершился без оценки системы (отменен после ответа другой системы, ошибка запроса или разбора):
+        пробный запрос полуоткрытого выключателя освобождается, чтобы следующий запрос мог проверить систему
+        без ожидания probe_timeout.
+        """
+        def change(state, now):
+            if state['circuit'] == CIRCUIT_HALF_OPEN:
+                state['probe_until'] = 0
+
+        self._update(engine, change)
+
+    def record_failure(self, engine):
+        """
+        Ответ 429/5xx или таймаут: после failure_threshold ошибок подряд или неудачной пробы выключатель размыкается.
+        """
+        threshold = self.limits(engine).get('failure_threshold', 3)
+
+        def change(state, now):
+            state['failures'] += 1
+            if state['circuit'] == CIRCUIT_HALF_OPEN or state['failures'] >= threshold:
+                opened = state['circuit'] != CIRCUIT_OPEN
+                state['circuit'] = CIRCUIT_OPEN
+                state['opened_at'] = now
+                state['probe_until'] = 0
+                return opened
+            return False
+
+        if self._update(engine, change):
+            self.counters[engine]['circuit_opened'] += 1
+            logger.warning(f"Выключатель {engine} разомкнут после ошибок запросов")
+        self.counters[engine]['failures'] += 1
+
+    def state(self, engine):
+        return self._update(engine, lambda state, now: dict(state))
+
+    def stats(self):
+        return {engine: dict(counters) for engine, counters in self.counters.items()}
+
+
+# Общий ограничитель запросов к поисковым системам
+search_rate_limiter = EngineRateLimiter()
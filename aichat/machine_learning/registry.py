@@ -0,0 +1,288 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from django.conf import settings
+from django.db import close_old_connections
+from .embedding_store import embedding_store
+from .text_preprocessing import PymorphyPreprocessor, SpacyPreprocessor, SPACY_UNUSED_COMPONENTS
+from .tfidf_index import TfidfIndex
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Инициализация логирования
+logger = logging.getLogger(__name__)
+
+BERT_MODEL_NAME = 'bert-base-multilingual-cased'
+SPACY_MODEL_NAME = 'ru_core_news_sm'
+
+
+class ModelRegistry:
+    """
+    Общий для процесса реестр моделей: токенизатор и модель BERT, конвейер spaCy,
+    TF-IDF индекс базы знаний и хранилище вложений.
+    Каждая модель загружается один раз за процесс при первом обращении, загрузка потокобезопасна.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._bert_tokenizer = None
+        self._bert_model = None
+        self._bert_loaded = False
+        self._nlp = None
+        self._nlp_loaded = False
+        self._preprocessor = None
+        self._embedding_service = None
+        self.tfidf_index = TfidfIndex()
+        self.load_seconds = {}
+        self.load_errors = {}
+        # Количество ответов каскадного поиска по стадиям
+        self.retrieval_stages = Counter()
+        # Вычисления, которых избежал контекст обработки сообщений, по видам
+        self.pipeline_reused = Counter()
+        self.pipeline_messages = 0
+        self._inference_executor = None
+        self.inference_calls = 0
+        self.inference_running = 0
+        # Время до первого содержимого ответа и до окончательного ответа асинхронной обработки сообщений
+        self.progressive = Counter()
+
+    def _timed(self, name, loader):
+        """
+        Выполнение загрузчика с замером времени и записью ошибки в статистику.
+        """
+        started = time.perf_counter()
+        try:
+            return loader()
+        except Exception as e:
+            logger.error(f"Ошибка загрузки '{name}': {str(e)}")
+            self.load_errors[name] = str(e)
+            return None
+        finally:
+            self.load_seconds[name] = round(time.perf_counter() - started, 3)
+            logger.debug(f"Загрузка '{name}' заняла {self.load_seconds[name]} с")
+
+    def _load_bert(self):
+        with self._lock:
+            if self._bert_loaded:
+                return
+            from transformers import BertTokenizer, BertModel
+            logger.debug(f"Загрузка модели BERT '{BERT_MODEL_NAME}'")
+            self._bert_tokenizer = self._timed(
+                'bert_tokenizer', lambda: BertTokenizer.from_pretrained(BERT_MODEL_NAME)
+            )
+            self._bert_model = self._timed('bert_model', lambda: BertModel.from_pretrained(BERT_MODEL_NAME))
+            if self._bert_tokenizer is None or self._bert_model is None:
+                self._bert_tokenizer = None
+                self._bert_model = None
+            else:
+                self._bert_model.eval()
+            self._bert_loaded = True
+
+    @property
+    def bert_tokenizer(self):
+        if not self._bert_loaded:
+            self._load_bert()
+        return self._bert_tokenizer
+
+    @property
+    def bert_model(self):
+        if not self._bert_loaded:
+            self._load_bert()
+        return self._bert_model
+
+    @property
+    def embedding_service(self):
+        """
+        Сервис микро-батчинга вложений BERT или None, если модель BERT не загрузилась.
+        """
+        if self._embedding_service is None:
+            with self._lock:
+                if self._embedding_service is None and self.bert_model is not None:
+                    from .embedding_service import EmbeddingService
+                    self._embedding_service = EmbeddingService(
+                        self.bert_tokenizer,
+                        self.bert_model,
+                        max_batch_size=getattr(settings, 'BERT_BATCH_MAX_SIZE', 16),
+                        max_wait_ms=getattr(settings, 'BERT_BATCH_MAX_WAIT_MS', 10),
+                    )
+        return self._embedding_service
+
+    @property
+    def nlp(self):
+        """
+        Конвейер spaCy для русского текста или None, если модель не загрузилась.
+        """
+        if not self._nlp_loaded:
+            with self._lock:
+                if not self._nlp_loaded:
+                    import spacy
+                    logger.debug(f"Загрузка модели spaCy '{SPACY_MODEL_NAME}' без {SPACY_UNUSED_COMPONENTS}")
+                    self._nlp = self._timed(
+                        'spacy', lambda: spacy.load(SPACY_MODEL_NAME, exclude=SPACY_UNUSED_COMPONENTS)
+                    )
+                    self._nlp_loaded = True
+        return self._nlp
+
+    @property
+    def preprocessor(self):
+        """
+        Движок предобработки текста, выбранный настройкой NLP_PREPROCESSOR_BACKEND
+        ('spacy' или 'pymorphy'), или None, если ни один движок не загрузился.
+        """
+        if self._preprocessor is None:
+            with self._lock:
+                if self._preprocessor is None:
+                    backend = getattr(settings, 'NLP_PREPROCESSOR_BACKEND', 'spacy')
+                    if backend == 'pymorphy':
+                        self._preprocessor = self._timed(
+                            'pymorphy',
+                            lambda: PymorphyPreprocessor(getattr(settings, 'NLP_LEMMA_CACHE_SIZE', 100000))
+                        )
+                        if self._preprocessor is None:
+                            logger.warning("Движок pymorphy3 недоступен, используется spaCy")
+                    if self._preprocessor is None and self.nlp is not None:
+                        self._preprocessor = SpacyPreprocessor(self.nlp)
+        return self._preprocessor
+
+    def fit_tfidf(self):
+        """
+        Полное переобучение TF-IDF индекса на вопросах базы знаний и запуск фонового переобучения.
+        Возвращает:
+            TfidfVectorizer: Обученный векторайзер.
+        """
+        vectorizer = self._timed('tfidf', self.tfidf_index.build)
+        self.tfidf_index.start_refit_scheduler(getattr(settings, 'TFIDF_REFIT_INTERVAL', 600))
+        return vectorizer
+
+    @property
+    def tfidf_vectorizer(self):
+        if not self.tfidf_index.is_built:
+            with self._lock:
+                if not self.tfidf_index.is_built:
+                    self.fit_tfidf()
+        return self.tfidf_index.vectorizer
+
+    @property
+    def tfidf_fitted(self):
+        return self.tfidf_index.is_built
+
+    def record_pipeline(self, context):
+        """
+        Учет статистики контекста обработки сообщения.
+        Аргументы:
+            context (PipelineContext): Завершенный контекст сообщения.
+        """
+        self.pipeline_messages += 1
+        self.pipeline_reused.update(context.reused)
+
+    @property
+    def inference_executor(self):
+        """
+        Ограниченный пул потоков для блокирующих вычислений (модели, ORM) асинхронной обработки сообщений.
+        """
+        if self._inference_executor is None:
+            with self._lock:
+                if self._inference_executor is None:
+                    self._inference_executor = ThreadPoolExecutor(
+                        max_workers=getattr(settings, 'AI_INFERENCE_WORKERS', 4),
+                        thread_name_prefix='ai-inference',
+                    )
+        return self._inference_executor
+
+    def _run_inference(self, func, args, kwargs):
+        self.inference_running += 1
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self.inference_running -= 1
+            # Потоки пула переиспользуются между запросами: соединения с базой закрываются как в конце запроса
+            close_old_connections()
+
+    async def run_inference(self, func, *args, **kwargs):
+        """
+        Выполнение блокирующей функции в пуле inference_executor без блокировки цикла событий.
+        Аргументы:
+            func (callable): Функция для выполнения.
+            *args, **kwargs: Аргументы функции.
+        Возвращает:
+            Результат функции.
+        """
+        self.inference_calls += 1
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.inference_executor, partial(self._run_inference, func, args, kwargs))
+
+    def record_first_content(self, first_content_seconds, total_seconds, partials):
+        """
+        Учет времени до первого содержимого ответа (промежуточного или окончательного) и до окончательного ответа.
+        Аргументы:
+            first_content_seconds (float): Время до первого содержимого в секундах.
+            total_seconds (float): Время до окончательного ответа в секундах.
+            partials (int): Количество промежуточных ответов.
+        """
+        self.progressive['messages'] += 1
+        self.progressive['first_content_seconds'] += first_content_seconds
+        self.progressive['total_seconds'] += total_seconds
+        self.progressive['partials'] += partials
+
+    @property
+    def embedding_store(self):
+        return embedding_store
+
+    def stats(self):
+        """
+        Статистика загрузки моделей и потребления памяти процессом.
+        Возвращает:
+            dict: Состояние моделей, время загрузки, ошибки и оценка памяти.
+        """
+        bert_bytes = 0
+        if self._bert_model is not None:
+            bert_bytes = sum(p.numel() * p.element_size() for p in self._bert_model.parameters())
+        messages = self.progressive['messages']
+        process_peak_rss = None
+        if resource is not None:
+            # ru_maxrss в Linux возвращается в килобайтах
+            process_peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        return {
+            'loaded': {
+                'bert': self._bert_model is not None,
+                'spacy': self._nlp is not None,
+                'preprocessor': self._preprocessor.stats() if self._preprocessor else None,
+                'tfidf': self.tfidf_index.is_built,
+            },
+            'load_seconds': dict(self.load_seconds),
+            'load_errors': dict(self.load_errors),
+            'memory': {
+                'bert_parameters_bytes': bert_bytes,
+                'process_peak_rss_bytes': process_peak_rss,
+            },
+            'tfidf_index': self.tfidf_index.stats(),
+            'embedding_store': embedding_store.stats(),
+            'retrieval_stages': dict(self.retrieval_stages),
+            'pipeline': {
+                'messages': self.pipeline_messages,
+                'reused': dict(self.pipeline_reused),
+            },
+            'embedding_service': self._embedding_service.stats() if self._embedding_service else None,
+            'progressive': {
+                'messages': messages,
+                'avg_first_content_seconds': round(self.progressive['first_content_seconds'] / messages, 3) if messages else None,
+                'avg_total_seconds': round(self.progressive['total_seconds'] / messages, 3) if messages else None,
+                'partials': self.progressive['partials'],
+            },
+            'inference_executor': {
+                'workers': getattr(settings, 'AI_INFERENCE_WORKERS', 4),
+                'calls': self.inference_calls,
+                'running': self.inference_running,
+            },
+        }
+
+
+# Общий реестр моделей процесса
+model_registry = ModelRegistry()
@@ -1,7 +1,17 @@
+import asyncio
 import logging
+from django.utils import timezone
 from aichat.models import KnowledgeBase
 from .nlp_processor import NLPProcessor
-from .utils import search_internet
+from .exact_match import exact_match_cache
+from .pipeline_context import PipelineContext, memoize
+from .registry import model_registry
+from .search_cache import negative_search_cache
+from .single_flight import search_flight
+from .utils import (
+    asearch_internet, is_placeholder_result, is_valid_snippet, no_results_placeholder, search_answered,
+    search_internet, question_hash
+)
 
 # Инициализация логирования
 logger = logging.getLogger(__name__)
@@ -21,45 +31,58 @@ class ResponseHandler:
             "привет": "Привет! Чем могу помочь?"
         }
 
-    def add_response(self, query, response, sources=None):
+    def add_response(self, query, response, sources=None, context=None):
         """
         Добавление ответа в базу знаний.
         Аргументы:
             query (str): Запрос пользователя.
             response (str): Ответ для хранения.
             sources (list): Список источников (опционально).
+            context (PipelineContext): Контекст обработки сообщения (опционально).
         """
         logger.debug(f"Добавление ответа в базу знаний для запроса: {query}")
         try:
-            processed_query = self.nlp_processor.preprocess_text(query)
+            processed_query = self.nlp_processor.preprocess_text(query, context=context)
             knowledge_item = KnowledgeBase.objects.filter(question_pattern=processed_query).first()
             if knowledge_item:
                 knowledge_item.usage_count += 1
                 knowledge_item.save()
+                exact_match_cache.link(knowledge_item, query)
                 logger.debug(f"Обновлено количество использований в KnowledgeBase для запроса: {query}")
             else:
-                KnowledgeBase.objects.create(
+                knowledge_item = KnowledgeBase.objects.create(
                     question_pattern=processed_query,
+                    question_hash=question_hash(query),
+                    search_query=query if sources else '',
+                    refreshed_at=timezone.now() if sources else None,
                     answer=response,
                     confidence_score=0.7,
                     sources=sources or []
                 )
+                exact_match_cache.remember(knowledge_item)
+                self.nlp_processor.index_knowledge_item(knowledge_item)
                 logger.debug(f"Создан новый элемент KnowledgeBase для запроса: {query}")
         except Exception as e:
             logger.error(f"Не удалось добавить ответ в KnowledgeBase для запроса '{query}': {str(e)}")
 
-    def get_trending_response(self, user_input):
+    def get_trending_response(self, user_input, context=None):
         """
         Поиск популярного ответа в базе знаний.
         Аргументы:
             user_input (str): Ввод пользователя.
+            context (PipelineContext): Контекст обработки сообщения (опционально).
         Возвращает:
             str: Популярный ответ или None, если не найден.
         """
         logger.debug(f"Поиск популярного ответа для ввода: {user_input}")
         try:
-            knowledge_item = self.nlp_processor.find_similar_question(user_input, threshold=0.7)
-            if knowledge_item:
+            exact = memoize(context, 'exact', user_input, lambda: exact_match_cache.lookup(user_input))
+            if exact:
+                logger.debug(f"Найден точный ответ в базе знаний: {exact['id']}")
+                return exact['answer']
+            matches = self.nlp_processor.find_similar_question(user_input, threshold=0.7, context=context)
+            if matches:
+                knowledge_item = matches[0][0]
                 logger.debug(f"Найден популярный ответ: {knowledge_item.answer}")
                 return knowledge_item.answer
             logger.debug(f"Популярный ответ для ввода: {user_input} не найден")
@@ -68,30 +91,141 @@ class ResponseHandler:
             logger.error(f"Ошибка в get_trending_response для ввода '{user_input}': {str(e)}")
             return None
 
-    def collect_data_via_parsing(self, query, location="Москва"):
+    def collect_data_via_parsing(self, query, location="Москва", refresh=False, policy=None):
         """
         Сбор данных с помощью парсинга результатов поиска.
         Аргументы:
             query (str): Запрос для поиска.
             location (str): Локация по умолчанию для добавления к запросу, если нужно.
+            refresh (bool): Выполнить поиск заново, минуя кеш результатов поиска.
+            policy (str): Политика ожидания поисковых систем (по умолчанию SEARCH_POLICY).
         Возвращает:
             list: Список разобранных результатов.
         """
+        return self._format_results(query, self.search_results(query, location, refresh, policy))
+
+    async def acollect_data_via_parsing(self, query, location="Москва", refresh=False, policy=None, on_results=None):
+        """
+        Асинхронный вариант collect_data_via_parsing: ожидание поиска не занимает поток.
+        on_results(name, results) получает результаты источников по мере ответов
+        (только у вызова, выполняющего поиск, а не ожидающего чужой).
+        Возвращает:
+            list: Список разобранных результатов.
+        """
+        return self._format_results(query, await self.asearch_results(query, location, refresh, policy, on_results))
+
+    def search_results(self, query, location="Москва", refresh=False, policy=None):
+        """
+        Результаты поиска без разбора, включая дефолтный результат при отсутствии данных
+        (по нему search_answered отличает пустую выдачу от недоступного поиска).
+        Аргументы:
+            query (str): Запрос для поиска.
+            location (str): Локация по умолчанию для добавления к запросу, если нужно.
+            refresh (bool): Выполнить поиск заново, минуя кеш результатов поиска.
+            policy (str): Политика ожидания поисковых систем (по умолчанию SEARCH_POLICY).
+        Возвращает:
+            list: Результаты search_internet.
+        """
         logger.debug(f"Сбор данных для запроса: {query}")
         try:
-            if "найди" in query.lower() and " в " not in query.lower():
-                query = f"{query} в {location}"
-            results = search_internet(query, use_selenium=False)
-            formatted_results = [{
-                'text': result.get('snippet', ''),
-                'source': result.get('link', ''),
-                'title': result.get('title', '')
-            } for result in results if 'snippet' in result and result['snippet']]
-            logger.debug(f"Собрано {len(formatted_results)} результатов для запроса: {query}")
-            return formatted_results
+            query = self._search_query(query, location)
+            # Одновременные одинаковые запросы выполняют один поиск
+            return search_flight.do(
+                question_hash(query),
+                lambda: search_internet(query, use_selenium=False, refresh=refresh, policy=policy)
+            )
         except Exception as e:
             logger.error(f"Ошибка сбора данных для запроса '{query}': {str(e)}")
-            return []
+            return no_results_placeholder(query, answered=False)
+
+    async def asearch_results(self, query, location="Москва", refresh=False, policy=None, on_results=None):
+        """
+        Асинхронный вариант search_results.
+        Возвращает:
+            list: Результаты asearch_internet.
+        """
+        logger.debug(f"Сбор данных для запроса: {query}")
+        try:
+            query = self._search_query(query, location)
+            # Синхронные и асинхронные вызовы с одинаковым запросом ждут один поиск
+            return await search_flight.ado(
+                question_hash(query),
+                lambda: asearch_internet(query, refresh=refresh, policy=policy, on_results=on_results)
+            )
+        except Exception as e:
+            logger.error(f"Ошибка сбора данных для запроса '{query}': {str(e)}")
+            return no_results_placeholder(query, answered=False)
+
+    @staticmethod
+    def _search_query(query, location):
+        # Добавление локации к запросу, если содержит "найди" и не имеет локации
+        if "найди" in query.lower() and " в " not in query.lower():
+            return f"{query} в {location}"
+        return query
+
+    @staticmethod
+    def _format_results(query, results):
+        formatted_results = [{
+            'text': result.get('snippet', ''),
+            'source': result.get('link', ''),
+            'title': result.get('title', '')
+        } for result in results if 'snippet' in result and result['snippet'] and not is_placeholder_result(result)]
+        logger.debug(f"Собрано {len(formatted_results)} результатов для запроса: {query}")
+        return formatted_results
+
+    def search_answer(self, user_input):
+        """
+        Ответ из поиска в интернете с учетом кеша запросов без результатов.
+        Аргументы:
+            user_input (str): Ввод пользователя.
+        Возвращает:
+            tuple: Ответ и список источников или None, если поиск не дал валидных результатов.
+        """
+        negative_key = question_hash(user_input)
+        if negative_search_cache.get(negative_key) is not None:
+            logger.debug(f"Поиск для запроса '{user_input}' пропущен: недавно не дал результатов")
+            return None
+        results = self.search_results(user_input)
+        search_answer = self.build_search_answer(self._format_results(user_input, results))
+        # Запрос запоминается только при пустой выдаче: недоступность поиска не кешируется
+        if search_answer is None and search_answered(results):
+            negative_search_cache.set(negative_key, True)
+        return search_answer
+
+    async def asearch_answer(self, user_input, on_results=None):
+        """
+        Асинхронный вариант search_answer.
+        Аргументы:
+            user_input (str): Ввод пользователя.
+            on_results (callable): Функция (name, results) для результатов источников по мере ответов.
+        Возвращает:
+            tuple: Ответ и список источников или None, если поиск не дал валидных результатов.
+        """
+        negative_key = question_hash(user_input)
+        if await asyncio.to_thread(negative_search_cache.get, negative_key) is not None:
+            logger.debug(f"Поиск для запроса '{user_input}' пропущен: недавно не дал результатов")
+            return None
+        results = await self.asearch_results(user_input, on_results=on_results)
+        search_answer = self.build_search_answer(self._format_results(user_input, results))
+        # Запрос запоминается только при пустой выдаче: недоступность поиска не кешируется
+        if search_answer is None and search_answered(results):
+            await asyncio.to_thread(negative_search_cache.set, negative_key, True)
+        return search_answer
+
+    def build_search_answer(self, collected_data):
+        """
+        Формирование ответа из собранных результатов поиска.
+        Аргументы:
+            collected_data (list): Результаты collect_data_via_parsing.
+        Возвращает:
+            tuple: Ответ и список источников или None, если валидных результатов нет.
+        """
+        valid_responses = [item for item in collected_data or [] if self.validate_response(item['text'])]
+        if not valid_responses:
+            return None
+        answer = "\n".join(f"- {item['title']}: {item['text']}" for item in valid_responses[:3])
+        sources = [{'url': item['source'], 'text': item['title']} for item in valid_responses]
+        return answer, sources
 
     def validate_response(self, response):
         """
@@ -102,19 +236,20 @@ class ResponseHandler:
             bool: True, если ответ валиден, False в противном случае.
         """
         logger.debug(f"Проверка качества ответа: {response}")
-        return bool(response and len(response.strip()) >= 5)
+        return is_valid_snippet(response)
 
-    def categorize_input(self, user_input):
+    def categorize_input(self, user_input, context=None):
         """
         Классификация ввода пользователя как вопрос или действие.
         Аргументы:
             user_input (str): Ввод пользователя.
+            context (PipelineContext): Контекст обработки сообщения (опционально).
         Возвращает:
             str: Категория ("вопрос" или "действие").
         """
         logger.debug(f"Классификация ввода: {user_input}")
         try:
-            processed_input = self.nlp_processor.preprocess_text(user_input)
+            processed_input = self.nlp_processor.preprocess_text(user_input, context=context)
             question_keywords = ["что", "почему", "как", "где", "когда", "сколько", "кто", "?", "найди"]
             if any(keyword in processed_input.lower() for keyword in question_keywords):
                 logger.debug("Ввод классифицирован как вопрос")
@@ -125,68 +260,92 @@ class ResponseHandler:
             logger.error(f"Ошибка классификации ввода '{user_input}': {str(e)}")
             return "вопрос"
 
-    def handle_question(self, user_input):
+    def handle_question(self, user_input, context=None):
         """
         Обработка вопроса.
         Аргументы:
             user_input (str): Ввод пользователя.
+            context (PipelineContext): Контекст обработки сообщения (опционально).
         Возвращает:
             tuple: Ответ и список источников.
         """
         logger.debug(f"Обработка вопроса: {user_input}")
-        trending_response = self.get_trending_response(user_input)
-        if trending_response:
-            logger.debug(f"Возвращен популярный ответ: {trending_response}")
-            return trending_response, []
-
-        collected_data = self.collect_data_via_parsing(user_input)
-        if collected_data:
-            valid_responses = [item for item in collected_data if self.validate_response(item['text'])]
-            if valid_responses:
-                answer = "\n".join(f"- {item['title']}: {item['text']}" for item in valid_responses[:3])
-                sources = [{'url': item['source'], 'text': item['title']} for item in valid_responses]
-                self.add_response(user_input, answer, sources)
-                logger.debug(f"Сгенерирован ответ: {answer}")
-                return answer, sources
-        # Предоставление более конкретного ответа для неконкретных запросов
-        if user_input.lower() in ["что нового?", "что нового"]:
-            logger.debug("Ввод неконкретный, возвращается уточняющий ответ")
-            return "Пожалуйста, уточните, что именно вы хотите узнать о новостях. Например, новости в Москве или новости технологий?", []
-        logger.debug("Не удалось найти информацию для вопроса")
-        return f"Не удалось найти информацию по запросу '{user_input}'. Попробуйте уточнить.", []
+        local_answer = self.local_answer(user_input, "вопрос", context=context)
+        if local_answer:
+            return local_answer
 
-    def handle_action(self, user_input):
+        search_answer = self.search_answer(user_input)
+        if search_answer:
+            answer, sources = search_answer
+            self.add_response(user_input, answer, sources, context=context)
+            logger.debug(f"Сгенерирован ответ: {answer}")
+            return answer, sources
+        return self.not_found_answer(user_input, "вопрос")
+
+    def handle_action(self, user_input, context=None):
         """
         Обработка действия.
         Аргументы:
             user_input (str): Ввод пользователя.
+            context (PipelineContext): Контекст обработки сообщения (опционально).
         Возвращает:
             tuple: Ответ и список источников.
         """
         logger.debug(f"Обработка действия: {user_input}")
-        if user_input.lower() in self.static_responses:
+        local_answer = self.local_answer(user_input, "действие", context=context)
+        if local_answer:
+            return local_answer
+
+        search_answer = self.search_answer(user_input)
+        if search_answer:
+            answer, sources = search_answer
+            self.add_response(user_input, answer, sources, context=context)
+            logger.debug(f"Сгенерирован ответ: {answer}")
+            return answer, sources
+        return self.not_found_answer(user_input, "действие")
+
+    def local_answer(self, user_input, category, context=None):
+        """
+        Ответ без поиска в интернете: популярный ответ базы знаний для вопроса, статический - для действия.
+        Аргументы:
+            user_input (str): Ввод пользователя.
+            category (str): Категория ввода ("вопрос" или "действие").
+            context (PipelineContext): Контекст обработки сообщения (опционально).
+        Возвращает:
+            tuple: Ответ и список источников или None.
+        """
+        if category == "вопрос":
+            trending_response = self.get_trending_response(user_input, context=context)
+            if trending_response:
+                logger.debug(f"Возвращен популярный ответ: {trending_response}")
+                return trending_response, []
+        elif user_input.lower() in self.static_responses:
             logger.debug(f"Возвращен статический ответ: {self.static_responses[user_input.lower()]}")
             return self.static_responses[user_input.lower()], []
+        return None
 
-        collected_data = self.collect_data_via_parsing(user_input)
-        if collected_data:
-            valid_responses = [item for item in collected_data if self.validate_response(item['text'])]
-            if valid_responses:
-                answer = "\n".join(f"- {item['title']}: {item['text']}" for item in valid_responses[:3])
-                sources = [{'url': item['source'], 'text': item['title']} for item in valid_responses]
-                self.add_response(user_input, answer, sources)
-                logger.debug(f"Сгенерирован ответ: {answer}")
-                return answer, sources
-        logger.debug("Не удалось найти информацию для действия")
+    @staticmethod
+    def not_found_answer(user_input, category):
+        """
+        Ответ при отсутствии результатов поиска.
+        Возвращает:
+            tuple: Ответ и пустой список источников.
+        """
+        # Предоставление более конкретного ответа для неконкретных запросов
+        if category == "вопрос" and user_input.lower() in ["что нового?", "что нового"]:
+            logger.debug("Ввод неконкретный, возвращается уточняющий ответ")
+            return "Пожалуйста, уточните, что именно вы хотите узнать о новостях. Например, новости в Москве или новости технологий?", []
+        logger.debug(f"Не удалось найти информацию для ввода категории '{category}'")
         return f"Не удалось найти информацию по запросу '{user_input}'. Попробуйте уточнить.", []
 
-    def process_input(self, user_input, conversation_id=None, user=None):
+    def process_input(self, user_input, conversation_id=None, user=None, context=None):
         """
         Обработка ввода пользователя и генерация ответа.
         Аргументы:
             user_input (str): Ввод пользователя.
             conversation_id (int): ID беседы (опционально).
             user: Объект пользователя (опционально).
+            context (PipelineContext): Контекст обработки сообщения (по умолчанию создается новый).
         Возвращает:
             dict: Словарь с статусом успеха, ответом, источниками и категорией.
         """
@@ -204,11 +363,13 @@ class ResponseHandler:
             user_input = user_input.strip()
             logger.debug(f"Обработанный ввод: {user_input}")
 
-            category = self.categorize_input(user_input)
+            if context is None:
+                context = PipelineContext(user_input)
+            category = self.categorize_input(user_input, context=context)
             if category == "вопрос":
-                answer, sources = self.handle_question(user_input)
+                answer, sources = self.handle_question(user_input, context=context)
             else:
-                answer, sources = self.handle_action(user_input)
+                answer, sources = self.handle_action(user_input, context=context)
 
             logger.debug(f"Обработан ввод '{user_input}' как {category}, ответ: {answer}")
             return {
@@ -224,4 +385,102 @@ class ResponseHandler:
                 "answer": "Произошла ошибка при обработке запроса",
                 "sources": [],
                 "error": str(e)
-            }
\ No newline at end of file
+            }
+
+    async def astream_input(self, user_input, conversation_id=None, user=None, context=None):
+        """
+        Обработка ввода с выдачей промежуточных результатов по мере готовности.
+        Ответ из базы знаний выдается сразу окончательным; иначе после события о начале поиска
+        выдаются ответы из выдержек ответивших поисковых систем, затем окончательный ответ.
+        Аргументы:
+            user_input (str): Ввод пользователя.
+            conversation_id (int): ID беседы (опционально).
+            user: Объект пользователя (опционально).
+            context (PipelineContext): Контекст обработки сообщения (по умолчанию создается новый).
+        Возвращает:
+            async generator: События {'type': 'status', 'stage': 'search'},
+                {'type': 'partial', 'stage': 'search', 'engine', 'answer', 'sources'}
+                и последнее {'type': 'final', 'result': результат как у process_input}.
+        """
+        logger.debug(f"Начало обработки ввода: {user_input}")
+        try:
+            if not user_input or not isinstance(user_input, str):
+                logger.error("Неверный ввод: пусто или не строка")
+                yield {'type': 'final', 'result': {
+                    "success": False,
+                    "answer": "Неверный формат запроса",
+                    "sources": [],
+                    "error": "Invalid input"
+                }}
+                return
+
+            user_input = user_input.strip()
+            if context is None:
+                context = PipelineContext(user_input)
+            category = await model_registry.run_inference(self.categorize_input, user_input, context=context)
+            local_answer = await model_registry.run_inference(self.local_answer, user_input, category, context=context)
+            if local_answer:
+                answer, sources = local_answer
+            else:
+                yield {'type': 'status', 'stage': 'search'}
+                collected = []
+                engines = asyncio.Queue()
+
+                def on_results(name, results):
+                    collected.extend(self._format_results(user_input, results))
+                    engines.put_nowait(name)
+
+                # Поиск не отменяется при закрытии потока: его результат ждут кеш и одновременные запросы
+                search = asyncio.ensure_future(self.asearch_answer(user_input, on_results=on_results))
+                while True:
+                    next_engine = asyncio.ensure_future(engines.get())
+                    await asyncio.wait({search, next_engine}, return_when=asyncio.FIRST_COMPLETED)
+                    if not next_engine.done():
+                        next_engine.cancel()
+                        break
+                    partial = self.build_search_answer(collected)
+                    if partial:
+                        yield {
+                            'type': 'partial',
+                            'stage': 'search',
+                            'engine': next_engine.result(),
+                            'answer': partial[0],
+                            'sources': partial[1]
+                        }
+                search_answer = search.result()
+                if search_answer:
+                    answer, sources = search_answer
+                    await model_registry.run_inference(self.add_response, user_input, answer, sources, context=context)
+                    logger.debug(f"Сгенерирован ответ: {answer}")
+                else:
+                    answer, sources = self.not_found_answer(user_input, category)
+
+            logger.debug(f"Обработан ввод '{user_input}' как {category}, ответ: {answer}")
+            yield {'type': 'final', 'result': {
+                "success": True,
+                "answer": answer,
+                "sources": sources,
+                "category": category
+            }}
+        except Exception as e:
+            logger.error(f"Ошибка обработки ввода '{user_input}': {str(e)}")
+            yield {'type': 'final', 'result': {
+                "success": False,
+                "answer": "Произошла ошибка при обработке запроса",
+                "sources": [],
+                "error": str(e)
+            }}
+
+    async def aprocess_input(self, user_input, conversation_id=None, user=None, context=None):
+        """
+        Асинхронный вариант process_input с тем же форматом результата.
+        Классификация, поиск в базе знаний и сохранение ответа выполняются в пуле потоков моделей,
+        поиск в интернете ожидается без блокировки потока.
+        Возвращает:
+            dict: Словарь с статусом успеха, ответом, источниками и категорией.
+        """
+        result = None
+        async for event in self.astream_input(user_input, conversation_id, user, context=context):
+            if event['type'] == 'final':
+                result = event['result']
+        return result
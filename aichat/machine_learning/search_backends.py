@@ -0,0 +1,435 @@
+import asyncio
+import logging
+import threading
+import time
+import httpx
+from bs4 import BeautifulSoup, SoupStrainer
+from django.conf import settings
+from urllib.parse import quote
+from aichat.models import SystemSettings
+from .http_pool import search_http_pool
+from .rate_limit import search_rate_limiter
+
+# Инициализация логирования
+logger = logging.getLogger(__name__)
+
+# Максимальное количество результатов поиска
+SEARCH_MAX_RESULTS = 10
+
+# Сообщение отмены запроса источника, не ответившего к сроку поиска (отличает таймаут от отмены после победы)
+DEADLINE_CANCEL_MESSAGE = 'search deadline'
+
+
+def _html_parser():
+    """
+    Парсер BeautifulSoup для страниц результатов: lxml, если установлен, иначе встроенный html.parser.
+    """
+    try:
+        import lxml  # noqa: F401
+        return 'lxml'
+    except ImportError:
+        return 'html.parser'
+
+
+HTML_PARSER = _html_parser()
+
+# Контейнеры результатов: при разборе страницы дерево строится только для них
+GOOGLE_RESULTS_STRAINER = SoupStrainer('div', id='rso')
+# Элементы результатов Яндекса имеют несколько классов (serp-item serp-item_card ...), а SoupStrainer
+# сравнивает строку с атрибутом class целиком, поэтому класс ищется среди отдельных значений
+YANDEX_RESULTS_STRAINER = SoupStrainer('li', class_=lambda value: bool(value) and 'serp-item' in value.split())
+
+
+def parse_google(soup, max_results=None):
+    """
+    Парсит результаты поиска Google на основе структуры HTML из скриншота.
+    Аргументы:
+        soup (BeautifulSoup): Разобранный HTML страницы Google.
+        max_results (int): Остановить разбор после указанного количества результатов (None - без ограничения).
+    Возвращает:
+        list: Список словарей с результатами поиска.
+    """
+    results = []
+    try:
+        logger.debug("Начало парсинга результатов Google")
+        # Основной контейнер результатов на основе скриншота
+        for result in soup.css.iselect('div#rso div.g'):
+            # Извлечение заголовка из тега h3 внутри ссылки
+            title_elem = result.select_one('h3.LC20lb')
+            if not title_elem:
+                title_elem = result.select_one('h3')  # Резервный вариант
+            # Извлечение ссылки из тега a
+            link_elem = result.select_one('a[href]')
+            # Извлечение выдержки
+            snippet_elem = result.select_one('div.VwiC3b.YwPh0e') or result.select_one('div[data-snippet]')
+
+            # Проверка наличия всех необходимых элементов
+            if title_elem and link_elem and snippet_elem:
+                title = title_elem.get_text(strip=True)
+                link = link_elem['href'].replace("/url?q=", "").split("&")[0]  # Удаление параметров
+                snippet = snippet_elem.get_text(strip=True)
+
+                results.append({
+                    'title': title,
+                    'snippet': snippet,
+                    'link': link
+                })
+                logger.debug(f"Найден результат Google: {title} ({link})")
+                if max_results and len(results) >= max_results:
+                    break
+            else:
+                logger.warning("Не удалось извлечь все элементы из результата Google")
+        logger.debug(f"Google: найдено {len(results)} результатов")
+        return results
+    except Exception as e:
+        logger.error(f"Ошибка парсинга результатов Google: {str(e)}")
+        return []
+
+
+def parse_yandex(soup, max_results=None):
+    """
+    Парсит результаты поиска Яндекса на основе структуры HTML из скриншота.
+    Аргументы:
+        soup (BeautifulSoup): Разобранный HTML страницы Яндекса.
+        max_results (int): Остановить разбор после указанного количества результатов (None - без ограничения).
+    Возвращает:
+        list: Список словарей с результатами поиска.
+    """
+    results = []
+    try:
+        logger.debug("Начало парсинга результатов Яндекса")
+        # Основной контейнер результатов
+        for result in soup.css.iselect('li.serp-item'):
+            # Извлечение заголовка
+            title_elem = result.select_one('a.organic__url b') or result.select_one('div.organic__title')
+            if not title_elem:
+                title_elem = result.select_one('a.Link')
+            # Извлечение ссылки
+            link_elem = result.select_one('a.organic__url[href]') or result.select_one('a.Link[href]')
+            # Извлечение выдержки
+            snippet_elem = result.select_one('div.organic__text')
+
+            if title_elem and link_elem and snippet_elem:
+                title = title_elem.get_text(strip=True)
+                link = link_elem['href']
+                snippet = snippet_elem.get_text(strip=True)
+
+                results.append({
+                    'title': title,
+                    'snippet': snippet,
+                    'link': link
+                })
+                logger.debug(f"Найден результат Яндекса: {title} ({link})")
+                if max_results and len(results) >= max_results:
+                    break
+            else:
+                logger.warning("Не удалось извлечь все элементы из результата Яндекса")
+        logger.debug(f"Яндекс: найдено {len(results)} результатов")
+        return results
+    except Exception as e:
+        logger.error(f"Ошибка парсинга результатов Яндекса: {str(e)}")
+        return []
+
+
+def extract_google(html, max_results=10):
+    """
+    Быстрое извлечение результатов Google: разбирается только контейнер div#rso.
+    Аргументы:
+        html (str): HTML страницы результатов.
+        max_results (int): Максимальное количество результатов.
+    Возвращает:
+        list: Список словарей с результатами поиска.
+    """
+    return parse_google(BeautifulSoup(html, HTML_PARSER, parse_only=GOOGLE_RESULTS_STRAINER), max_results)
+
+
+def extract_yandex(html, max_results=10):
+    """
+    Быстрое извлечение результатов Яндекса: разбираются только элементы li.serp-item.
+    Аргументы:
+        html (str): HTML страницы результатов.
+        max_results (int): Максимальное количество результатов.
+    Возвращает:
+        list: Список словарей с результатами поиска.
+    """
+    return parse_yandex(BeautifulSoup(html, HTML_PARSER, parse_only=YANDEX_RESULTS_STRAINER), max_results)
+
+
+def _is_engine_failure(error):
+    """
+    Ошибки, указывающие на перегрузку или недоступность поисковой системы: 429, 5xx, таймауты и сетевые ошибки.
+    """
+    if isinstance(error, httpx.HTTPStatusError):
+        status = error.response.status_code
+        return status == 429 or status >= 500
+    return isinstance(error, httpx.TransportError)
+
+
+class SearchBackend:
+    """
+    Базовый источник результатов поиска.
+    Запрос выполняется через общий пул соединений источника, в пределах его бюджета запросов
+    и при замкнутом выключателе; ответ разбирается в потоке, чтобы не блокировать цикл событий.
+    Наследники определяют request() и parse().
+    """
+
+    name = None
+    rate_limited = True
+
+    def request(self, query):
+        """
+        Параметры HTTP запроса для поискового запроса.
+        Возвращает:
+            tuple: URL и словарь дополнительных аргументов httpx (params, headers).
+        """
+        raise NotImplementedError
+
+    def parse(self, response):
+        """
+        Извлечение результатов из ответа.
+        Возвращает:
+            list: Список словарей с ключами 'title', 'snippet', 'link'.
+        """
+        raise NotImplementedError
+
+    def is_configured(self):
+        return True
+
+    async def search(self, query, timeout, deadline_at):
+        """
+        Поиск с учетом бюджета запросов: ожидание токена допускается, только если оно укладывается в срок поиска.
+        Аргументы:
+            query (str): Поисковый запрос.
+            timeout (httpx.Timeout): Таймаут HTTP запроса.
+            deadline_at (float): Момент окончания срока поиска по часам цикла событий.
+        Возвращает:
+            list: Результаты источника (пустой список - источник ответил без результатов)
+                  или None, если источник не ответил (не настроен, запрос отклонен или ошибка).
+        """
+        name = self.name
+        if not self.is_configured():
+            logger.warning(f"Источник поиска {name} не настроен, пропускается")
+            return None
+        loop = asyncio.get_running_loop()
+        if self.rate_limited:
+            reservation = asyncio.ensure_future(
+                asyncio.to_thread(search_rate_limiter.acquire, name, max(0.0, deadline_at - loop.time()))
+            )
+            try:
+                wait = await asyncio.shield(reservation)
+            except asyncio.CancelledError:
+                # Резервирование завершится в потоке; пробный запрос, если он был выдан, освобождается после него
+                reservation.add_done_callback(self._release_reservation)
+                raise
+            if wait is None:
+                return None
+        # Исход запроса уже записан в состояние выключателя; requested - запрос отправлен системе
+        settled = not self.rate_limited
+        requested = False
+        try:
+            if self.rate_limited and wait:
+                logger.debug(f"Ожидание бюджета запросов {name}: {round(wait, 2)} с")
+                await asyncio.sleep(wait)
+            url, kwargs = self.request(query)
+            logger.debug(f"Выполняется поиск в {name} по URL: {url}")
+            requested = True
+            response = await search_http_pool.get(name, url, timeout=timeout, **kwargs)
+            response.raise_for_status()  # Проверка на успешный ответ
+            logger.debug(f"Статус ответа {name}: {response.status_code}")
+            if not settled:
+                settled = True
+                await asyncio.to_thread(search_rate_limiter.record_success, name)
+            return await asyncio.to_thread(self.parse, response)
+        except asyncio.CancelledError as e:
+            # Отмена отправленного запроса к сроку поиска - таймаут системы; отмена после ответа другой системы
+            # систему не оценивает. Отмененная задача не ждет поток, поэтому состояние записывается синхронно
+            if not settled:
+                settled = True
+                self._settle(requested and (DEADLINE_CANCEL_MESSAGE in e.args or loop.time() >= deadline_at))
+            raise
+        except httpx.HTTPError as e:
+            # Таймауты httpx (TimeoutException) - сетевые ошибки, они учитываются выключателем как 429 и 5xx
+            logger.error(f"Поиск в {name} для запроса '{query}' завершился неудачей: {str(e)}")
+            if not settled:
+                settled = True
+                await asyncio.to_thread(self._settle, _is_engine_failure(e))
+        except Exception as e:
+            logger.error(f"Неожиданная ошибка в поиске {name} для запроса '{query}': {str(e)}")
+            if not settled:
+                settled = True
+                await asyncio.to_thread(self._settle, False)
+        return None
+
+    def _release_reservation(self, reservation):
+        if not reservation.cancelled() and reservation.exception() is None and reservation.result() is not None:
+            self._settle(False)
+
+    def _settle(self, failed):
+        """
+        Запись исхода запроса без ответа: ошибка системы размыкает выключатель, иначе освобождается пробный запрос.
+        """
+        try:
+            if failed:
+                search_rate_limiter.record_failure(self.name)
+            else:
+                search_rate_limiter.release_probe(self.name)
+        except Exception as e:
+            logger.error(f"Ошибка записи состояния выключателя {self.name}: {str(e)}")
+
+
+class HTMLSearchBackend(SearchBackend):
+    """
+    Источник, разбирающий HTML страницу результатов поисковой системы.
+    """
+
+    url_template = None
+
+    @staticmethod
+    def extract(html, max_results):
+        raise NotImplementedError
+
+    def request(self, query):
+        return self.url_template.format(query=quote(query)), {}
+
+    def parse(self, response):
+        return self.extract(response.text, SEARCH_MAX_RESULTS)
+
+
+class GoogleHTMLBackend(HTMLSearchBackend):
+    name = 'google'
+    url_template = 'https://www.google.com/search?q={query}'
+    extract = staticmethod(extract_google)
+
+
+class YandexHTMLBackend(HTMLSearchBackend):
+    name = 'yandex'
+    url_template = 'https://yandex.ru/search/?text={query}'
+    extract = staticmethod(extract_yandex)
+
+
+class JSONSearchBackend(SearchBackend):
+    """
+    Источник с JSON ответом в формате SearchApi: список organic_results с полями title, link, snippet.
+    """
+
+    url = None
+
+    def params(self, query):
+        return {'q': query}
+
+    def headers(self):
+        return {}
+
+    def request(self, query):
+        return self.url, {'params': self.params(query), 'headers': self.headers()}
+
+    def parse(self, response):
+        results = []
+        for item in response.json().get('organic_results', [])[:SEARCH_MAX_RESULTS]:
+            if item.get('title') and item.get('link'):
+                results.append({
+                    'title': item['title'],
+                    'snippet': item.get('snippet', ''),
+                    'link': item['link']
+                })
+        logger.debug(f"{self.name}: найдено {len(results)} результатов")
+        return results
+
+
+class SearchAPIBackend(JSONSearchBackend):
+    """
+    Поиск через JSON API searchapi.io (ключ SEARCHAPI_API_KEY).
+    """
+
+    name = 'searchapi'
+
+    @property
+    def url(self):
+        return getattr(settings, 'SEARCHAPI_URL', 'https://www.searchapi.io/api/v1/search')
+
+    def is_configured(self):
+        return getattr(settings, 'SEARCHAPI_API_KEY', 'dummy-key') not in ('', 'dummy-key')
+
+    def params(self, query):
+        return {
+            'engine': getattr(settings, 'SEARCHAPI_ENGINE', 'google'),
+            'q': query,
+        }
+
+    def headers(self):
+        # Ключ передается в заголовке: URL запроса попадает в текст ошибок httpx и в журнал
+        return {'Authorization': f'Bearer {settings.SEARCHAPI_API_KEY}'}
+
+
+class StubSearchBackend(JSONSearchBackend):
+    """
+    Локальный сервер-заглушка (команда run_search_stub) с записанными ответами в формате SearchApi.
+    Не ограничивается бюджетом запросов: используется для офлайн измерения пропускной способности и задержек.
+    """
+
+    name = 'stub'
+    rate_limited = False
+
+    @property
+    def url(self):
+        return getattr(settings, 'SEARCH_STUB_URL', 'http://127.0.0.1:8765/api/v1/search')
+
+
+# Доступные источники поиска по именам, используемым в SEARCH_BACKENDS и SystemSettings
+SEARCH_BACKEND_CLASSES = {
+    backend.name: backend
+    for backend in (GoogleHTMLBackend, YandexHTMLBackend, SearchAPIBackend, StubSearchBackend)
+}
+
+# Имя записи SystemSettings, переопределяющей список источников (value - список имен)
+SEARCH_BACKENDS_SETTING = 'search_backends'
+
+_backends_lock = threading.Lock()
+_backends = {}
+_selection = {'names': None, 'loaded_at': 0}
+
+
+def get_search_backend(name):
+    """
+    Экземпляр источника поиска по имени.
+    Возвращает:
+        SearchBackend: Источник или None для неизвестного имени.
+    """
+    with _backends_lock:
+        if name not in _backends:
+            backend_class = SEARCH_BACKEND_CLASSES.get(name)
+            if backend_class is None:
+                logger.error(f"Неизвестный источник поиска: {name}")
+                return None
+            _backends[name] = backend_class()
+        return _backends[name]
+
+
+def selected_backend_names():
+    """
+    Имена выбранных источников поиска: запись SystemSettings 'search_backends', иначе settings.SEARCH_BACKENDS.
+    Выбор перечитывается из базы не чаще раза в SEARCH_BACKENDS_REFRESH секунд.
+    Возвращает:
+        list: Имена источников в порядке объединения результатов.
+    """
+    now = time.monotonic()
+    if _selection['names'] is not None and now - _selection['loaded_at'] < getattr(settings, 'SEARCH_BACKENDS_REFRESH', 30):
+        return _selection['names']
+    names = list(getattr(settings, 'SEARCH_BACKENDS', ['google', 'yandex']))
+    try:
+        override = SystemSettings.objects.filter(name=SEARCH_BACKENDS_SETTING).values_list('value', flat=True).first()
+        if override:
+            names = [override] if isinstance(override, str) else list(override)
+    except Exception as e:
+        logger.error(f"Ошибка чтения настройки {SEARCH_BACKENDS_SETTING}: {str(e)}")
+    _selection.update(names=names, loaded_at=now)
+    return names
+
+
+def get_search_backends():
+    """
+    Выбранные источники поиска.
+    Возвращает:
+        list: Экземпляры SearchBackend.
+    """
+    return [backend for backend in map(get_search_backend, selected_backend_names()) if backend is not None]
@@ -0,0 +1,199 @@
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import InvalidCacheBackendError
+
+# Инициализация логирования
+logger = logging.getLogger(__name__)
+
+
+class SearchCache:
+    """
+    Кеш результатов поиска в интернете по хешу нормализованного запроса.
+    Первый уровень - словарь процесса с TTL и вытеснением LRU по суммарному размеру записей,
+    второй - Django кеш SEARCH_CACHE_ALIAS (файловый), общий для воркеров и переживающий перезапуск.
+    Поколение кеша хранится во втором уровне: очистка в одном процессе меняет его, и остальные процессы
+    сбрасывают свой первый уровень при следующей проверке (не чаще раза в SEARCH_CACHE_GENERATION_CHECK секунд).
+    """
+
+    def __init__(self, alias=None, ttl=None, max_bytes=None, prefix='search', ttl_setting='SEARCH_CACHE_TTL'):
+        """
+        Аргументы:
+            alias (str): Имя Django кеша второго уровня (по умолчанию SEARCH_CACHE_ALIAS).
+            ttl (int): Время жизни записи в секундах (по умолчанию из настройки ttl_setting).
+            max_bytes (int): Ограничение размера первого уровня в байтах (по умолчанию SEARCH_CACHE_MAX_BYTES).
+            prefix (str): Префикс ключей второго уровня, отделяющий кеши с общим alias.
+            ttl_setting (str): Имя настройки времени жизни записи.
+        """
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._alias = alias
+        self._ttl = ttl
+        self._max_bytes = max_bytes
+        self._prefix = prefix
+        self._ttl_setting = ttl_setting
+        self.hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._generation = None
+        self._generation_checked_at = 0
+
+    @property
+    def ttl(self):
+        return self._ttl or getattr(settings, self._ttl_setting, 3600)
+
+    @property
+    def max_bytes(self):
+        return self._max_bytes or getattr(settings, 'SEARCH_CACHE_MAX_BYTES', 16 * 1024 * 1024)
+
+    @property
+    def alias(self):
+        return self._alias or getattr(settings, 'SEARCH_CACHE_ALIAS', 'search')
+
+    def _persistent(self):
+        try:
+            return caches[self.alias]
+        except InvalidCacheBackendError:
+            return None
+
+    def _cache_key(self, key):
+        return f"{self._prefix}:{key}"
+
+    def _sync_generation(self, persistent, now):
+        """
+        Сброс первого уровня, если поколение кеша изменил другой процесс.
+        Аргументы:
+            persistent: Django кеш второго уровня.
+            now (float): Текущее время.
+        """
+        if now < self._generation_checked_at + getattr(settings, 'SEARCH_CACHE_GENERATION_CHECK', 5):
+            return
+        self._generation_checked_at = now
+        try:
+            generation = persistent.get(self._cache_key('generation'))
+        except Exception as e:
+            logger.error(f"Ошибка чтения поколения кеша поиска '{self.alias}': {str(e)}")
+            return
+        if generation != self._generation:
+            with self._lock:
+                self._entries.clear()
+                self._bytes = 0
+                self._generation = generation
+
+    def _drop(self, key):
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+    def _put_memory(self, key, results, expires_at):
+        size = len(json.dumps(results, ensure_ascii=False).encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (expires_at, results, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def get(self, key):
+        """
+        Получение результатов поиска из кеша.
+        Аргументы:
+            key (str): Хеш нормализованного запроса.
+        Возвращает:
+            list: Сохраненные результаты поиска или None.
+        """
+        now = time.time()
+        persistent = self._persistent()
+        if persistent is not None:
+            self._sync_generation(persistent, now)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                self._drop(key)
+                self.expirations += 1
+
+        if persistent is not None:
+            try:
+                stored = persistent.get(self._cache_key(key))
+            except Exception as e:
+                logger.error(f"Ошибка чтения кеша поиска '{self.alias}': {str(e)}")
+                stored = None
+            # Записи прошлого поколения (до очистки кеша) не используются
+            if stored is not None and stored['expires_at'] > now and stored.get('generation') == self._generation:
+                self.persistent_hits += 1
+                self._put_memory(key, stored['results'], stored['expires_at'])
+                return stored['results']
+        self.misses += 1
+        return None
+
+    def set(self, key, results, ttl=None):
+        """
+        Сохранение результатов поиска на обоих уровнях кеша.
+        Аргументы:
+            key (str): Хеш нормализованного запроса.
+            results (list): Результаты поиска.
+            ttl (int): Время жизни записи в секундах (по умолчанию время жизни кеша).
+        """
+        ttl = ttl or self.ttl
+        expires_at = time.time() + ttl
+        self._put_memory(key, results, expires_at)
+        persistent = self._persistent()
+        if persistent is not None:
+            try:
+                persistent.set(
+                    self._cache_key(key),
+                    {'results': results, 'expires_at': expires_at, 'generation': self._generation},
+                    ttl,
+                )
+            except Exception as e:
+                logger.error(f"Ошибка записи кеша поиска '{self.alias}': {str(e)}")
+
+    def clear(self):
+        """
+        Очистка кеша: новое поколение во втором уровне делает недействительными записи всех процессов.
+        """
+        generation = time.time()
+        persistent = self._persistent()
+        if persistent is not None:
+            try:
+                persistent.set(self._cache_key('generation'), generation, None)
+            except Exception as e:
+                logger.error(f"Ошибка записи поколения кеша поиска '{self.alias}': {str(e)}")
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self._generation = generation
+            self._generation_checked_at = generation
+
+    def stats(self):
+        return {
+            'entries': len(self._entries),
+            'bytes': self._bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'persistent_hits': self.persistent_hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
+
+
+# Общий кеш результатов поиска процесса
+search_cache = SearchCache()
+
+# Кеш запросов, поиск по которым недавно не дал результатов (короткий TTL); попадания - пропущенные поиски
+negative_search_cache = SearchCache(prefix='nosearch', ttl_setting='SEARCH_NEGATIVE_CACHE_TTL')
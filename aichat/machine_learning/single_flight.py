@@ -0,0 +1,196 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+import zlib
+from concurrent.futures import Future
+from django.conf import settings
+from filelock import FileLock, Timeout
+
+# Инициализация логирования
+logger = logging.getLogger(__name__)
+
+
+class _Call:
+    """
+    Выполняющееся вычисление, результат которого ожидают одновременные запросы
+    (синхронные - через future.result(), асинхронные - через asyncio.wrap_future).
+    """
+
+    def __init__(self):
+        self.future = Future()
+
+
+class SingleFlight:
+    """
+    Объединение одновременных одинаковых вычислений (single-flight).
+    В процессе одновременные вызовы с одним ключом ждут одно выполняющееся вычисление и получают его результат.
+    Между процессами вычисление выполняется под файловой блокировкой: процесс, дождавшийся блокировки,
+    сначала проверяет результат соседа через recheck (кеши и база), и только при его отсутствии вычисляет сам.
+    """
+
+    def __init__(self, name):
+        """
+        Аргументы:
+            name (str): Имя группы вычислений (используется в именах файлов блокировок).
+        """
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.leaders = 0
+        self.followers = 0
+        self.lock_waits = 0
+        self.recheck_hits = 0
+
+    @staticmethod
+    def _lock_dir():
+        return getattr(settings, 'SINGLE_FLIGHT_LOCK_DIR', None) or os.path.join(settings.BASE_DIR, 'data', 'locks')
+
+    def _file_lock(self, key):
+        # Ключи распределяются по ограниченному числу файлов, чтобы файлы блокировок не накапливались
+        stripe = zlib.crc32(key.encode('utf-8')) % getattr(settings, 'SINGLE_FLIGHT_LOCK_STRIPES', 4096)
+        os.makedirs(self._lock_dir(), exist_ok=True)
+        return FileLock(os.path.join(self._lock_dir(), f'{self.name}_{stripe}.lock'))
+
+    def _join(self, key):
+        """
+        Регистрация вызова: возвращает вычисление и признак того, что вызов должен его выполнить.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+                return call, True
+            self.followers += 1
+        logger.debug(f"Ожидание выполняющегося вычисления {self.name} для ключа {key[:12]}")
+        return call, False
+
+    def _count(self, counter):
+        # Счетчики изменяются из потоков и цикла событий одновременно
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _finish(self, key, call, result=None, error=None):
+        with self._lock:
+            self._calls.pop(key, None)
+        if error is not None:
+            call.future.set_exception(error)
+        else:
+            call.future.set_result(result)
+
+    def do(self, key, compute, recheck=None):
+        """
+        Выполнение вычисления не более одного раза для одновременных вызовов с одинаковым ключом.
+        Аргументы:
+            key (str): Ключ вычисления (например, хеш нормализованного запроса).
+            compute (callable): Функция вычисления без аргументов.
+            recheck (callable): Функция без аргументов, возвращающая результат другого процесса или None.
+        Возвращает:
+            Результат compute (общий для всех ожидавших вызовов).
+        """
+        call, leader = self._join(key)
+        if not leader:
+            return call.future.result()
+        try:
+            result = self._compute_locked(key, compute, recheck)
+        except BaseException as e:
+            self._finish(key, call, error=e)
+            raise
+        self._finish(key, call, result)
+        return result
+
+    async def ado(self, key, acompute, arecheck=None):
+        """
+        Асинхронный вариант do: ожидание не занимает поток, вычисление - корутина.
+        Аргументы:
+            key (str): Ключ вычисления.
+            acompute (callable): Функция без аргументов, возвращающая корутину вычисления.
+            arecheck (callable): Функция без аргументов, возвращающая корутину повторной проверки (опционально).
+        Возвращает:
+            Результат вычисления (общий для синхронных и асинхронных вызовов с этим ключом).
+        """
+        call, leader = self._join(key)
+        if not leader:
+            return await asyncio.wrap_future(call.future)
+        try:
+            result = await self._acompute_locked(key, acompute, arecheck)
+        except BaseException as e:
+            self._finish(key, call, error=e)
+            raise
+        self._finish(key, call, result)
+        return result
+
+    def _compute_locked(self, key, compute, recheck):
+        lock = self._file_lock(key)
+        contended = False
+        try:
+            lock.acquire(timeout=0)
+        except Timeout:
+            # Тот же ключ (или ключ того же файла) вычисляется другим процессом
+            contended = True
+            self._count('lock_waits')
+            try:
+                lock.acquire(timeout=getattr(settings, 'SINGLE_FLIGHT_LOCK_TIMEOUT', 60))
+            except Timeout:
+                logger.warning(f"Не дождались блокировки {self.name} для ключа {key[:12]}, вычисляем без нее")
+                return compute()
+        try:
+            if contended and recheck is not None:
+                try:
+                    result = recheck()
+                except Exception as e:
+                    logger.error(f"Ошибка повторной проверки {self.name} для ключа {key[:12]}: {str(e)}")
+                    result = None
+                if result is not None:
+                    self._count('recheck_hits')
+                    return result
+            return compute()
+        finally:
+            lock.release()
+
+    async def _acompute_locked(self, key, acompute, arecheck):
+        # Блокировка опрашивается без ожидания, чтобы не останавливать цикл событий
+        lock = self._file_lock(key)
+        give_up_at = time.monotonic() + getattr(settings, 'SINGLE_FLIGHT_LOCK_TIMEOUT', 60)
+        contended = False
+        while True:
+            try:
+                lock.acquire(timeout=0)
+                break
+            except Timeout:
+                if not contended:
+                    contended = True
+                    self._count('lock_waits')
+                if time.monotonic() >= give_up_at:
+                    logger.warning(f"Не дождались блокировки {self.name} для ключа {key[:12]}, вычисляем без нее")
+                    return await acompute()
+                await asyncio.sleep(0.05)
+        try:
+            if contended and arecheck is not None:
+                try:
+                    result = await arecheck()
+                except Exception as e:
+                    logger.error(f"Ошибка повторной проверки {self.name} для ключа {key[:12]}: {str(e)}")
+                    result = None
+                if result is not None:
+                    self._count('recheck_hits')
+                    return result
+            return await acompute()
+        finally:
+            lock.release()
+
+    def stats(self):
+        return {
+            'in_flight': len(self._calls),
+            'leaders': self.leaders,
+            'followers': self.followers,
+            'lock_waits': self.lock_waits,
+            'recheck_hits': self.recheck_hits,
+        }
+
+
+# Объединение одновременных генераций ответа и сборов данных поиском по одинаковым запросам
+answer_flight = SingleFlight('answer')
+search_flight = SingleFlight('search')
@@ -0,0 +1,115 @@
+import logging
+import re
+from functools import lru_cache
+
+# Инициализация логирования
+logger = logging.getLogger(__name__)
+
+# Компоненты ru_core_news_sm, которые не влияют на леммы и признаки стоп-слов
+SPACY_UNUSED_COMPONENTS = ['parser', 'ner']
+
+_TOKEN_RE = re.compile(r'[0-9a-zа-яё]+(?:-[0-9a-zа-яё]+)*')
+
+RUSSIAN_STOP_WORDS = frozenset("""
+а без более бы был была были было быть в вам вас весь во вот все всего всех вы где да даже для до его ее
+если есть еще же за здесь и из или им их к как ко когда кто ли либо мне может мы на надо наш не него нее
+нет ни них но ну о об однако он она они оно от очень по под при с со так также такой там те тем то того
+тоже той только том ты у уже хотя чего чей чем что чтобы чье чья эта эти это я ей ему ею им ими кого кому
+ком мной мною нам нами нас ней нему ним ними нём нею себе себя собой тебе тебя тобой вами ваш ваша ваше
+ваши наша наше наши мой моя моё мое мои твой твоя твоё твое твои свой своя своё свое свои этот этого этой
+этому этим этом эту тот та тех теми тому тою ту весь вся всё всем всеми всю всему сам сама само сами
+самим самих самого самой самом самому саму ещё уж вдруг ведь вон впрочем всегда где-то зачем иногда
+именно какая какой какие каких каким какое кроме куда между много нельзя нибудь никогда ничего ну-ка
+опять перед потом потому почти разве сейчас сразу теперь тогда тут хоть хорошо чуть чтоб ж б бы
+около после через над среди вокруг вне всякий каждый другой другие иной иные сколько столько
+""".split())
+
+
+class PymorphyPreprocessor:
+    """
+    Легковесная предобработка: токенизация регулярным выражением, фиксированный набор
+    русских стоп-слов и лемматизация pymorphy3 с ограниченным LRU-кешем лемм по токенам.
+    """
+
+    name = 'pymorphy'
+
+    def __init__(self, cache_size=100000):
+        """
+        Аргументы:
+            cache_size (int): Максимальное количество токенов в кеше лемм.
+        """
+        import pymorphy3
+        self.morph = pymorphy3.MorphAnalyzer()
+        self.lemmatize = lru_cache(maxsize=cache_size)(self._lemmatize)
+
+    def _lemmatize(self, token):
+        if token.isdigit():
+            return token
+        return self.morph.parse(token)[0].normal_form
+
+    def tokens(self, text):
+        """
+        Леммы значимых токенов текста.
+        Аргументы:
+            text (str): Исходный текст.
+        Возвращает:
+            list: Список лемм без стоп-слов и пунктуации.
+        """
+        return [
+            self.lemmatize(token)
+            for token in _TOKEN_RE.findall(text.lower())
+            if token not in RUSSIAN_STOP_WORDS
+        ]
+
+    def preprocess(self, text):
+        return ' '.join(self.tokens(text))
+
+    def preprocess_many(self, texts):
+        return [self.preprocess(text) for text in texts]
+
+    def stats(self):
+        info = self.lemmatize.cache_info()
+        return {
+            'backend': self.name,
+            'lemma_cache_hits': info.hits,
+            'lemma_cache_misses': info.misses,
+            'lemma_cache_size': info.currsize,
+        }
+
+
+class SpacyPreprocessor:
+    """
+    Предобработка конвейером spaCy с отключенными компонентами, не влияющими на леммы;
+    списки текстов обрабатываются батчами через nlp.pipe.
+    """
+
+    name = 'spacy'
+
+    def __init__(self, nlp, batch_size=64):
+        """
+        Аргументы:
+            nlp: Загруженный конвейер spaCy.
+            batch_size (int): Размер батча для nlp.pipe.
+        """
+        self.nlp = nlp
+        self.batch_size = batch_size
+
+    @staticmethod
+    def _tokens(doc):
+        return [token.lemma_ for token in doc if not token.is_stop and not token.is_punct]
+
+    def tokens(self, text):
+        return self._tokens(self.nlp(text.lower()))
+
+    def preprocess(self, text):
+        return ' '.join(self.tokens(text))
+
+    def preprocess_many(self, texts):
+        docs = self.nlp.pipe((text.lower() for text in texts), batch_size=self.batch_size)
+        return [' '.join(self._tokens(doc)) for doc in docs]
+
+    def stats(self):
+        return {
+            'backend': self.name,
+            'pipeline': list(self.nlp.pipe_names),
+        }
@@ -0,0 +1,239 @@
+import logging
+import threading
+import time
+import numpy as np
+from django.db import close_old_connections
+from django.db.models import Count, Max
+from scipy import sparse
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.preprocessing import normalize
+from aichat.models import KnowledgeBase
+
+# Инициализация логирования
+logger = logging.getLogger(__name__)
+
+
+class TfidfIndex:
+    """
+    Постоянный TF-IDF индекс вопросов базы знаний.
+    Хранит L2-нормализованную разреженную матрицу документов и соответствие строк ID элементов,
+    поэтому запрос сводится к одному разреженному скалярному произведению.
+    Новые и измененные элементы дописываются инкрементально в текущий словарь,
+    а фоновое переобучение обновляет словарь и веса IDF.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.vectorizer = None
+        self._matrix = None
+        self._pending = []
+        self._ids = []
+        self._alive = []
+        self._positions = {}
+        self._appended_since_fit = 0
+        self._replay = None
+        self._db_state = None
+        self._refit_thread = None
+        self.fit_count = 0
+        self.last_fit_seconds = None
+        self.last_fit_at = None
+
+    @staticmethod
+    def _db_snapshot():
+        """
+        Количество строк и максимальный ID базы знаний для обнаружения изменений в обход индекса.
+        """
+        state = KnowledgeBase.objects.aggregate(count=Count('id'), max_id=Max('id'))
+        return state['count'], state['max_id']
+
+    def build(self):
+        """
+        Полное построение индекса по базе знаний.
+        Обучение выполняется вне блокировки; элементы, добавленные во время обучения, применяются повторно.
+        """
+        started = time.perf_counter()
+        with self._lock:
+            self._replay = []
+        try:
+            db_state = self._db_snapshot()
+            rows = list(KnowledgeBase.objects.values_list('id', 'question_pattern'))
+            vectorizer = TfidfVectorizer()
+            if rows:
+                matrix = vectorizer.fit_transform([question for _, question in rows])
+                logger.debug(f"Векторайзер TF-IDF инициализирован с {len(rows)} вопросами")
+            else:
+                logger.warning("Вопросы в KnowledgeBase для инициализации TF-IDF не найдены")
+                vectorizer.fit([""])
+                matrix = sparse.csr_matrix((0, len(vectorizer.vocabulary_)))
+            matrix = normalize(matrix.tocsr(), norm='l2', copy=False)
+        except Exception:
+            with self._lock:
+                self._replay = None
+            raise
+
+        with self._lock:
+            replay, self._replay = self._replay, None
+            self.vectorizer = vectorizer
+            self._matrix = matrix
+            self._pending = []
+            self._ids = [item_id for item_id, _ in rows]
+            self._alive = [True] * len(rows)
+            self._positions = {item_id: position for position, item_id in enumerate(self._ids)}
+            self._appended_since_fit = 0
+            self._db_state = db_state
+            for action, item_id, text in replay:
+                if action == 'add':
+                    self._add_locked(item_id, text)
+                else:
+                    self._remove_locked(item_id)
+            self.fit_count += 1
+            self.last_fit_seconds = round(time.perf_counter() - started, 3)
+            self.last_fit_at = time.time()
+        logger.debug(f"TF-IDF индекс построен за {self.last_fit_seconds} с: {len(self._ids)} строк")
+        return vectorizer
+
+    @property
+    def is_built(self):
+        return self.vectorizer is not None
+
+    def ensure_built(self):
+        if not self.is_built:
+            with self._lock:
+                if not self.is_built:
+                    self.build()
+
+    def transform(self, processed_text):
+        """
+        TF-IDF вектор уже обработанного текста в словаре индекса.
+        Аргументы:
+            processed_text (str): Лемматизированный текст.
+        Возвращает:
+            sparse matrix: Нормализованный вектор 1 x V.
+        """
+        self.ensure_built()
+        return self.vectorizer.transform([processed_text])
+
+    def _add_locked(self, item_id, text):
+        self._remove_locked(item_id)
+        vector = normalize(self.vectorizer.transform([text]), norm='l2', copy=False)
+        self._pending.append(vector)
+        self._positions[item_id] = len(self._ids)
+        self._ids.append(item_id)
+        self._alive.append(True)
+        self._appended_since_fit += 1
+
+    def _remove_locked(self, item_id):
+        position = self._positions.pop(item_id, None)
+        if position is not None:
+            self._alive[position] = False
+
+    def add(self, item_id, processed_text):
+        """
+        Инкрементальное добавление или обновление вопроса в текущем словаре.
+        Аргументы:
+            item_id (int): ID элемента KnowledgeBase.
+            processed_text (str): Лемматизированный вопрос.
+        """
+        with self._lock:
+            if self._replay is not None:
+                self._replay.append(('add', item_id, processed_text))
+            if self.is_built:
+                self._add_locked(item_id, processed_text)
+
+    def remove(self, item_id):
+        """
+        Удаление вопроса из индекса.
+        Аргументы:
+            item_id (int): ID элемента KnowledgeBase.
+        """
+        with self._lock:
+            if self._replay is not None:
+                self._replay.append(('remove', item_id, None))
+            self._remove_locked(item_id)
+
+    def _compact_locked(self):
+        """
+        Присоединение добавленных строк к основной матрице перед поиском.
+        """
+        if self._pending:
+            self._matrix = sparse.vstack([self._matrix] + self._pending, format='csr')
+            self._pending = []
+
+    def search(self, processed_query, k=1, query_vec=None):
+        """
+        Поиск ближайших вопросов по косинусной схожести TF-IDF.
+        Аргументы:
+            processed_query (str): Лемматизированный запрос.
+            k (int): Количество результатов.
+            query_vec (sparse matrix): Готовый TF-IDF вектор запроса (опционально).
+        Возвращает:
+            list: Список кортежей (id элемента, схожесть) по убыванию схожести.
+        """
+        self.ensure_built()
+        with self._lock:
+            self._compact_locked()
+            if self._matrix.shape[0] == 0:
+                return []
+            if query_vec is None or query_vec.shape[1] != self._matrix.shape[1]:
+                # Вектор мог быть получен до фонового переобучения словаря
+                query_vec = self.vectorizer.transform([processed_query])
+            scores = (self._matrix @ query_vec.T).toarray().ravel()
+            scores[~np.asarray(self._alive, dtype=bool)] = -1.0
+            k = min(k, scores.shape[0])
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [(self._ids[i], float(scores[i])) for i in top if scores[i] >= 0]
+
+    def __len__(self):
+        return len(self._positions)
+
+    def needs_refit(self):
+        """
+        Проверка, отстал ли словарь от базы знаний: были вставки после обучения
+        или база изменилась в обход индекса (админка, другой процесс).
+        """
+        if not self.is_built:
+            return True
+        if self._appended_since_fit:
+            return True
+        return self._db_snapshot() != self._db_state
+
+    def start_refit_scheduler(self, interval):
+        """
+        Запуск фонового потока, который периодически переобучает индекс при изменении базы знаний.
+        Аргументы:
+            interval (float): Интервал проверки в секундах; 0 отключает переобучение.
+        """
+        if not interval or self._refit_thread is not None:
+            return
+        with self._lock:
+            if self._refit_thread is not None:
+                return
+
+            def run():
+                while True:
+                    time.sleep(interval)
+                    try:
+                        if self.needs_refit():
+                            logger.debug("Фоновое переобучение TF-IDF индекса")
+                            self.build()
+                    except Exception as e:
+                        logger.error(f"Ошибка фонового переобучения TF-IDF индекса: {str(e)}")
+                    finally:
+                        close_old_connections()
+
+            self._refit_thread = threading.Thread(target=run, name='tfidf-refit', daemon=True)
+            self._refit_thread.start()
+
+    def stats(self):
+        """
+        Статистика индекса.
+        """
+        return {
+            'documents': len(self._positions),
+            'rows': len(self._ids),
+            'vocabulary_size': len(getattr(self.vectorizer, 'vocabulary_', {}) or {}),
+            'appended_since_fit': self._appended_since_fit,
+            'fit_count': self.fit_count,
+            'last_fit_seconds': self.last_fit_seconds,
+        }
@@ -1,162 +1,326 @@
+import asyncio
+import concurrent.futures
+import hashlib
 import logging
-import random
-import time
-import requests
-from bs4 import BeautifulSoup
-from urllib.parse import quote
+import re
+import threading
+from collections import Counter, defaultdict
+import httpx
+from django.conf import settings
+from .search_backends import (  # noqa: F401
+    DEADLINE_CANCEL_MESSAGE, SEARCH_MAX_RESULTS, extract_google, extract_yandex, get_search_backends, parse_google, parse_yandex
+)
+from .search_cache import search_cache
 
 # Инициализация логгера для отслеживания процесса и ошибок
 logger = logging.getLogger(__name__)
 
-def search_internet(query, use_selenium=False):
+_PUNCTUATION_RE = re.compile(r'[^\w\s]+')
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+def normalize_question(text):
     """
-    Выполняет поиск в Google и Яндексе, парсит результаты и возвращает список с заголовками, выдержками и ссылками.
+    Нормализация вопроса для точного сравнения: нижний регистр, ё -> е, без пунктуации и лишних пробелов.
+    Аргументы:
+        text (str): Исходный текст.
+    Возвращает:
+        str: Нормализованный текст.
+    """
+    text = (text or '').lower().replace('ё', 'е')
+    text = _PUNCTUATION_RE.sub(' ', text)
+    return _WHITESPACE_RE.sub(' ', text).strip()
+
+
+def question_hash(text):
+    """
+    Хеш SHA-256 нормализованного вопроса для индексированного поиска точных совпадений.
+    Аргументы:
+        text (str): Исходный текст.
+    Возвращает:
+        str: Шестнадцатеричный хеш длиной 64 символа.
+    """
+    return hashlib.sha256(normalize_question(text).encode('utf-8')).hexdigest()
+
+
+NO_RESULTS_TITLE = 'Нет результатов'
+
+
+def no_results_placeholder(query, answered=True):
+    """
+    Дефолтный результат поиска при отсутствии данных.
     Аргументы:
         query (str): Поисковый запрос.
-        use_selenium (bool): Флаг для использования Selenium (по умолчанию False, так как требует настройки).
+        answered (bool): Хотя бы один источник ответил (пустой выдачей); False - поиск недоступен.
+    """
+    return [{
+        'title': NO_RESULTS_TITLE,
+        'snippet': f'Не удалось найти информацию по запросу "{query}". Попробуйте уточнить запрос.',
+        'link': '',
+        'answered': answered
+    }]
+
+
+def is_placeholder_result(result):
+    """
+    Проверка, что результат поиска - дефолтный результат при отсутствии данных, а не найденная страница.
+    """
+    return result.get('title') == NO_RESULTS_TITLE and not result.get('link')
+
+
+def search_answered(results):
+    """
+    Проверка, что результаты получены от источников: дефолтный результат без ответа источников означает,
+    что поиск был недоступен (выключатель, бюджет запросов, ошибки, срок поиска), а не пустую выдачу.
+    Аргументы:
+        results (list): Результаты search_internet.
     Возвращает:
-        list: Список словарей с ключами 'title', 'snippet', 'link' или дефолтный результат при отсутствии данных.
+        bool: False, если ни один источник не ответил.
+    """
+    return not any(is_placeholder_result(result) and result.get('answered') is False for result in results)
+
+
+def is_valid_snippet(text):
+    """
+    Проверка, что выдержка пригодна для ответа (не короче 5 символов).
+    Аргументы:
+        text (str): Текст выдержки.
+    Возвращает:
+        bool: True, если выдержка валидна.
+    """
+    return bool(text and len(text.strip()) >= 5)
+
+
+# Политики поиска: 'first' - вернуть результат, как только набрано достаточно валидных выдержек,
+# 'merge' - объединить все ответы, полученные до срока, 'all' - дождаться всех источников
+SEARCH_POLICIES = ('first', 'merge', 'all')
+
+# Итоги поиска по источникам: победы, завершения, отмены после победы другого источника и превышения срока
+search_outcomes = defaultdict(Counter)
+
+
+def search_policy_stats():
+    """
+    Статистика источников поиска для настройки политики и срока.
+    Возвращает:
+        dict: Счетчики итогов по источникам.
+    """
+    return {name: dict(counter) for name, counter in search_outcomes.items()}
+
+
+async def _search_engines(query, deadline, policy='first', on_results=None):
+    """
+    Одновременный поиск во всех выбранных источниках с общим ограничением времени.
+    При политике 'first' поиск завершается, как только ответившие источники дали SEARCH_MIN_VALID_RESULTS
+    валидных выдержек; запросы остальных источников отменяются.
+    Результаты источников, не ответивших к сроку, отбрасываются, их запросы отменяются.
+    on_results(name, results) вызывается для каждого источника, давшего валидные выдержки, по мере ответов.
+    Возвращает:
+        tuple: Объединенные результаты в порядке выбора источников, признак того,
+               что хотя бы один источник ответил (в том числе пустой выдачей), и признак того,
+               что поиск не был остановлен досрочно политикой 'first'.
     """
-    logger.debug(f"Начало выполнения функции search_internet для запроса: {query}")
+    loop = asyncio.get_running_loop()
+    engine_timeout = getattr(settings, 'SEARCH_ENGINE_TIMEOUT', 15)
+    if policy == 'all':
+        deadline = engine_timeout
+    timeout = httpx.Timeout(min(engine_timeout, deadline))
+    deadline_at = loop.time() + deadline
+    backends = await asyncio.to_thread(get_search_backends)
+    tasks = {
+        asyncio.create_task(backend.search(query, timeout, deadline_at)): backend.name
+        for backend in backends
+    }
+    if not tasks:
+        logger.error("Не выбрано ни одного источника поиска")
+        return [], False, True
 
-    # Список User-Agent'ов для ротации, чтобы избежать блокировок
-    user_agents = [
-        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/125.0.0.0 Safari/537.36",
-        "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/125.0.0.0 Safari/537.36",
-        "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:127.0) Gecko/20100101 Firefox/127.0",
-    ]
-    headers = {"User-Agent": random.choice(user_agents)}
-    logger.debug(f"Выбранный User-Agent: {headers['User-Agent']}")
+    min_valid = getattr(settings, 'SEARCH_MIN_VALID_RESULTS', 3)
+    finished = {}
+    valid_count = 0
+    winner = None
+    answered = False
+    timed_out = False
+    pending = set(tasks)
+    while pending:
+        done, pending = await asyncio.wait(
+            pending, timeout=max(0.0, deadline_at - loop.time()), return_when=asyncio.FIRST_COMPLETED
+        )
+        if not done:
+            timed_out = True
+            break
+        for task in done:
+            name = tasks[task]
+            # None - источник не ответил (выключатель, бюджет, ошибка запроса)
+            results = task.result() if not task.cancelled() and task.exception() is None else None
+            answered = answered or results is not None
+            results = finished[name] = results or []
+            search_outcomes[name]['completed'] += 1
+            valid = sum(1 for result in results if is_valid_snippet(result.get('snippet')))
+            if valid and winner is None:
+                winner = name
+            valid_count += valid
+            if valid and on_results is not None:
+                try:
+                    on_results(name, results)
+                except Exception as e:
+                    logger.error(f"Ошибка обработки промежуточных результатов {name}: {str(e)}")
+        if policy == 'first' and valid_count >= min_valid:
+            break
+
+    complete = True
+    for task in pending:
+        outcome = 'deadline' if timed_out or loop.time() >= deadline_at else 'cancelled'
+        complete = complete and outcome == 'deadline'
+        # Источник различает таймаут (учитывается выключателем) и отмену после ответа других источников
+        task.cancel(DEADLINE_CANCEL_MESSAGE if outcome == 'deadline' else None)
+        search_outcomes[tasks[task]][outcome] += 1
+        if outcome == 'deadline':
+            logger.warning(f"Поиск в {tasks[task]} для запроса '{query}' не уложился в срок {deadline} с")
+    if pending:
+        await asyncio.gather(*pending, return_exceptions=True)
+    if winner:
+        search_outcomes[winner]['wins'] += 1
+        logger.debug(f"Первые валидные результаты для запроса '{query}' получены от {winner} (политика {policy})")
 
     results = []
+    for name in tasks.values():
+        results.extend(finished.get(name, []))
+    return results, answered, complete
 
-    # Функция парсинга результатов Google с обновленными селекторами
-    def parse_google(soup):
-        """
-        Парсит результаты поиска Google на основе структуры HTML из скриншота.
-        Аргументы:
-            soup (BeautifulSoup): Разобранный HTML страницы Google.
-        Возвращает:
-            list: Список словарей с результатами поиска.
-        """
-        try:
-            logger.debug("Начало парсинга результатов Google")
-            # Основной контейнер результатов на основе скриншота
-            for result in soup.select('div#rso div.g'):
-                # Извлечение заголовка из тега h3 внутри ссылки
-                title_elem = result.select_one('h3.LC20lb')
-                if not title_elem:
-                    title_elem = result.select_one('h3')  # Резервный вариант
-                # Извлечение ссылки из тега a
-                link_elem = result.select_one('a[href]')
-                # Извлечение выдержки
-                snippet_elem = result.select_one('div.VwiC3b.YwPh0e') or result.select_one('div[data-snippet]')
-
-                # Проверка наличия всех необходимых элементов
-                if title_elem and link_elem and snippet_elem:
-                    title = title_elem.get_text(strip=True)
-                    link = link_elem['href'].replace("/url?q=", "").split("&")[0]  # Удаление параметров
-                    snippet = snippet_elem.get_text(strip=True)
-
-                    results.append({
-                        'title': title,
-                        'snippet': snippet,
-                        'link': link
-                    })
-                    logger.debug(f"Найден результат Google: {title} ({link})")
-                else:
-                    logger.warning("Не удалось извлечь все элементы из результата Google")
-            logger.debug(f"Google: найдено {len(results)} результатов")
-            return results
-        except Exception as e:
-            logger.error(f"Ошибка парсинга результатов Google: {str(e)}")
-            return []
-
-    # Функция парсинга результатов Яндекса с обновленными селекторами
-    def parse_yandex(soup):
-        """
-        Парсит результаты поиска Яндекса на основе структуры HTML из скриншота.
-        Аргументы:
-            soup (BeautifulSoup): Разобранный HTML страницы Яндекса.
-        Возвращает:
-            list: Список словарей с результатами поиска.
-        """
-        try:
-            logger.debug("Начало парсинга результатов Яндекса")
-            # Основной контейнер результатов
-            for result in soup.select('li.serp-item'):
-                # Извлечение заголовка
-                title_elem = result.select_one('a.organic__url b') or result.select_one('div.organic__title')
-                if not title_elem:
-                    title_elem = result.select_one('a.Link')
-                # Извлечение ссылки
-                link_elem = result.select_one('a.organic__url[href]') or result.select_one('a.Link[href]')
-                # Извлечение выдержки
-                snippet_elem = result.select_one('div.organic__text')
-
-                if title_elem and link_elem and snippet_elem:
-                    title = title_elem.get_text(strip=True)
-                    link = link_elem['href']
-                    snippet = snippet_elem.get_text(strip=True)
-
-                    results.append({
-                        'title': title,
-                        'snippet': snippet,
-                        'link': link
-                    })
-                    logger.debug(f"Найден результат Яндекса: {title} ({link})")
-                else:
-                    logger.warning("Не удалось извлечь все элементы из результата Яндекса")
-            logger.debug(f"Яндекс: найдено {len(results)} результатов")
-            return results
-        except Exception as e:
-            logger.error(f"Ошибка парсинга результатов Яндекса: {str(e)}")
-            return []
-
-    # Выполнение поиска в Google
-    try:
-        google_url = f"https://www.google.com/search?q={quote(query)}"
-        logger.debug(f"Выполняется поиск в Google по URL: {google_url}")
-        response = requests.get(google_url, headers=headers, timeout=15)
-        response.raise_for_status()  # Проверка на успешный ответ
-        logger.debug(f"Статус ответа Google: {response.status_code}")
-        soup = BeautifulSoup(response.text, 'html.parser')
-        google_results = parse_google(soup)
-        results.extend(google_results)
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Поиск в Google для запроса '{query}' завершился неудачей: {str(e)}")
-    except Exception as e:
-        logger.error(f"Неожиданная ошибка в поиске Google для запроса '{query}': {str(e)}")
-
-    # Добавление случайной задержки для имитации человеческого поведения
-    delay = random.uniform(3, 10)
-    logger.debug(f"Задержка перед поиском в Яндексе: {delay} секунд")
-    time.sleep(delay)
-
-    # Выполнение поиска в Яндексе
-    try:
-        yandex_url = f"https://yandex.ru/search/?text={quote(query)}"
-        logger.debug(f"Выполняется поиск в Яндексе по URL: {yandex_url}")
-        response = requests.get(yandex_url, headers=headers, timeout=15)
-        response.raise_for_status()
-        logger.debug(f"Статус ответа Яндекса: {response.status_code}")
-        soup = BeautifulSoup(response.text, 'html.parser')
-        yandex_results = parse_yandex(soup)
-        results.extend(yandex_results)
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Поиск в Яндексе для запроса '{query}' завершился неудачей: {str(e)}")
-    except Exception as e:
-        logger.error(f"Неожиданная ошибка в поиске Яндекса для запроса '{query}': {str(e)}")
+
+async def async_search_internet(query, deadline=None, use_cache=True, refresh=False, policy=None, on_results=None):
+    """
+    Асинхронно выполняет поиск во всех выбранных источниках (по умолчанию Google и Яндекс) одновременно
+    с общим ограничением времени.
+    Непустые результаты сохраняются в кеше поиска по нормализованному запросу; результаты части источников,
+    на которых политика 'first' остановила поиск, хранятся только SEARCH_PARTIAL_CACHE_TTL секунд.
+    Аргументы:
+        query (str): Поисковый запрос.
+        deadline (float): Общее время ожидания в секундах (по умолчанию SEARCH_DEADLINE).
+        use_cache (bool): Использовать кеш результатов поиска.
+        refresh (bool): Выполнить поиск без чтения кеша и обновить кеш полученными результатами.
+        policy (str): Политика ожидания источников из SEARCH_POLICIES (по умолчанию SEARCH_POLICY).
+        on_results (callable): Функция (name, results), получающая результаты источников по мере ответов
+            (не вызывается при ответе из кеша).
+    Возвращает:
+        list: Список словарей с ключами 'title', 'snippet', 'link' или дефолтный результат при отсутствии данных.
+    """
+    deadline = deadline or getattr(settings, 'SEARCH_DEADLINE', 8)
+    policy = policy or getattr(settings, 'SEARCH_POLICY', 'first')
+    if policy not in SEARCH_POLICIES:
+        raise ValueError(f"Неизвестная политика поиска: {policy}")
+    logger.debug(f"Начало выполнения функции search_internet для запроса: {query} (срок {deadline} с)")
+    cache_key = question_hash(query)
+    if use_cache and not refresh:
+        cached = await asyncio.to_thread(search_cache.get, cache_key)
+        if cached is not None:
+            logger.debug(f"Результаты поиска для запроса '{query}' найдены в кеше")
+            return cached
+
+    results, answered, complete = await _search_engines(query, deadline, policy, on_results)
+    # Ограничение количества результатов до 10
+    results = results[:SEARCH_MAX_RESULTS]
 
     # Если результатов нет, возвращаем дефолтный ответ
     if not results:
-        logger.warning(f"Результатов поиска не найдено для запроса: {query}")
-        return [{
-            'title': 'Нет результатов',
-            'snippet': f'Не удалось найти информацию по запросу "{query}". Попробуйте уточнить запрос.',
-            'link': ''
-        }]
+        if answered:
+            logger.warning(f"Результатов поиска не найдено для запроса: {query}")
+        else:
+            logger.warning(f"Ни один источник поиска не ответил на запрос: {query}")
+        return no_results_placeholder(query, answered)
 
-    # Ограничение количества результатов до 10
+    if use_cache:
+        # Ранний ответ 'first' недолго заменяет объединенный результат: повтор запроса опросит все источники
+        ttl = None if complete else getattr(settings, 'SEARCH_PARTIAL_CACHE_TTL', 300)
+        await asyncio.to_thread(search_cache.set, cache_key, results, ttl)
     logger.debug(f"Всего возвращено {len(results)} результатов")
-    return results[:10]
\ No newline at end of file
+    return results
+
+
+_search_loop = None
+_search_loop_lock = threading.Lock()
+
+
+def get_search_loop():
+    """
+    Цикл событий поисковой подсистемы в отдельном фоновом потоке.
+    Синхронные вызовы из любых потоков (представления, Telegram бот) выполняют поиск в нем.
+    Возвращает:
+        asyncio.AbstractEventLoop: Запущенный цикл событий.
+    """
+    global _search_loop
+    if _search_loop is None:
+        with _search_loop_lock:
+            if _search_loop is None:
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=loop.run_forever, name='search-loop', daemon=True)
+                thread.start()
+                _search_loop = loop
+    return _search_loop
+
+
+def run_in_search_loop(coro):
+    """
+    Выполнение корутины в цикле событий поисковой подсистемы.
+    Возвращает:
+        concurrent.futures.Future: Future результата корутины.
+    """
+    return asyncio.run_coroutine_threadsafe(coro, get_search_loop())
+
+
+def search_internet(query, use_selenium=False, deadline=None, use_cache=True, refresh=False, policy=None):
+    """
+    Выполняет поиск в Google и Яндексе, парсит результаты и возвращает список с заголовками, выдержками и ссылками.
+    Синхронная обертка над async_search_internet.
+    Аргументы:
+        query (str): Поисковый запрос.
+        use_selenium (bool): Флаг для использования Selenium (по умолчанию False, так как требует настройки).
+        deadline (float): Общее время ожидания в секундах (по умолчанию SEARCH_DEADLINE).
+        use_cache (bool): Использовать кеш результатов поиска.
+        refresh (bool): Выполнить поиск без чтения кеша и обновить кеш полученными результатами.
+        policy (str): Политика ожидания источников: 'first', 'merge' или 'all' (по умолчанию SEARCH_POLICY).
+    Возвращает:
+        list: Список словарей с ключами 'title', 'snippet', 'link' или дефолтный результат при отсутствии данных.
+    """
+    future = run_in_search_loop(async_search_internet(query, deadline, use_cache, refresh, policy))
+    # Ожидание ограничено сроком поиска с запасом, чтобы остановка цикла поиска не блокировала вызывающий поток
+    timeout = deadline or getattr(settings, 'SEARCH_DEADLINE', 8)
+    if (policy or getattr(settings, 'SEARCH_POLICY', 'first')) == 'all':
+        timeout = getattr(settings, 'SEARCH_ENGINE_TIMEOUT', 15)
+    timeout += getattr(settings, 'SEARCH_RESULT_TIMEOUT_MARGIN', 5)
+    try:
+        return future.result(timeout=timeout)
+    except concurrent.futures.TimeoutError:
+        future.cancel()
+        logger.error(f"Цикл поиска не вернул результат для запроса '{query}' за {timeout} с")
+        return no_results_placeholder(query, answered=False)
+
+
+async def asearch_internet(query, deadline=None, use_cache=True, refresh=False, policy=None, on_results=None):
+    """
+    Асинхронный вариант search_internet для асинхронных представлений и Telegram бота.
+    Поиск выполняется в цикле событий поисковой подсистемы (общий пул соединений и ограничения частоты),
+    вызывающий цикл событий только ожидает результат.
+    Аргументы:
+        query (str): Поисковый запрос.
+        deadline (float): Общее время ожидания в секундах (по умолчанию SEARCH_DEADLINE).
+        use_cache (bool): Использовать кеш результатов поиска.
+        refresh (bool): Выполнить поиск без чтения кеша и обновить кеш полученными результатами.
+        policy (str): Политика ожидания источников (по умолчанию SEARCH_POLICY).
+        on_results (callable): Функция (name, results) для результатов источников по мере ответов;
+            вызывается в цикле событий вызывающего.
+    Возвращает:
+        list: Список словарей с ключами 'title', 'snippet', 'link' или дефолтный результат при отсутствии данных.
+    """
+    if on_results is not None:
+        # Поиск выполняется в другом цикле событий: промежуточные результаты передаются в цикл вызывающего
+        loop = asyncio.get_running_loop()
+        callback = on_results
+
+        def on_results(name, results):
+            loop.call_soon_threadsafe(callback, name, results)
+
+    return await asyncio.wrap_future(
+        run_in_search_loop(async_search_internet(query, deadline, use_cache, refresh, policy, on_results))
+    )
@@ -0,0 +1,79 @@
+import random
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from aichat.models import Conversation, Message, User
+
+BENCHMARK_USERNAME = 'benchmark-dedup'
+
+class Command(BaseCommand):
+    help = 'Benchmarks duplicate message detection: unindexed text comparison vs indexed text_hash lookup'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=1000000, help='Number of messages in the benchmark conversation')
+        parser.add_argument('--lookups', type=int, default=200, help='Number of duplicate checks per method')
+        parser.add_argument('--batch', type=int, default=10000, help='bulk_create batch size')
+        parser.add_argument('--keep', action='store_true', help='Keep the generated conversation for later runs')
+
+    def _populate(self, conversation, count, batch_size):
+        existing = Message.objects.filter(conversation=conversation).count()
+        if existing >= count:
+            return
+        self.stdout.write(f'Creating {count - existing} messages...')
+        started = time.perf_counter()
+        for start in range(existing, count, batch_size):
+            batch = []
+            for i in range(start, min(start + batch_size, count)):
+                text = f'Сообщение пользователя номер {i}: как найти информацию по запросу {i * 7919 % 100003}?'
+                # bulk_create не вызывает save(), хеш заполняется явно
+                batch.append(Message(
+                    conversation=conversation, text=text, text_hash=Message.hash_text(text), is_user_message=i % 2 == 0
+                ))
+            with transaction.atomic():
+                Message.objects.bulk_create(batch)
+        self.stdout.write(f'Created in {time.perf_counter() - started:.1f} s')
+
+    def _measure(self, check, texts):
+        started = time.perf_counter()
+        found = sum(1 for text in texts if check(text))
+        return (time.perf_counter() - started) / len(texts), found
+
+    def handle(self, *args, **options):
+        user, _ = User.objects.get_or_create(username=BENCHMARK_USERNAME, defaults={'is_active': False})
+        conversation, _ = Conversation.objects.get_or_create(user=user, title='Duplicate detection benchmark')
+        self._populate(conversation, options['messages'], options['batch'])
+
+        sample = list(
+            Message.objects.filter(conversation=conversation, is_user_message=True)
+            .order_by('?').values_list('text', flat=True)[:options['lookups'] // 2]
+        )
+        texts = sample + [f'Новое сообщение {i}' for i in range(options['lookups'] - len(sample))]
+        random.shuffle(texts)
+
+        def legacy(text):
+            return Message.objects.filter(conversation=conversation, text=text, is_user_message=True).exists()
+
+        def hashed(text):
+            return Message.user_duplicates(conversation, text).exists()
+
+        self.stdout.write(f'Messages: {Message.objects.filter(conversation=conversation).count()}, lookups: {len(texts)}')
+        legacy_time, legacy_found = self._measure(legacy, texts)
+        hashed_time, hashed_found = self._measure(hashed, texts)
+        self.stdout.write(f'{"text comparison":<20}{legacy_time * 1000:>10.3f} ms/lookup  found {legacy_found}')
+        self.stdout.write(f'{"text_hash index":<20}{hashed_time * 1000:>10.3f} ms/lookup  found {hashed_found}')
+        self.stdout.write(f'Plan (text_hash): {Message.user_duplicates(conversation, texts[0]).explain()}')
+
+        if not options['keep']:
+            # Удаление пачками: каскадное удаление всей беседы превышает ограничение параметров SQLite
+            messages = Message.objects.filter(conversation=conversation)
+            while True:
+                ids = list(messages.values_list('id', flat=True)[:options['batch']])
+                if not ids:
+                    break
+                Message.objects.filter(id__in=ids).delete()
+            conversation.delete()
+            user.delete()
+        if legacy_found != hashed_found:
+            self.stdout.write(self.style.ERROR('Methods found different numbers of duplicates'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Speedup: {legacy_time / hashed_time:.1f}x'))
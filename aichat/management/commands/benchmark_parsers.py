@@ -0,0 +1,86 @@
+import os
+import time
+import tracemalloc
+from urllib.parse import quote
+import httpx
+from bs4 import BeautifulSoup
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from aichat.machine_learning.http_pool import USER_AGENTS
+from aichat.machine_learning.search_backends import (
+    HTML_PARSER, SEARCH_MAX_RESULTS, GoogleHTMLBackend, YandexHTMLBackend, parse_google, parse_yandex
+)
+
+HTML_BACKENDS = [GoogleHTMLBackend, YandexHTMLBackend]
+
+# Эталонный разбор: полное дерево html.parser, как до ограниченного извлечения
+REFERENCE_PARSERS = {'google': parse_google, 'yandex': parse_yandex}
+
+class Command(BaseCommand):
+    help = 'Benchmarks bounded search page extraction against full-tree parsing on saved HTML fixtures'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--fixtures', default=os.path.join(settings.BASE_DIR, 'aichat', 'machine_learning', 'serp_fixtures'),
+            help='Directory with <engine>_<name>.html fixtures'
+        )
+        parser.add_argument('--save', nargs='+', metavar='QUERY', help='Download result pages for queries into --fixtures')
+        parser.add_argument('--repeat', type=int, default=5, help='Number of timed passes per page')
+
+    def _save(self, directory, queries):
+        os.makedirs(directory, exist_ok=True)
+        with httpx.Client(headers={"User-Agent": USER_AGENTS[0]}, follow_redirects=True, timeout=15) as client:
+            for index, query in enumerate(queries):
+                for backend in HTML_BACKENDS:
+                    response = client.get(backend.url_template.format(query=quote(query)))
+                    path = os.path.join(directory, f'{backend.name}_{index}.html')
+                    with open(path, 'w', encoding='utf-8') as f:
+                        f.write(response.text)
+                    self.stdout.write(f'Saved {path} ({response.status_code}, {len(response.text)} chars)')
+
+    @staticmethod
+    def _measure(func, html, repeat):
+        tracemalloc.start()
+        result = func(html)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        started = time.perf_counter()
+        for _ in range(repeat):
+            func(html)
+        return result, (time.perf_counter() - started) / repeat, peak
+
+    def handle(self, *args, **options):
+        directory = options['fixtures']
+        if options['save']:
+            self._save(directory, options['save'])
+        if not os.path.isdir(directory):
+            raise CommandError(f'Fixtures directory not found: {directory}')
+
+        extractors = {backend.name: backend.extract for backend in HTML_BACKENDS}
+        repeat = max(1, options['repeat'])
+        self.stdout.write(f'Fast path parser: {HTML_PARSER}, max results: {SEARCH_MAX_RESULTS}')
+        self.stdout.write(
+            f'{"fixture":<28}{"KB":>8}{"full ms":>10}{"fast ms":>10}{"full MB":>10}{"fast MB":>10}{"results":>9}  same'
+        )
+        mismatches = 0
+        for filename in sorted(os.listdir(directory)):
+            engine = filename.split('_', 1)[0]
+            if not filename.endswith('.html') or engine not in extractors:
+                continue
+            with open(os.path.join(directory, filename), encoding='utf-8') as f:
+                html = f.read()
+            reference_parser = REFERENCE_PARSERS[engine]
+            reference, full_time, full_peak = self._measure(
+                lambda page: reference_parser(BeautifulSoup(page, 'html.parser'))[:SEARCH_MAX_RESULTS], html, repeat
+            )
+            result, fast_time, fast_peak = self._measure(
+                lambda page: extractors[engine](page, SEARCH_MAX_RESULTS), html, repeat
+            )
+            same = result == reference
+            mismatches += not same
+            self.stdout.write(
+                f'{filename:<28}{len(html) / 1024:>8.0f}{full_time * 1000:>10.2f}{fast_time * 1000:>10.2f}'
+                f'{full_peak / 2 ** 20:>10.2f}{fast_peak / 2 ** 20:>10.2f}{len(result):>9}  {"yes" if same else "NO"}'
+            )
+        if mismatches:
+            raise CommandError(f'{mismatches} fixture(s) produced different results')
@@ -0,0 +1,76 @@
+import time
+from collections import Counter
+from django.core.management.base import BaseCommand, CommandError
+from aichat.models import Message
+from aichat.machine_learning.registry import SPACY_MODEL_NAME
+from aichat.machine_learning.text_preprocessing import (
+    PymorphyPreprocessor, SpacyPreprocessor, SPACY_UNUSED_COMPONENTS
+)
+
+class Command(BaseCommand):
+    help = 'Compares text preprocessing backends against the full spaCy pipeline (token agreement and speed)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--file', help='UTF-8 text file with one input per line (default: user messages)')
+        parser.add_argument('--limit', type=int, default=1000, help='Maximum number of inputs')
+        parser.add_argument('--repeat', type=int, default=1, help='Number of passes over the inputs')
+
+    def _load_texts(self, options):
+        if options['file']:
+            with open(options['file'], encoding='utf-8') as f:
+                texts = [line.strip() for line in f if line.strip()]
+        else:
+            texts = list(
+                Message.objects.filter(is_user_message=True).values_list('text', flat=True)[:options['limit']]
+            )
+        if not texts:
+            raise CommandError('No input texts: pass --file or add user messages first')
+        return texts[:options['limit']]
+
+    @staticmethod
+    def _reference(nlp, text):
+        doc = nlp(text.lower())
+        return ' '.join(token.lemma_ for token in doc if not token.is_stop and not token.is_punct)
+
+    @staticmethod
+    def _timed(func, repeat):
+        started = time.perf_counter()
+        for _ in range(repeat):
+            result = func()
+        return result, time.perf_counter() - started
+
+    @staticmethod
+    def _agreement(reference, candidate):
+        matched = total = exact = 0
+        for ref_text, cand_text in zip(reference, candidate):
+            ref_tokens = Counter(ref_text.split())
+            cand_tokens = Counter(cand_text.split())
+            matched += sum((ref_tokens & cand_tokens).values())
+            total += max(sum(ref_tokens.values()), sum(cand_tokens.values()))
+            exact += ref_text == cand_text
+        return (matched / total if total else 1.0), exact / len(reference)
+
+    def handle(self, *args, **options):
+        import spacy
+        texts = self._load_texts(options)
+        repeat = max(1, options['repeat'])
+        self.stdout.write(f'Inputs: {len(texts)}, passes: {repeat}')
+
+        full_nlp = spacy.load(SPACY_MODEL_NAME)
+        reference, reference_time = self._timed(lambda: [self._reference(full_nlp, t) for t in texts], repeat)
+        self.stdout.write(f'{"backend":<22}{"seconds":>10}{"speedup":>10}{"tokens":>10}{"exact":>10}')
+        self.stdout.write(f'{"spacy (full, current)":<22}{reference_time:>10.3f}{1.0:>10.2f}{1.0:>10.3f}{1.0:>10.3f}')
+
+        backends = [
+            ('spacy (trimmed)', SpacyPreprocessor(spacy.load(SPACY_MODEL_NAME, exclude=SPACY_UNUSED_COMPONENTS))),
+        ]
+        try:
+            backends.append(('pymorphy', PymorphyPreprocessor()))
+        except ImportError as e:
+            self.stdout.write(self.style.WARNING(f'pymorphy3 backend unavailable: {e}'))
+
+        for name, backend in backends:
+            result, seconds = self._timed(lambda: backend.preprocess_many(texts), repeat)
+            token_agreement, exact = self._agreement(reference, result)
+            speedup = reference_time / seconds if seconds else float('inf')
+            self.stdout.write(f'{name:<22}{seconds:>10.3f}{speedup:>10.2f}{token_agreement:>10.3f}{exact:>10.3f}')
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from aichat.machine_learning.embedding_store import embedding_store
+from aichat.machine_learning.nlp_processor import NLPProcessor
+
+class Command(BaseCommand):
+    help = 'Computes and stores missing BERT embeddings for KnowledgeBase questions'
+
+    def handle(self, *args, **kwargs):
+        nlp_processor = NLPProcessor(load_immediately=False)
+        embedding_store.load()
+        filled = embedding_store.backfill(nlp_processor)
+        if embedding_store.needs_rebuild():
+            embedding_store.rebuild_ann()
+        self.stdout.write(self.style.SUCCESS(
+            f"Embeddings ready: {len(embedding_store)} ({embedding_store.stats()['mode']}), computed {filled}"
+        ))
@@ -1,10 +1,14 @@
 from django.core.management.base import BaseCommand
 from django.core.cache import caches
+from aichat.machine_learning.search_cache import negative_search_cache, search_cache
 
 class Command(BaseCommand):
-    help = 'Clearcache'
+    help = 'Clear all caches; other workers drop their in-memory search caches within SEARCH_CACHE_GENERATION_CHECK seconds'
 
     def handle(self, *args, **kwargs):
         for cache_name in caches:
             caches[cache_name].clear()
+        # После очистки файлового кеша: записывают новое поколение, по которому сбрасываются кеши других процессов
+        search_cache.clear()
+        negative_search_cache.clear()
         self.stdout.write('Cache cleared successfully!')
\ No newline at end of file
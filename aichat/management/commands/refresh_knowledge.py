@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from aichat.machine_learning.knowledge_refresh import KnowledgeRefresher
+from aichat.machine_learning.response_handler import ResponseHandler
+
+class Command(BaseCommand):
+    help = 'Re-runs web search for the most used stale KnowledgeBase answers and updates them in place'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, help='Maximum number of entries (default: KB_REFRESH_BATCH)')
+        parser.add_argument('--max-age', type=int, help='Refresh entries older than this many seconds (default: KB_REFRESH_MAX_AGE)')
+        parser.add_argument('--dry-run', action='store_true', help='Only list entries that would be refreshed')
+
+    def handle(self, *args, **options):
+        refresher = KnowledgeRefresher(ResponseHandler())
+        if options['dry_run']:
+            for item in refresher.stale_items(options['limit'], options['max_age']):
+                self.stdout.write(f'{item.id}: {item.search_query}')
+            return
+        # Под той же блокировкой, что и фоновое обновление: одновременно обновляет только один процесс
+        refreshed = refresher.run_once(options['limit'], options['max_age'])
+        if refreshed is None:
+            self.stdout.write(self.style.WARNING('Another process is refreshing the knowledge base, skipped'))
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f"Refreshed {refreshed} answers ({refresher.counters['failed']} failed)"
+        ))
@@ -0,0 +1,39 @@
+import signal
+import threading
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from aichat.machine_learning.answer_queue import answer_queue
+
+class Command(BaseCommand):
+    help = 'Runs a local pool of workers that generate AI answers for queued messages (AI_ANSWER_QUEUE)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=getattr(settings, 'ANSWER_WORKERS', 4),
+            help='Number of worker threads (default: ANSWER_WORKERS)'
+        )
+        parser.add_argument('--once', action='store_true', help='Process pending jobs and exit')
+
+    def handle(self, *args, **options):
+        if options['once']:
+            processed = answer_queue.run_pending(answer_queue.worker_name(0))
+            self.stdout.write(self.style.SUCCESS(f'Processed {processed} jobs'))
+            return
+
+        stop_event = threading.Event()
+
+        def handle_shutdown(signum, frame):
+            self.stdout.write('Stopping answer workers...')
+            stop_event.set()
+
+        signal.signal(signal.SIGINT, handle_shutdown)
+        signal.signal(signal.SIGTERM, handle_shutdown)
+
+        workers = max(1, options['workers'])
+        threads = answer_queue.start_workers(workers, stop_event)
+        self.stdout.write(self.style.SUCCESS(f'Started {workers} answer workers'))
+        while not stop_event.is_set():
+            stop_event.wait(1)
+        for thread in threads:
+            thread.join()
+        self.stdout.write(self.style.SUCCESS(f'Answer workers stopped: {answer_queue.stats()}'))
@@ -0,0 +1,101 @@
+import json
+import os
+import random
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import count
+from urllib.parse import parse_qs, urlparse
+import httpx
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from aichat.machine_learning.search_backends import SearchAPIBackend
+from aichat.machine_learning.utils import question_hash
+
+class Command(BaseCommand):
+    help = 'Runs a local search API stub that replays recorded SearchApi responses with configurable latency'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--responses', default=os.path.join(settings.BASE_DIR, 'data', 'search_stub'),
+            help='Directory with recorded <question hash>.json responses'
+        )
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--latency', type=float, default=0, help='Added latency per request, ms')
+        parser.add_argument('--jitter', type=float, default=0, help='Random extra latency up to this value, ms')
+        parser.add_argument('--record', nargs='+', metavar='QUERY', help='Record real SearchApi responses and exit')
+
+    def _record(self, directory, queries):
+        backend = SearchAPIBackend()
+        if not backend.is_configured():
+            raise CommandError('SEARCHAPI_API_KEY is not set')
+        os.makedirs(directory, exist_ok=True)
+        with httpx.Client(timeout=30) as client:
+            for query in queries:
+                url, kwargs = backend.request(query)
+                response = client.get(url, **kwargs)
+                response.raise_for_status()
+                data = response.json()
+                data['query'] = query
+                path = os.path.join(directory, f'{question_hash(query)}.json')
+                with open(path, 'w', encoding='utf-8') as f:
+                    json.dump(data, f, ensure_ascii=False)
+                self.stdout.write(f'Recorded {path} ({len(data.get("organic_results", []))} results)')
+
+    @staticmethod
+    def _load(directory):
+        responses = {}
+        if os.path.isdir(directory):
+            for filename in sorted(os.listdir(directory)):
+                if filename.endswith('.json'):
+                    with open(os.path.join(directory, filename), encoding='utf-8') as f:
+                        responses[filename[:-len('.json')]] = json.load(f)
+        return responses
+
+    def handle(self, *args, **options):
+        if options['record']:
+            self._record(options['responses'], options['record'])
+            return
+
+        responses = self._load(options['responses'])
+        recorded = list(responses.values())
+        sequence = count()
+        latency = options['latency'] / 1000
+        jitter = options['jitter'] / 1000
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                query = parse_qs(urlparse(self.path).query).get('q', [''])[0]
+                data = responses.get(question_hash(query))
+                if data is None and recorded:
+                    # Незаписанные запросы получают записанные ответы по кругу
+                    data = recorded[next(sequence) % len(recorded)]
+                if data is None:
+                    data = {'organic_results': [
+                        {'title': f'{query} {i}', 'link': f'https://example.com/{i}', 'snippet': f'Результат {i} по запросу {query}'}
+                        for i in range(1, 6)
+                    ]}
+                time.sleep(latency + random.uniform(0, jitter))
+                body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((options['host'], options['port']), Handler)
+        self.stdout.write(self.style.SUCCESS(
+            f'Search stub on http://{options["host"]}:{options["port"]}/api/v1/search '
+            f'({len(recorded)} recorded responses, latency {options["latency"]}+{options["jitter"]} ms)'
+        ))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-18 04:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('aichat', '0004_alter_conversation_options_alter_message_options_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='knowledgebase',
+            name='question_embedding',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
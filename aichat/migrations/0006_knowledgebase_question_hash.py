@@ -0,0 +1,22 @@
+# Generated by Django 5.2 on 2026-10-18 04:39
+
+from django.db import migrations, models
+
+# Существующие элементы хранят только обработанный вопрос (лемматизированный, без стоп-слов),
+# хеш которого никогда не совпадет с хешем исходного вопроса, поэтому они остаются без хеша
+# и получают его при первом повторном использовании
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('aichat', '0005_knowledgebase_question_embedding'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='knowledgebase',
+            name='question_hash',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=64),
+        ),
+    ]
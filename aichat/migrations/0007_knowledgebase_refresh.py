@@ -0,0 +1,40 @@
+# Generated by Django 5.2 on 2026-10-18 04:50
+
+from django.db import migrations, models
+
+
+def backfill_search_query(apps, schema_editor):
+    # Исходные вопросы существующих элементов не сохранены: для ответов из поиска (с источниками)
+    # запросом обновления служит обработанный вопрос
+    KnowledgeBase = apps.get_model('aichat', 'KnowledgeBase')
+    batch = []
+    for item in KnowledgeBase.objects.only('id', 'question_pattern', 'sources').iterator(chunk_size=1000):
+        if item.sources:
+            item.search_query = item.question_pattern
+            batch.append(item)
+        if len(batch) >= 1000:
+            KnowledgeBase.objects.bulk_update(batch, ['search_query'])
+            batch = []
+    if batch:
+        KnowledgeBase.objects.bulk_update(batch, ['search_query'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('aichat', '0006_knowledgebase_question_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='knowledgebase',
+            name='refreshed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='knowledgebase',
+            name='search_query',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.RunPython(backfill_search_query, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2 on 2026-10-18 05:03
+
+import hashlib
+
+from django.db import migrations, models
+
+
+def backfill_text_hash(apps, schema_editor):
+    # Индекс создается после заполнения хешей, чтобы не перестраивать его на каждом обновлении
+    Message = apps.get_model('aichat', 'Message')
+    batch = []
+    for message in Message.objects.only('id', 'text').iterator(chunk_size=5000):
+        message.text_hash = hashlib.sha256(message.text.encode('utf-8')).hexdigest()
+        batch.append(message)
+        if len(batch) >= 5000:
+            Message.objects.bulk_update(batch, ['text_hash'])
+            batch = []
+    if batch:
+        Message.objects.bulk_update(batch, ['text_hash'])
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('aichat', '0008_answerjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='text_hash',
+            field=models.CharField(blank=True, default='', editable=False, max_length=64),
+        ),
+        migrations.RunPython(backfill_text_hash, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['conversation', 'is_user_message', 'text_hash'], name='message_duplicate_idx'),
+        ),
+    ]
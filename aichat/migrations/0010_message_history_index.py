@@ -0,0 +1,17 @@
+# Generated by Django 5.2 on 2026-10-18 05:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('aichat', '0009_message_text_hash'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['conversation', 'id'], name='message_history_idx'),
+        ),
+    ]
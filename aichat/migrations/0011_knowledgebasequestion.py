@@ -0,0 +1,23 @@
+# Generated by Django 5.2 on 2026-10-18 05:26
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('aichat', '0010_message_history_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='KnowledgeBaseQuestion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('question_hash', models.CharField(max_length=64, unique=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('knowledge_item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='question_hashes', to='aichat.knowledgebase')),
+            ],
+        ),
+    ]
@@ -1,3 +1,4 @@
+import hashlib
 from django.db import models
 from django.contrib.auth.models import AbstractUser, Group, Permission
 from django.utils.translation import gettext_lazy as _
@@ -54,9 +55,73 @@ class Message(models.Model):
     is_ai_generated = models.BooleanField(default=False)
     sources = models.JSONField(default=list, blank=True)
     # sources = models.JSONField(blank=True, null=True)  # Для хранения источников информации
+    # SHA-256 текста сообщения для индексированной проверки дублей (заполняется при сохранении)
+    text_hash = models.CharField(max_length=64, blank=True, default='', editable=False)
 
     class Meta:
         ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['conversation', 'is_user_message', 'text_hash'], name='message_duplicate_idx'),
+            # Постраничная загрузка истории беседы по id (before_id/after_id в get_messages)
+            models.Index(fields=['conversation', 'id'], name='message_history_idx'),
+        ]
+
+    @staticmethod
+    def hash_text(text):
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    @classmethod
+    def user_duplicates(cls, conversation, text):
+        """
+        Сообщения пользователя беседы с тем же текстом: поиск по индексу хеша,
+        сравнение текста исключает совпадения хешей разных текстов.
+        """
+        return cls.objects.filter(
+            conversation=conversation, is_user_message=True, text_hash=cls.hash_text(text), text=text
+        )
+
+    def save(self, *args, **kwargs):
+        self.text_hash = self.hash_text(self.text)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'text' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'text_hash'}
+        super().save(*args, **kwargs)
+
+
+class AnswerJob(models.Model):
+    """
+    Задание фоновой генерации ответа ИИ на сообщение пользователя (очередь в базе данных).
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Ожидает'),
+        (STATUS_RUNNING, 'Выполняется'),
+        (STATUS_DONE, 'Выполнено'),
+        (STATUS_FAILED, 'Ошибка'),
+    ]
+
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='answer_jobs')
+    user_message = models.OneToOneField(Message, on_delete=models.CASCADE, related_name='answer_job')
+    ai_message = models.OneToOneField(
+        Message, on_delete=models.SET_NULL, blank=True, null=True, related_name='answered_job'
+    )
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.IntegerField(default=0)
+    error = models.TextField(blank=True, default='')
+    # Имя обработчика, выполняющего задание, и срок его аренды: после срока задание возвращается в очередь
+    worker = models.CharField(max_length=100, blank=True, default='')
+    lease_expires_at = models.DateTimeField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+        ]
 
 
 class KnowledgeBase(models.Model):
@@ -66,6 +131,16 @@ class KnowledgeBase(models.Model):
     confidence_score = models.FloatField(default=0.0)
     last_used = models.DateTimeField(auto_now=True)
     usage_count = models.IntegerField(default=0)
+    # Вложение BERT вопроса (float32), вычисляется один раз при записи элемента
+    question_embedding = models.BinaryField(blank=True, null=True, editable=False)
+    # SHA-256 нормализованного исходного вопроса для быстрого поиска точных совпадений.
+    # Элементы, созданные до его появления, хранят только обработанный вопрос и получают хеш
+    # при первом повторном использовании (ExactMatchCache.link)
+    question_hash = models.CharField(max_length=64, blank=True, default='', db_index=True)
+    # Поисковый запрос, по которому был получен ответ из интернета (пусто для ответов не из поиска)
+    search_query = models.TextField(blank=True, default='')
+    # Время последнего фонового обновления ответа повторным поиском
+    refreshed_at = models.DateTimeField(blank=True, null=True)
 
     class Meta:
         indexes = [
@@ -73,6 +148,16 @@ class KnowledgeBase(models.Model):
         ]
 
 
+class KnowledgeBaseQuestion(models.Model):
+    """
+    Другие формулировки вопроса, отвечаемые элементом базы знаний (найденные как похожие вопросы):
+    хеш нормализованной формулировки для быстрого пути точных совпадений во всех процессах.
+    """
+    question_hash = models.CharField(max_length=64, unique=True)
+    knowledge_item = models.ForeignKey(KnowledgeBase, on_delete=models.CASCADE, related_name='question_hashes')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+
 class SystemSettings(models.Model):
     name = models.CharField(max_length=100, unique=True)
     value = models.JSONField()
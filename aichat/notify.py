@@ -0,0 +1,164 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import defaultdict
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Max
+from .models import Message
+
+# Инициализация логирования
+logger = logging.getLogger(__name__)
+
+
+class _Waiter:
+    """
+    Подписка потока сообщений беседы: событие в цикле событий подписчика.
+    """
+
+    def __init__(self, conversation_id):
+        self.conversation_id = conversation_id
+        self.loop = asyncio.get_running_loop()
+        self.event = asyncio.Event()
+
+
+class MessageHub:
+    """
+    Оповещение открытых потоков сообщений (stream_messages) о новых сообщениях бесед.
+    Сообщения, созданные в процессе, оповещают подписчиков сразу (сигнал post_save после фиксации транзакции).
+    Сообщения других процессов (обработчики очереди ответов, Telegram бот) находит один фоновый поток,
+    проверяющий новые сообщения раз в MESSAGE_HUB_POLL_INTERVAL секунд, пока есть подписчики, -
+    один запрос на процесс вместо запроса на каждую открытую вкладку.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._waiters = defaultdict(set)
+        self._watcher = None
+        self._last_id = None
+        self.notifications = 0
+        self.watcher_polls = 0
+
+    def subscribe(self, conversation_id):
+        """
+        Подписка на новые сообщения беседы из цикла событий.
+        Аргументы:
+            conversation_id (int): ID беседы.
+        Возвращает:
+            _Waiter: Подписка для wait и unsubscribe.
+        """
+        waiter = _Waiter(conversation_id)
+        with self._lock:
+            self._waiters[conversation_id].add(waiter)
+        self._start_watcher()
+        return waiter
+
+    def unsubscribe(self, waiter):
+        with self._lock:
+            waiters = self._waiters.get(waiter.conversation_id)
+            if waiters is not None:
+                waiters.discard(waiter)
+                if not waiters:
+                    del self._waiters[waiter.conversation_id]
+
+    def notify(self, conversation_id):
+        """
+        Оповещение подписчиков беседы; безопасно для вызова из любого потока.
+        Аргументы:
+            conversation_id (int): ID беседы.
+        """
+        with self._lock:
+            waiters = list(self._waiters.get(conversation_id, ()))
+        if not waiters:
+            return
+        self.notifications += 1
+        for waiter in waiters:
+            try:
+                waiter.loop.call_soon_threadsafe(waiter.event.set)
+            except RuntimeError:
+                # Цикл событий подписчика уже закрыт
+                self.unsubscribe(waiter)
+
+    @staticmethod
+    async def wait(waiter, timeout):
+        """
+        Ожидание оповещения подписки.
+        Аргументы:
+            waiter (_Waiter): Подписка.
+            timeout (float): Максимальное время ожидания в секундах.
+        Возвращает:
+            bool: True, если пришло оповещение, False по истечении времени.
+        """
+        try:
+            await asyncio.wait_for(waiter.event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def _start_watcher(self):
+        interval = getattr(settings, 'MESSAGE_HUB_POLL_INTERVAL', 2)
+        if not interval or self._watcher is not None:
+            return
+        with self._lock:
+            if self._watcher is not None:
+                return
+            self._watcher = threading.Thread(target=self._watch, args=(interval,), name='message-hub', daemon=True)
+            self._watcher.start()
+
+    def _watch(self, interval):
+        while True:
+            try:
+                self.poll()
+            except Exception as e:
+                logger.error(f"Ошибка проверки новых сообщений: {str(e)}")
+            finally:
+                close_old_connections()
+            time.sleep(interval)
+
+    def poll(self):
+        """
+        Поиск сообщений, созданных после предыдущей проверки (в том числе другими процессами),
+        и оповещение подписчиков их бесед.
+        """
+        if self._last_id is None:
+            self._last_id = Message.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+            return
+        with self._lock:
+            conversation_ids = list(self._waiters)
+        if not conversation_ids:
+            return
+        self.watcher_polls += 1
+        new_messages = list(
+            Message.objects.filter(id__gt=self._last_id).order_by().values_list('id', 'conversation_id')
+        )
+        if not new_messages:
+            return
+        self._last_id = max(message_id for message_id, _ in new_messages)
+        for conversation_id in {conversation_id for _, conversation_id in new_messages}:
+            if conversation_id in conversation_ids:
+                self.notify(conversation_id)
+
+    def stats(self):
+        with self._lock:
+            subscribers = sum(len(waiters) for waiters in self._waiters.values())
+            conversations = len(self._waiters)
+        return {
+            'subscribers': subscribers,
+            'conversations': conversations,
+            'notifications': self.notifications,
+            'watcher_polls': self.watcher_polls,
+        }
+
+
+def message_saved(sender, instance, created, **kwargs):
+    """
+    Обработчик post_save сообщений: оповещение потоков беседы после фиксации транзакции.
+    """
+    if created:
+        conversation_id = instance.conversation_id
+        transaction.on_commit(lambda: message_hub.notify(conversation_id))
+
+
+# Общий для процесса центр оповещений о новых сообщениях
+message_hub = MessageHub()
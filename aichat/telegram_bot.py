@@ -1,12 +1,11 @@
 import logging
 import signal
+import time
 from telegram import Update
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
 from django.conf import settings
-from asgiref.sync import sync_to_async
-from django.db import transaction
 from aichat.models import User, Conversation, Message
-from aichat.machine_learning.model_manager import AIModelManager
+from aichat.machine_learning.model_manager import AIModelManager, get_ai_manager
 from functools import partial
 
 # Configure logging
@@ -16,12 +15,28 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Initialize the AI model manager
-ai_manager = AIModelManager()
-
 # Cache for processed message IDs to prevent duplicates
 processed_message_ids = set()
 
+# Максимальная длина сообщения Telegram
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+def format_answer(answer, sources):
+    """Текст ответа с источниками для Telegram."""
+    text = answer
+    if sources:
+        text += "\n\nИсточники:\n" + "\n".join(
+            f"- {source['text']} ({source['url']})" for source in sources if source.get('url')
+        )
+    return text[:TELEGRAM_MESSAGE_LIMIT]
+
+async def edit_reply(reply, text):
+    """Редактирование ответа бота; ошибки (например, неизмененный текст) не прерывают обработку."""
+    try:
+        await reply.edit_text(text)
+    except Exception as e:
+        logger.warning(f"Failed to edit reply {reply.message_id}: {str(e)}")
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE, ai_manager: AIModelManager) -> None:
     """Обработчик команды /start."""
     user = update.effective_user
@@ -30,7 +45,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE, ai_manager:
     logger.info(f"Received /start command from chat_id: {telegram_chat_id}")
 
     try:
-        django_user = await sync_to_async(User.objects.get)(telegram_chat_id=telegram_chat_id)
+        django_user = await User.objects.aget(telegram_chat_id=telegram_chat_id)
         welcome_message = (
             f"Привет, {django_user.first_name or django_user.username}!\n"
             "Я - AIchat, ваш интеллектуальный помощник. "
@@ -64,63 +79,67 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE, ai_
         return
     processed_message_ids.add(message_id)
 
+    reply = None
     try:
         # Находим пользователя
-        user = await sync_to_async(User.objects.select_related().get)(telegram_chat_id=telegram_chat_id)
+        user = await User.objects.aget(telegram_chat_id=telegram_chat_id)
 
         # Создаем или находим беседу
-        conversation, created = await sync_to_async(
-            Conversation.objects.get_or_create
-        )(user=user, title=f"Telegram Chat {telegram_chat_id}")
+        conversation, created = await Conversation.objects.aget_or_create(
+            user=user, title=f"Telegram Chat {telegram_chat_id}"
+        )
 
         # Проверяем на дублирование сообщения
-        if await sync_to_async(Message.objects.filter)(
-            conversation=conversation,
-            text=message_text,
-            is_user_message=True
-        ).exists():
+        if await Message.user_duplicates(conversation, message_text).aexists():
             logger.warning(f"Duplicate message text '{message_text}' in conversation {conversation.id}, ignoring")
             await update.message.reply_text("Это сообщение уже было отправлено. Попробуйте другой запрос.")
             return
 
-        # Используем транзакцию для атомарного сохранения
-        async with transaction.atomic():
-            # Сохранение сообщения пользователя
-            user_message = await sync_to_async(Message.objects.create)(
-                conversation=conversation,
-                text=message_text,
-                is_user_message=True
-            )
-
-            # Обрабатываем сообщение через AIModelManager
-            response = await sync_to_async(ai_manager.process_message)(
+        # Сохранение сообщения пользователя; транзакция не удерживается на время обработки,
+        # при ошибке сообщение удаляется
+        user_message = await Message.objects.acreate(
+            conversation=conversation,
+            text=message_text,
+            is_user_message=True
+        )
+        try:
+            # Ответ-заготовка редактируется по мере готовности: сначала выдержки первой ответившей
+            # поисковой системы, затем окончательный ответ (не чаще TELEGRAM_EDIT_INTERVAL секунд)
+            reply = await update.message.reply_text("Ищу ответ...")
+            edit_interval = getattr(settings, 'TELEGRAM_EDIT_INTERVAL', 1.0)
+            last_edit = 0.0
+            response = None
+            async for event in ai_manager.astream_message(
                 message_text=message_text,
                 user=user,
                 conversation_id=conversation.id
-            )
+            ):
+                if event['type'] == 'final':
+                    response = event['result']
+                elif event['type'] == 'partial' and time.monotonic() - last_edit >= edit_interval:
+                    last_edit = time.monotonic()
+                    await edit_reply(reply, format_answer(event['answer'] + "\n\n(уточняю ответ...)", []))
 
             if not response['success']:
                 raise ValueError(response.get('error', 'Failed to process message'))
 
             # Сохранение ответа ИИ
-            ai_message = await sync_to_async(Message.objects.create)(
+            await Message.objects.acreate(
                 conversation=conversation,
                 text=response['answer'],
                 is_user_message=False,
                 is_ai_generated=True,
                 sources=response.get('sources', [])
             )
+        except Exception:
+            await user_message.adelete()
+            raise
 
         # Формируем ответ
-        final_message = response['answer']
-        if response.get('sources'):
-            sources_text = "\n\nИсточники:\n" + "\n".join(
-                f"- {source['text']} ({source['url']})" for source in response['sources'] if source.get('url')
-            )
-            final_message += sources_text
+        final_message = format_answer(response['answer'], response.get('sources'))
 
         logger.debug(f"Sending response to chat_id {telegram_chat_id}, conversation {conversation.id}: {final_message}")
-        await update.message.reply_text(final_message)
+        await edit_reply(reply, final_message)
 
     except User.DoesNotExist:
         await update.message.reply_text(
@@ -129,9 +148,11 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE, ai_
         )
     except Exception as e:
         logger.exception(f"Error processing message for chat_id {telegram_chat_id}, message_id {message_id}: {str(e)}")
-        await update.message.reply_text(
-            "Произошла ошибка при обработке вашего сообщения. Пожалуйста, попробуйте позже."
-        )
+        error_message = "Произошла ошибка при обработке вашего сообщения. Пожалуйста, попробуйте позже."
+        if reply is not None:
+            await edit_reply(reply, error_message)
+        else:
+            await update.message.reply_text(error_message)
 
 def setup_telegram_bot():
     """Инициализация и запуск Telegram бота."""
@@ -140,7 +161,7 @@ def setup_telegram_bot():
         logger.error("TELEGRAM_BOT_TOKEN is not set in settings")
         raise ValueError("TELEGRAM_BOT_TOKEN is not set")
 
-    ai_manager = AIModelManager()
+    ai_manager = get_ai_manager()
     application = Application.builder().token(bot_token).build()
 
     application.add_handler(CommandHandler('start', partial(start, ai_manager=ai_manager)))
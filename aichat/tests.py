@@ -1,3 +1,577 @@
-from django.test import TestCase
+import asyncio
+import concurrent.futures
+import os
+import tempfile
+from datetime import timedelta
+from unittest import mock
+import numpy as np
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from aichat.machine_learning import answer_queue as answer_queue_module, exact_match as exact_match_module
+from aichat.machine_learning import rate_limit, search_backends, utils
+from aichat.machine_learning.ann_index import IVFIndex
+from aichat.machine_learning.answer_queue import FAILED_ANSWER, AnswerQueue
+from aichat.machine_learning.embedding_store import EmbeddingStore, embedding_to_bytes
+from aichat.machine_learning.exact_match import ExactMatchCache
+from aichat.machine_learning.rate_limit import CIRCUIT_CLOSED, CIRCUIT_HALF_OPEN, CIRCUIT_OPEN, EngineRateLimiter
+from aichat.machine_learning.search_backends import DEADLINE_CANCEL_MESSAGE, SearchBackend
+from aichat.machine_learning.search_cache import SearchCache
+from aichat.machine_learning.single_flight import SingleFlight
+from aichat.machine_learning.utils import no_results_placeholder, question_hash, search_answered
+from aichat.models import AnswerJob, Conversation, KnowledgeBase, KnowledgeBaseQuestion, Message, User
 
-# Create your tests here.
+ENGINE_LIMITS = {'engine': {'rate': 1, 'burst': 2, 'failure_threshold': 2, 'cooldown': 10, 'probe_timeout': 5}}
+
+
+@override_settings(SEARCH_RATE_LIMITS=ENGINE_LIMITS)
+class EngineRateLimiterTests(SimpleTestCase):
+    """
+    Корзина токенов и выключатель поисковой системы с управляемыми часами.
+    """
+
+    def setUp(self):
+        self.state_dir = tempfile.TemporaryDirectory()
+        self.limiter = EngineRateLimiter(self.state_dir.name)
+        self.now = 1000.0
+        patcher = mock.patch.object(rate_limit, 'time')
+        self.clock = patcher.start()
+        self.clock.time.side_effect = lambda: self.now
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.state_dir.cleanup)
+
+    def open_circuit(self):
+        self.limiter.record_failure('engine')
+        self.limiter.record_failure('engine')
+        self.assertEqual(self.limiter.state('engine')['circuit'], CIRCUIT_OPEN)
+
+    def test_burst_is_allowed_without_waiting(self):
+        self.assertEqual(self.limiter.acquire('engine', 0), 0)
+        self.assertEqual(self.limiter.acquire('engine', 0), 0)
+
+    def test_exhausted_budget_returns_wait_within_max_wait(self):
+        self.limiter.acquire('engine', 0)
+        self.limiter.acquire('engine', 0)
+        self.assertAlmostEqual(self.limiter.acquire('engine', 5), 1.0)
+        # Зарезервированный токен уходит в минус: следующий запрос ждет дольше
+        self.assertAlmostEqual(self.limiter.acquire('engine', 5), 2.0)
+
+    def test_exhausted_budget_rejects_beyond_max_wait(self):
+        self.limiter.acquire('engine', 0)
+        self.limiter.acquire('engine', 0)
+        self.assertIsNone(self.limiter.acquire('engine', 0.5))
+        self.assertEqual(self.limiter.stats()['engine']['rejected_budget'], 1)
+
+    def test_tokens_refill_with_time_up_to_burst(self):
+        self.limiter.acquire('engine', 0)
+        self.limiter.acquire('engine', 0)
+        self.now += 100
+        self.assertEqual(self.limiter.acquire('engine', 0), 0)
+        self.assertEqual(self.limiter.acquire('engine', 0), 0)
+        self.assertIsNone(self.limiter.acquire('engine', 0))
+
+    def test_failures_below_threshold_keep_circuit_closed(self):
+        self.limiter.record_failure('engine')
+        self.assertEqual(self.limiter.state('engine')['circuit'], CIRCUIT_CLOSED)
+        self.limiter.record_success('engine')
+        self.limiter.record_failure('engine')
+        self.assertEqual(self.limiter.state('engine')['circuit'], CIRCUIT_CLOSED)
+
+    def test_open_circuit_rejects_until_cooldown(self):
+        self.open_circuit()
+        self.assertIsNone(self.limiter.acquire('engine', 5))
+        self.now += 9
+        self.assertIsNone(self.limiter.acquire('engine', 5))
+        self.assertEqual(self.limiter.stats()['engine']['rejected_open'], 2)
+
+    def test_half_open_allows_single_probe(self):
+        self.open_circuit()
+        self.now += 11
+        self.assertEqual(self.limiter.acquire('engine', 5), 0)
+        self.assertEqual(self.limiter.state('engine')['circuit'], CIRCUIT_HALF_OPEN)
+        self.assertIsNone(self.limiter.acquire('engine', 5))
+        # Пробный запрос без ответа перестает блокировать систему через probe_timeout
+        self.now += 6
+        self.assertEqual(self.limiter.acquire('engine', 5), 0)
+
+    def test_released_probe_allows_next_probe(self):
+        self.open_circuit()
+        self.now += 11
+        self.limiter.acquire('engine', 5)
+        self.limiter.release_probe('engine')
+        self.assertEqual(self.limiter.acquire('engine', 5), 0)
+        self.assertEqual(self.limiter.state('engine')['circuit'], CIRCUIT_HALF_OPEN)
+
+    def test_successful_probe_closes_circuit(self):
+        self.open_circuit()
+        self.now += 11
+        self.limiter.acquire('engine', 5)
+        self.limiter.record_success('engine')
+        state = self.limiter.state('engine')
+        self.assertEqual(state['circuit'], CIRCUIT_CLOSED)
+        self.assertEqual(state['failures'], 0)
+
+    def test_failed_probe_reopens_circuit(self):
+        self.open_circuit()
+        self.now += 11
+        self.limiter.acquire('engine', 5)
+        self.limiter.record_failure('engine')
+        self.assertEqual(self.limiter.state('engine')['circuit'], CIRCUIT_OPEN)
+        self.assertIsNone(self.limiter.acquire('engine', 5))
+
+
+class _SlowPool:
+    """
+    Пул соединений, запрос которого не завершается до отмены.
+    """
+
+    async def get(self, name, url, **kwargs):
+        await asyncio.sleep(60)
+
+
+class _SlowBackend(SearchBackend):
+    name = 'engine'
+
+    def request(self, query):
+        return 'http://engine.invalid/search', {}
+
+
+@override_settings(SEARCH_RATE_LIMITS=ENGINE_LIMITS)
+class SearchBackendCancellationTests(SimpleTestCase):
+    """
+    Отмена запроса источника: таймаут учитывается выключателем, отмена после ответа другого источника - нет.
+    """
+
+    def setUp(self):
+        self.state_dir = tempfile.TemporaryDirectory()
+        self.limiter = EngineRateLimiter(self.state_dir.name)
+        for target, value in (('search_rate_limiter', self.limiter), ('search_http_pool', _SlowPool())):
+            patcher = mock.patch.object(search_backends, target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(self.state_dir.cleanup)
+
+    async def cancel_search(self, message=None):
+        loop = asyncio.get_running_loop()
+        task = asyncio.create_task(_SlowBackend().search('запрос', None, loop.time() + 60))
+        await asyncio.sleep(0.2)
+        task.cancel(message)
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+
+    async def test_deadline_cancellation_counts_as_failure(self):
+        await self.cancel_search(DEADLINE_CANCEL_MESSAGE)
+        self.assertEqual(self.limiter.state('engine')['failures'], 1)
+        await self.cancel_search(DEADLINE_CANCEL_MESSAGE)
+        self.assertEqual(self.limiter.state('engine')['circuit'], CIRCUIT_OPEN)
+
+    async def test_cancellation_after_other_engine_won_is_neutral(self):
+        await self.cancel_search()
+        state = self.limiter.state('engine')
+        self.assertEqual(state['failures'], 0)
+        self.assertEqual(state['circuit'], CIRCUIT_CLOSED)
+
+    async def test_cancelled_probe_is_released(self):
+        self.limiter.record_failure('engine')
+        self.limiter.record_failure('engine')
+        with mock.patch.object(rate_limit.time, 'time', return_value=rate_limit.time.time() + 11):
+            await self.cancel_search()
+            state = self.limiter.state('engine')
+            self.assertEqual(state['circuit'], CIRCUIT_HALF_OPEN)
+            self.assertEqual(state['probe_until'], 0)
+
+
+class _FixedBackend:
+    """
+    Источник с заданным ответом: список результатов или None (источник не ответил).
+    """
+
+    def __init__(self, name, results, delay=0):
+        self.name = name
+        self.results = results
+        self.delay = delay
+
+    async def search(self, query, timeout, deadline_at):
+        await asyncio.sleep(self.delay)
+        return self.results
+
+
+class SingleFlightTests(SimpleTestCase):
+    """
+    Прерванное вычисление лидера не оставляет ключ занятым.
+    """
+
+    def setUp(self):
+        self.lock_dir = tempfile.TemporaryDirectory()
+        patcher = override_settings(SINGLE_FLIGHT_LOCK_DIR=self.lock_dir.name)
+        patcher.enable()
+        self.addCleanup(patcher.disable)
+        self.addCleanup(self.lock_dir.cleanup)
+        self.flight = SingleFlight('test')
+
+    def test_base_exception_releases_key(self):
+        def interrupted():
+            raise KeyboardInterrupt
+
+        with self.assertRaises(KeyboardInterrupt):
+            self.flight.do('key', interrupted)
+        self.assertEqual(self.flight.stats()['in_flight'], 0)
+        self.assertEqual(self.flight.do('key', lambda: 'ответ'), 'ответ')
+
+    async def test_cancelled_async_leader_releases_key(self):
+        async def cancelled():
+            raise asyncio.CancelledError
+
+        with self.assertRaises(asyncio.CancelledError):
+            await self.flight.ado('key', cancelled)
+        self.assertEqual(self.flight.stats()['in_flight'], 0)
+
+
+class SearchAnsweredTests(SimpleTestCase):
+    """
+    Пустая выдача источников отличается от недоступного поиска (для кеша запросов без результатов).
+    """
+
+    def search(self, *backends):
+        with mock.patch.object(utils, 'get_search_backends', return_value=list(backends)):
+            return asyncio.run(utils.async_search_internet('запрос', deadline=1, use_cache=False))
+
+    def test_empty_page_is_answered(self):
+        results = self.search(_FixedBackend('google', []), _FixedBackend('yandex', None))
+        self.assertTrue(search_answered(results))
+
+    def test_no_engine_answered(self):
+        results = self.search(_FixedBackend('google', None), _FixedBackend('yandex', None))
+        self.assertFalse(search_answered(results))
+
+    def test_found_results_are_answered(self):
+        found = [{'title': 'Заголовок', 'snippet': 'Достаточно длинная выдержка', 'link': 'https://example.com'}]
+        self.assertEqual(self.search(_FixedBackend('google', found)), found)
+        self.assertTrue(search_answered(found))
+
+    def test_placeholder_defaults_to_answered(self):
+        self.assertTrue(search_answered(no_results_placeholder('запрос')))
+        self.assertFalse(search_answered(no_results_placeholder('запрос', answered=False)))
+
+
+@override_settings(SEARCH_MIN_VALID_RESULTS=3, SEARCH_CACHE_TTL=3600, SEARCH_PARTIAL_CACHE_TTL=300)
+class SearchResultCachingTests(SimpleTestCase):
+    """
+    Ранний ответ политики 'first' кешируется ненадолго, полный результат - на SEARCH_CACHE_TTL.
+    """
+
+    found = [
+        {'title': f'Заголовок {i}', 'snippet': 'Достаточно длинная выдержка', 'link': f'https://example.com/{i}'}
+        for i in range(3)
+    ]
+
+    def search(self, policy, *backends):
+        with mock.patch.object(utils, 'get_search_backends', return_value=list(backends)), \
+                mock.patch.object(utils, 'search_cache') as cache:
+            cache.get.return_value = None
+            asyncio.run(utils.async_search_internet('запрос', deadline=1, policy=policy))
+        return cache.set.call_args.args
+
+    def test_first_policy_early_result_gets_short_ttl(self):
+        _, _, ttl = self.search('first', _FixedBackend('google', self.found), _FixedBackend('yandex', [], delay=5))
+        self.assertEqual(ttl, 300)
+
+    @override_settings(SEARCH_RESULT_TIMEOUT_MARGIN=0.1)
+    def test_sync_search_stops_waiting_for_stalled_loop(self):
+        stalled = concurrent.futures.Future()
+        with mock.patch.object(utils, 'run_in_search_loop', side_effect=lambda coro: coro.close() or stalled):
+            results = utils.search_internet('запрос', deadline=0.1)
+        self.assertFalse(search_answered(results))
+        self.assertTrue(stalled.cancelled())
+
+    def test_result_of_all_engines_gets_full_ttl(self):
+        _, results, ttl = self.search(
+            'first', _FixedBackend('google', self.found, delay=0.05), _FixedBackend('yandex', [])
+        )
+        self.assertEqual(results, self.found)
+        self.assertIsNone(ttl)
+
+
+@override_settings(
+    CACHES={'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'search-tests'}},
+    SEARCH_CACHE_GENERATION_CHECK=0,
+)
+class SearchCacheGenerationTests(SimpleTestCase):
+    """
+    Очистка кеша поиска в одном процессе сбрасывает первый уровень других процессов (общий второй уровень).
+    """
+
+    def setUp(self):
+        self.worker = SearchCache(alias='shared')
+        self.command = SearchCache(alias='shared')
+
+    def tearDown(self):
+        self.worker._persistent().clear()
+
+    def test_clear_in_other_process_drops_memory_entries(self):
+        self.worker.set('key', [{'title': 'старый'}])
+        self.assertEqual(self.worker.get('key'), [{'title': 'старый'}])
+        self.command.clear()
+        self.assertIsNone(self.worker.get('key'))
+        self.assertEqual(self.worker.stats()['entries'], 0)
+
+    def test_entries_of_previous_generation_are_ignored(self):
+        self.worker.set('key', [{'title': 'старый'}])
+        self.command.clear()
+        self.assertIsNone(SearchCache(alias='shared').get('key'))
+
+
+class EmbeddingStoreRebuildTests(SimpleTestCase):
+    """
+    IVF индекс строится и переобучается вне пути запроса и сохраняется на диск.
+    """
+
+    def setUp(self):
+        self.index_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.index_dir.cleanup)
+        self.index_path = f"{self.index_dir.name}/kb_ann_index.npz"
+        patcher = override_settings(KB_ANN_MIN_SIZE=8, KB_ANN_INDEX_PATH=self.index_path)
+        patcher.enable()
+        self.addCleanup(patcher.disable)
+        self.store = EmbeddingStore()
+        self.vectors = np.random.default_rng(0).normal(size=(40, 16)).astype(np.float32)
+
+    def test_add_does_not_build_index(self):
+        for item_id in range(10):
+            self.store.add(item_id, self.vectors[item_id])
+        self.assertEqual(self.store.stats()['mode'], 'flat')
+        self.assertTrue(self.store.rebuild_ann())
+        self.assertEqual(self.store.stats()['mode'], 'ivf')
+        self.assertEqual(len(IVFIndex.load(self.index_path)), 10)
+
+    def test_changes_during_rebuild_are_kept(self):
+        for item_id in range(10):
+            self.store.add(item_id, self.vectors[item_id])
+        train = IVFIndex.train
+
+        def train_with_concurrent_changes(index, vectors, **kwargs):
+            self.store.add(30, self.vectors[30])
+            self.store.remove(0)
+            train(index, vectors, **kwargs)
+
+        with mock.patch.object(IVFIndex, 'train', train_with_concurrent_changes):
+            self.assertTrue(self.store.rebuild_ann())
+        self.assertIsNone(self.store.get(0))
+        self.assertEqual(self.store.search(self.vectors[30])[0][0], 30)
+        self.assertEqual(len(self.store), 10)
+
+    def test_save_leaves_no_temporary_files(self):
+        index = IVFIndex(16)
+        index.add(list(range(5)), self.vectors[:5])
+        index.save(self.index_path)
+        index.save(self.index_path)
+        self.assertEqual(os.listdir(self.index_dir.name), ['kb_ann_index.npz'])
+
+    def test_saved_index_loads_same_lists(self):
+        index = IVFIndex(16)
+        index.train(self.vectors, n_lists=4)
+        index.add(list(range(40)), self.vectors)
+        index.save(self.index_path)
+        loaded = IVFIndex.load(self.index_path)
+        self.assertEqual(loaded.ids(), set(range(40)))
+        for item_id in (0, 17, 39):
+            np.testing.assert_allclose(loaded.get(item_id), index.get(item_id))
+        self.assertEqual(loaded.search(self.vectors[17], n_probe=4)[0][0], 17)
+
+
+@override_settings(KB_ANN_MIN_SIZE=8, KB_ANN_INDEX_PATH=None, KB_ANN_MAINTENANCE_INTERVAL=0)
+class EmbeddingStoreLoadTests(TestCase):
+    """
+    Загрузка хранилища не строит IVF индекс и не вычисляет вложения в пути запроса.
+    """
+
+    def test_load_serves_flat_until_rebuild(self):
+        vectors = np.random.default_rng(0).normal(size=(10, 16)).astype(np.float32)
+        items = KnowledgeBase.objects.bulk_create([
+            KnowledgeBase(question_pattern=f'вопрос {i}', answer='ответ', question_embedding=embedding_to_bytes(vector))
+            for i, vector in enumerate(vectors)
+        ])
+        store = EmbeddingStore()
+        store.ensure_loaded()
+        self.assertEqual(store.stats()['mode'], 'flat')
+        self.assertEqual(store.search(vectors[3])[0][0], items[3].id)
+        self.assertTrue(store.needs_rebuild())
+        self.assertTrue(store.rebuild_ann())
+        self.assertEqual(store.stats()['mode'], 'ivf')
+
+    def test_missing_embeddings_are_backfilled_outside_load(self):
+        item = KnowledgeBase.objects.create(question_pattern='погода', answer='Солнечно')
+        processor = mock.Mock()
+        processor.get_bert_embeddings.return_value = [np.ones(16, dtype=np.float32)]
+        store = EmbeddingStore()
+        with mock.patch.object(store, '_start_backfill') as start_backfill:
+            store.ensure_loaded(processor)
+        start_backfill.assert_called_once_with(processor)
+        processor.get_bert_embeddings.assert_not_called()
+        self.assertIsNone(store.get(item.id))
+        self.assertEqual(store.backfill(processor), 1)
+        self.assertIsNotNone(store.get(item.id))
+        item.refresh_from_db()
+        self.assertIsNotNone(item.question_embedding)
+
+
+class ExactMatchLinkTests(TestCase):
+    """
+    Хеш вопроса, привязанного к повторно использованному элементу, находят другие процессы (новый кеш).
+    """
+
+    def test_item_without_hash_gets_question_hash(self):
+        item = KnowledgeBase.objects.create(question_pattern='погода москва', answer='Солнечно')
+        ExactMatchCache().link(item, 'Какая погода в Москве?')
+        item.refresh_from_db()
+        self.assertEqual(item.question_hash, question_hash('какая погода в москве'))
+        self.assertEqual(ExactMatchCache().lookup('какая погода в Москве')['id'], item.id)
+
+    def test_other_wording_is_mapped_to_item(self):
+        item = KnowledgeBase.objects.create(
+            question_pattern='погода москва', answer='Солнечно', question_hash=question_hash('погода в москве')
+        )
+        ExactMatchCache().link(item, 'Какая сейчас погода в Москве?')
+        self.assertEqual(KnowledgeBaseQuestion.objects.get().knowledge_item_id, item.id)
+        entry = ExactMatchCache().lookup('какая сейчас погода в москве')
+        self.assertEqual(entry['answer'], 'Солнечно')
+        # Хеш самого элемента не меняется
+        self.assertEqual(ExactMatchCache().lookup('погода в Москве')['id'], item.id)
+
+    def test_mapping_moves_to_latest_item(self):
+        first = KnowledgeBase.objects.create(question_pattern='a', answer='1', question_hash='x' * 64)
+        second = KnowledgeBase.objects.create(question_pattern='b', answer='2', question_hash='y' * 64)
+        ExactMatchCache().link(first, 'вопрос')
+        ExactMatchCache().link(second, 'вопрос')
+        self.assertEqual(ExactMatchCache().lookup('вопрос')['id'], second.id)
+
+
+class ExactMatchTTLTests(TestCase):
+    """
+    Ответ, обновленный другим процессом, перечитывается из базы после истечения записи кеша.
+    """
+
+    def test_expired_entry_is_reloaded_from_database(self):
+        item = KnowledgeBase.objects.create(
+            question_pattern='погода', answer='Солнечно', question_hash=question_hash('погода')
+        )
+        cache = ExactMatchCache(ttl=60)
+        with mock.patch.object(exact_match_module, 'time') as clock:
+            clock.monotonic.return_value = 1000.0
+            self.assertEqual(cache.lookup('погода')['answer'], 'Солнечно')
+            KnowledgeBase.objects.filter(id=item.id).update(answer='Дождь')
+            clock.monotonic.return_value = 1059.0
+            self.assertEqual(cache.lookup('погода')['answer'], 'Солнечно')
+            clock.monotonic.return_value = 1061.0
+            self.assertEqual(cache.lookup('погода')['answer'], 'Дождь')
+        self.assertEqual(cache.stats()['expirations'], 1)
+
+
+class _FakeManager:
+    """
+    Менеджер ИИ с заданными ответами process_message (словарь результата или исключение).
+    """
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+
+    def process_message(self, text, user, conversation_id):
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+ANSWER = {'success': True, 'answer': 'Ответ', 'sources': []}
+
+
+@override_settings(ANSWER_JOB_MAX_ATTEMPTS=2, ANSWER_JOB_LEASE=300)
+class AnswerQueueTests(TestCase):
+    """
+    Захват, повторные попытки и возврат в очередь заданий с истекшей арендой.
+    """
+
+    def setUp(self):
+        self.queue = AnswerQueue()
+        user = User.objects.create(username='queue')
+        self.conversation = Conversation.objects.create(user=user)
+
+    def enqueue(self, text='Вопрос'):
+        return self.queue.enqueue(self.conversation, text)[1]
+
+    def answer_with(self, *responses):
+        patcher = mock.patch.object(answer_queue_module, 'get_ai_manager', return_value=_FakeManager(*responses))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def ai_messages(self):
+        return Message.objects.filter(conversation=self.conversation, is_user_message=False)
+
+    def test_claim_takes_oldest_pending_job_once(self):
+        first = self.enqueue('Первый')
+        second = self.enqueue('Второй')
+        claimed = self.queue.claim('worker-1')
+        self.assertEqual(claimed.id, first.id)
+        self.assertEqual((claimed.status, claimed.worker, claimed.attempts), (AnswerJob.STATUS_RUNNING, 'worker-1', 1))
+        self.assertEqual(self.queue.claim('worker-2').id, second.id)
+        self.assertIsNone(self.queue.claim('worker-3'))
+
+    def test_successful_job_saves_answer(self):
+        self.enqueue()
+        self.answer_with(ANSWER)
+        self.assertTrue(self.queue.process(self.queue.claim('worker')))
+        job = AnswerJob.objects.get()
+        self.assertEqual(job.status, AnswerJob.STATUS_DONE)
+        self.assertEqual(job.ai_message.text, 'Ответ')
+
+    def test_failed_attempt_is_retried(self):
+        self.enqueue()
+        self.answer_with(Exception('сбой'), ANSWER)
+        self.assertFalse(self.queue.process(self.queue.claim('worker')))
+        job = AnswerJob.objects.get()
+        self.assertEqual((job.status, job.worker, job.error), (AnswerJob.STATUS_PENDING, '', 'сбой'))
+        self.assertFalse(self.ai_messages().exists())
+        self.assertTrue(self.queue.process(self.queue.claim('worker')))
+        self.assertEqual(AnswerJob.objects.get().attempts, 2)
+
+    def test_last_failed_attempt_saves_failure_answer(self):
+        self.enqueue()
+        self.answer_with(Exception('сбой'), Exception('сбой'))
+        self.queue.process(self.queue.claim('worker'))
+        self.queue.process(self.queue.claim('worker'))
+        job = AnswerJob.objects.get()
+        self.assertEqual(job.status, AnswerJob.STATUS_FAILED)
+        self.assertEqual(job.ai_message.text, FAILED_ANSWER)
+
+    def test_expired_lease_is_requeued(self):
+        self.enqueue()
+        self.queue.claim('worker')
+        self.assertEqual(self.queue.requeue_expired(), 0)
+        AnswerJob.objects.update(lease_expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(self.queue.requeue_expired(), 1)
+        job = AnswerJob.objects.get()
+        self.assertEqual((job.status, job.worker), (AnswerJob.STATUS_PENDING, ''))
+        self.assertEqual(self.queue.claim('worker-2').attempts, 2)
+
+    def test_worker_that_lost_lease_does_not_save(self):
+        self.enqueue()
+        stale = self.queue.claim('worker-1')
+        AnswerJob.objects.update(lease_expires_at=timezone.now() - timedelta(seconds=1))
+        self.queue.requeue_expired()
+        current = self.queue.claim('worker-2')
+        self.answer_with(ANSWER, ANSWER)
+        self.assertFalse(self.queue.process(stale))
+        self.assertFalse(self.ai_messages().exists())
+        self.assertEqual(AnswerJob.objects.get().status, AnswerJob.STATUS_RUNNING)
+        self.assertTrue(self.queue.process(current))
+        self.assertEqual(self.ai_messages().count(), 1)
+
+    def test_worker_that_lost_lease_does_not_requeue(self):
+        self.enqueue()
+        stale = self.queue.claim('worker-1')
+        AnswerJob.objects.update(lease_expires_at=timezone.now() - timedelta(seconds=1))
+        self.queue.requeue_expired()
+        self.queue.claim('worker-2')
+        self.answer_with(Exception('сбой'))
+        self.queue.process(stale)
+        job = AnswerJob.objects.get()
+        self.assertEqual((job.status, job.worker), (AnswerJob.STATUS_RUNNING, 'worker-2'))
@@ -1,20 +1,33 @@
+import asyncio
 import json
 import logging
-from django.shortcuts import render, redirect, get_object_or_404
-from django.http import JsonResponse
+import time
+from django.conf import settings
+from django.shortcuts import render, redirect, get_object_or_404, aget_object_or_404
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.contrib import messages
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.views.decorators.http import require_http_methods
 from django.views.decorators.csrf import csrf_exempt
-from django.db import transaction
 from django.views.generic import ListView, DeleteView
 from django.urls import reverse_lazy
 from .models import Conversation, Message
+from .notify import message_hub
 from django.contrib.auth.models import User
-from .machine_learning.model_manager import AIModelManager
-from .machine_learning.response_handler import ResponseHandler
+from asgiref.sync import sync_to_async
+from .machine_learning.answer_queue import answer_queue
+from .machine_learning.model_manager import aget_ai_manager, get_ai_manager
+from .machine_learning.registry import model_registry
+from .machine_learning.exact_match import exact_match_cache
+from .machine_learning.http_pool import search_http_pool
+from .machine_learning.rate_limit import search_rate_limiter
+from .machine_learning.search_cache import negative_search_cache, search_cache
+from .machine_learning.single_flight import answer_flight, search_flight
+from .machine_learning.utils import search_policy_stats
 
 logger = logging.getLogger(__name__)
 
@@ -48,7 +61,7 @@ def handle_response(request):
             if not user_input:
                 return JsonResponse({"success": False, "error": "Отсутствует пользовательский ввод"}, status=400)
 
-            response_handler = ResponseHandler()
+            response_handler = get_ai_manager().response_handler
             response = response_handler.process_input(user_input)
             return JsonResponse({"success": True, "response": response})
         else:
@@ -111,74 +124,226 @@ def chat(request, conversation_id):
     """Просмотр конкретного чата."""
     try:
         conversation = get_object_or_404(Conversation, id=conversation_id, user=request.user)
-        messages = conversation.messages.all().order_by('created_at')
+        # Только последняя страница беседы; более старые сообщения страница загружает при прокрутке
+        page_size = getattr(settings, 'MESSAGE_PAGE_SIZE', 50)
+        recent_messages = list(conversation.messages.order_by('-id')[:page_size])
         return render(request, 'aichat/admin/chat.html', {
             'conversation': conversation,
-            'messages': messages
+            'messages': recent_messages[::-1],
+            # При очереди ответов страница отправляет сообщения в send_message и ждет ответ из очереди
+            'stream_answers': not answer_queue.enabled(),
+            # Поток новых сообщений (SSE) требует ASGI сервера, под WSGI страница опрашивает get_messages
+            'message_stream': isinstance(request, ASGIRequest)
         })
     except Exception as e:
         logger.error(f"Error loading chat {conversation_id}: {str(e)}")
         messages.error(request, "Не удалось загрузить чат")
         return redirect('dashboard')
 
+def _message_json(message):
+    """Сообщение пользователя в ответе send_message."""
+    return {
+        'id': message.id,
+        'text': message.text,
+        'created_at': message.created_at.isoformat(),
+        'is_user_message': message.is_user_message
+    }
+
+def _ai_message_json(message):
+    """Ответ ИИ в ответе send_message."""
+    return {
+        'id': message.id,
+        'text': message.text,
+        'sources': message.sources,
+        'created_at': message.created_at.isoformat(),
+        'is_user_message': message.is_user_message
+    }
+
+# Обработка сообщений, продолжающаяся после закрытия соединения клиентом
+_answer_tasks = set()
+
+async def _answer_message(conversation, user, message_text, user_message):
+    """
+    Генерация и сохранение ответа ИИ на сообщение пользователя.
+    При ошибке или отмене обработки сообщение пользователя удаляется, чтобы его можно было отправить повторно.
+    Аргументы:
+        conversation (Conversation): Беседа.
+        user (User): Пользователь.
+        message_text (str): Текст сообщения.
+        user_message (Message): Сохраненное сообщение пользователя.
+    Возвращает:
+        Message: Сохраненный ответ ИИ.
+    """
+    try:
+        # Обработка сообщения через AIModelManager
+        ai_manager = await aget_ai_manager()
+        response = await ai_manager.aprocess_message(message_text, user, conversation.id)
+
+        if not response['success']:
+            raise Exception(response.get('error', 'Ошибка обработки сообщения'))
+
+        # Сохранение ответа ИИ
+        return await Message.objects.acreate(
+            conversation=conversation,
+            text=response['answer'],
+            is_user_message=False,
+            is_ai_generated=True,
+            sources=response.get('sources', [])
+        )
+    except BaseException:
+        await user_message.adelete()
+        raise
+
+def _log_detached_answer(task):
+    """Ошибка обработки сообщения, которую после закрытия соединения уже не запишет представление."""
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"Error answering message after client disconnected: {str(task.exception())}")
+
+async def _answer_events(conversation, user, message_text, user_message):
+    """
+    Строки NDJSON потокового ответа: сообщение пользователя, промежуточные результаты
+    и окончательный ответ ИИ, сохраненный в беседу так же, как в send_message.
+    Обработка выполняется отдельной задачей: при закрытии соединения ответ все равно сохраняется.
+    """
+    events = asyncio.Queue()
+
+    async def answer():
+        try:
+            result = None
+            ai_manager = await aget_ai_manager()
+            async for event in ai_manager.astream_message(message_text, user, conversation.id):
+                if event['type'] == 'final':
+                    result = event['result']
+                else:
+                    events.put_nowait(event)
+            if not result['success']:
+                raise Exception(result.get('error', 'Ошибка обработки сообщения'))
+            ai_message = await Message.objects.acreate(
+                conversation=conversation,
+                text=result['answer'],
+                is_user_message=False,
+                is_ai_generated=True,
+                sources=result.get('sources', [])
+            )
+            events.put_nowait({'type': 'final', 'success': True, 'ai_message': _ai_message_json(ai_message)})
+        except asyncio.CancelledError:
+            await user_message.adelete()
+            raise
+        except Exception as e:
+            logger.error(f"Error in send_message_stream for conversation {conversation.id}: {str(e)}")
+            await user_message.adelete()
+            events.put_nowait({
+                'type': 'error',
+                'success': False,
+                'error': str(e),
+                'message': 'Произошла ошибка при отправке сообщения'
+            })
+        finally:
+            events.put_nowait(None)
+
+    task = asyncio.ensure_future(answer())
+    _answer_tasks.add(task)
+    task.add_done_callback(_answer_tasks.discard)
+    yield json.dumps({'type': 'user_message', 'message': _message_json(user_message)}, ensure_ascii=False) + '\n'
+    while True:
+        event = await events.get()
+        if event is None:
+            return
+        yield json.dumps(event, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
+
 @require_http_methods(["POST"])
 @login_required
 @csrf_exempt
-def send_message(request, conversation_id):
-    """Отправка сообщения."""
+async def send_message_stream(request, conversation_id):
+    """
+    Отправка сообщения с потоковым ответом (NDJSON): промежуточные ответы из выдержек
+    первых ответивших поисковых систем выдаются до окончательного ответа.
+    """
     try:
-        conversation = get_object_or_404(Conversation, id=conversation_id, user=request.user)
+        user = await request.auser()
+        conversation = await aget_object_or_404(Conversation, id=conversation_id, user=user)
         data = json.loads(request.body) if request.body else {}
         message_text = data.get('text', '').strip()
         if not message_text:
             return JsonResponse({'success': False, 'error': 'Сообщение не может быть пустым'}, status=400)
 
         # Проверка на дублирование сообщения
-        if Message.objects.filter(conversation=conversation, text=message_text, is_user_message=True).exists():
+        if await Message.user_duplicates(conversation, message_text).aexists():
             return JsonResponse({'success': False, 'error': 'Сообщение уже существует'}, status=400)
 
-        logger.debug(f"Sending message: {message_text} in conversation {conversation_id}")
+        user_message = await Message.objects.acreate(
+            conversation=conversation,
+            text=message_text,
+            is_user_message=True
+        )
+    except Exception as e:
+        logger.error(f"Error in send_message_stream for conversation {conversation_id}: {str(e)}")
+        return JsonResponse({
+            'success': False,
+            'error': str(e),
+            'message': 'Произошла ошибка при отправке сообщения'
+        }, status=500)
+    response = StreamingHttpResponse(
+        _answer_events(conversation, user, message_text, user_message), content_type='application/x-ndjson'
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
 
-        # Используем транзакцию для атомарного сохранения
-        with transaction.atomic():
-            # Сохранение сообщения пользователя
-            user_message = Message.objects.create(
-                conversation=conversation,
-                text=message_text,
-                is_user_message=True
-            )
+@require_http_methods(["POST"])
+@login_required
+@csrf_exempt
+async def send_message(request, conversation_id):
+    """
+    Отправка сообщения.
+    Асинхронное представление: ожидание поиска в интернете не занимает поток сервера ASGI,
+    вычисления моделей выполняются в пуле потоков реестра моделей.
+    """
+    try:
+        user = await request.auser()
+        conversation = await aget_object_or_404(Conversation, id=conversation_id, user=user)
+        data = json.loads(request.body) if request.body else {}
+        message_text = data.get('text', '').strip()
+        if not message_text:
+            return JsonResponse({'success': False, 'error': 'Сообщение не может быть пустым'}, status=400)
 
-            # Обработка сообщения через AIModelManager
-            ai_manager = AIModelManager()
-            response = ai_manager.process_message(message_text, request.user, conversation_id)
+        # Проверка на дублирование сообщения
+        if await Message.user_duplicates(conversation, message_text).aexists():
+            return JsonResponse({'success': False, 'error': 'Сообщение уже существует'}, status=400)
 
-            if not response['success']:
-                raise Exception(response.get('error', 'Ошибка обработки сообщения'))
+        logger.debug(f"Sending message: {message_text} in conversation {conversation_id}")
 
-            # Сохранение ответа ИИ
-            ai_message = Message.objects.create(
-                conversation=conversation,
-                text=response['answer'],
-                is_user_message=False,
-                is_ai_generated=True,
-                sources=response.get('sources', [])
-            )
+        if answer_queue.enabled():
+            # Ответ сгенерирует обработчик очереди; страница получит его опросом новых сообщений
+            user_message, job = await sync_to_async(answer_queue.enqueue)(conversation, message_text)
+            return JsonResponse({
+                'success': True,
+                'user_message': _message_json(user_message),
+                'job': {'id': job.id, 'status': job.status}
+            }, status=202)
+
+        # Сохранение сообщения пользователя; транзакция не удерживается на время поиска,
+        # при ошибке обработки сообщение удаляется
+        user_message = await Message.objects.acreate(
+            conversation=conversation,
+            text=message_text,
+            is_user_message=True
+        )
+        # Обработка выполняется отдельной задачей: при закрытии соединения клиентом сервер ASGI отменяет
+        # представление, а ответ все равно сохраняется и приходит странице с новыми сообщениями
+        task = asyncio.ensure_future(_answer_message(conversation, user, message_text, user_message))
+        _answer_tasks.add(task)
+        task.add_done_callback(_answer_tasks.discard)
+        try:
+            ai_message = await asyncio.shield(task)
+        except asyncio.CancelledError:
+            task.add_done_callback(_log_detached_answer)
+            raise
 
         return JsonResponse({
             'success': True,
-            'user_message': {
-                'id': user_message.id,
-                'text': user_message.text,
-                'created_at': user_message.created_at.isoformat(),
-                'is_user_message': user_message.is_user_message
-            },
-            'ai_message': {
-                'id': ai_message.id,
-                'text': ai_message.text,
-                'sources': ai_message.sources,
-                'created_at': ai_message.created_at.isoformat(),
-                'is_user_message': ai_message.is_user_message
-            }
+            'user_message': _message_json(user_message),
+            'ai_message': _ai_message_json(ai_message)
         })
     except Exception as e:
         logger.error(f"Error in send_message for conversation {conversation_id}: {str(e)}")
@@ -189,18 +354,35 @@ def send_message(request, conversation_id):
         }, status=500)
 
 @login_required
-def get_messages(request, conversation_id):
-    """Получение сообщений."""
+async def get_messages(request, conversation_id):
+    """
+    Получение страницы сообщений беседы (пагинация по id, сообщения по возрастанию id).
+    Параметры запроса: before_id - более старые сообщения (загрузка истории при прокрутке),
+    after_id (since_id) - более новые сообщения, limit - размер страницы (по умолчанию MESSAGE_PAGE_SIZE).
+    Без before_id и after_id возвращается последняя страница беседы.
+    """
     try:
-        conversation = get_object_or_404(Conversation, id=conversation_id, user=request.user)
-        since_id = request.GET.get('since_id', 0)
-        messages = conversation.messages.filter(id__gt=since_id).order_by('created_at').values(
-            'id', 'text', 'is_user_message', 'created_at', 'sources'
+        user = await request.auser()
+        conversation = await aget_object_or_404(Conversation, id=conversation_id, user=user)
+        try:
+            before_id = int(request.GET.get('before_id', 0))
+            after_id = int(request.GET.get('after_id', request.GET.get('since_id', 0)))
+            limit = int(request.GET.get('limit', getattr(settings, 'MESSAGE_PAGE_SIZE', 50)))
+        except ValueError:
+            return JsonResponse({
+                'success': False,
+                'error': 'before_id, after_id и limit должны быть целыми числами'
+            }, status=400)
+        limit = max(1, min(limit, getattr(settings, 'MESSAGE_PAGE_MAX_SIZE', 200)))
+        page, has_more = await _message_page(conversation.id, before_id, after_id, limit)
+        logger.debug(
+            f"Retrieved {len(page)} messages for conversation {conversation_id} "
+            f"before_id={before_id} after_id={after_id} has_more={has_more}"
         )
-        logger.debug(f"Retrieved {len(messages)} messages for conversation {conversation_id} since_id={since_id}")
         return JsonResponse({
             'success': True,
-            'messages': list(messages)
+            'messages': page,
+            'has_more': has_more
         })
     except Exception as e:
         logger.error(f"Error getting messages for conversation {conversation_id}: {str(e)}")
@@ -210,6 +392,96 @@ def get_messages(request, conversation_id):
             'message': 'Не удалось загрузить сообщения'
         }, status=500)
 
+async def _message_page(conversation_id, before_id, after_id, limit):
+    """
+    Страница сообщений по индексу (conversation, id) без OFFSET: запрашивается limit + 1 сообщение,
+    лишнее сообщение только показывает, что за страницей есть еще сообщения.
+    Аргументы:
+        conversation_id (int): ID беседы.
+        before_id (int): Сообщения с id меньше before_id (0 - без ограничения).
+        after_id (int): Сообщения с id больше after_id (0 - без ограничения).
+        limit (int): Размер страницы.
+    Возвращает:
+        tuple: Сообщения страницы по возрастанию id и признак наличия следующих сообщений
+               (более новых для after_id без before_id, иначе более старых).
+    """
+    queryset = Message.objects.filter(conversation_id=conversation_id)
+    if before_id:
+        queryset = queryset.filter(id__lt=before_id)
+    if after_id:
+        queryset = queryset.filter(id__gt=after_id)
+    # Новые сообщения после after_id читаются от него вперед, история - от конца назад
+    forward = bool(after_id) and not before_id
+    queryset = queryset.order_by('id' if forward else '-id').values(
+        'id', 'text', 'is_user_message', 'created_at', 'sources'
+    )
+    page = [message async for message in queryset[:limit + 1]]
+    has_more = len(page) > limit
+    page = page[:limit]
+    if not forward:
+        page.reverse()
+    return page, has_more
+
+async def _message_events(conversation_id, last_id):
+    """
+    События Server-Sent Events с новыми сообщениями беседы.
+    Запрос к базе выполняется только при оповещении о новом сообщении; в простое отправляются
+    комментарии-пульс, а через MESSAGE_STREAM_MAX_AGE секунд поток закрывается,
+    и браузер переподключается с заголовком Last-Event-ID.
+    """
+    heartbeat = getattr(settings, 'MESSAGE_STREAM_HEARTBEAT', 15)
+    closes_at = time.monotonic() + getattr(settings, 'MESSAGE_STREAM_MAX_AGE', 300)
+    # Подписка до первого запроса, чтобы не пропустить сообщение, созданное между ними
+    waiter = message_hub.subscribe(conversation_id)
+    try:
+        yield 'retry: 3000\n\n'
+        while True:
+            waiter.event.clear()
+            async for message in Message.objects.filter(conversation_id=conversation_id, id__gt=last_id).order_by('id').values(
+                'id', 'text', 'is_user_message', 'created_at', 'sources'
+            ):
+                last_id = message['id']
+                data = json.dumps(message, cls=DjangoJSONEncoder, ensure_ascii=False)
+                yield f'id: {last_id}\nevent: message\ndata: {data}\n\n'
+            while True:
+                remaining = closes_at - time.monotonic()
+                if remaining <= 0:
+                    return
+                if await message_hub.wait(waiter, min(heartbeat, remaining)):
+                    break
+                yield ': ping\n\n'
+    finally:
+        message_hub.unsubscribe(waiter)
+
+@login_required
+async def stream_messages(request, conversation_id):
+    """
+    Поток новых сообщений беседы (Server-Sent Events) вместо периодического опроса get_messages.
+    Открытая вкладка держит одно соединение и не обращается к базе, пока в беседе нет новых сообщений.
+    Под WSGI сервером ответ буферизуется целиком и занимает обработчик на MESSAGE_STREAM_MAX_AGE секунд,
+    поэтому поток отдается только под ASGI; иначе ответ 204, после которого EventSource не переподключается.
+    """
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse(status=204)
+    try:
+        user = await request.auser()
+        conversation = await aget_object_or_404(Conversation, id=conversation_id, user=user)
+        last_id = int(request.headers.get('Last-Event-ID') or request.GET.get('since_id', 0))
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'Неверный since_id'}, status=400)
+    except Exception as e:
+        logger.error(f"Error opening message stream for conversation {conversation_id}: {str(e)}")
+        return JsonResponse({
+            'success': False,
+            'error': str(e),
+            'message': 'Не удалось загрузить сообщения'
+        }, status=500)
+    response = StreamingHttpResponse(_message_events(conversation.id, last_id), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Отключение буферизации ответа в nginx
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
 @login_required
 def user_list(request):
     """Список пользователей."""
@@ -219,4 +491,28 @@ def user_list(request):
     except Exception as e:
         logger.error(f"Error loading user list: {str(e)}")
         messages.error(request, "Не удалось загрузить список пользователей")
-        return redirect('dashboard')
\ No newline at end of file
+        return redirect('dashboard')
+
+@login_required
+def system_stats(request):
+    """Статистика моделей и подсистем ИИ (только для персонала)."""
+    if not request.user.is_staff:
+        return JsonResponse({'success': False, 'error': 'Доступ запрещен'}, status=403)
+    try:
+        return JsonResponse({
+            'success': True,
+            'models': model_registry.stats(),
+            'exact_match': exact_match_cache.stats(),
+            'search_cache': search_cache.stats(),
+            'negative_search_cache': negative_search_cache.stats(),
+            'search_http': search_http_pool.stats(),
+            'search_rate_limit': search_rate_limiter.stats(),
+            'search_engines': search_policy_stats(),
+            'single_flight': {'answer': answer_flight.stats(), 'search': search_flight.stats()},
+            'knowledge_refresh': get_ai_manager().knowledge_refresher.stats(),
+            'answer_queue': answer_queue.stats(),
+            'message_hub': message_hub.stats(),
+        })
+    except Exception as e:
+        logger.error(f"Error collecting system stats: {str(e)}")
+        return JsonResponse({'success': False, 'error': str(e)}, status=500)
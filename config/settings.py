@@ -144,6 +144,114 @@ SEARCHAPI_API_KEY = os.getenv('SEARCHAPI_API_KEY', 'dummy-key')
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN', 'dummy-token')
 print("API-ключи загружены")
 
+# Настройки подсистемы машинного обучения
+# Интервал фоновой проверки и переобучения TF-IDF индекса базы знаний (секунды, 0 - отключено)
+TFIDF_REFIT_INTERVAL = int(os.getenv('TFIDF_REFIT_INTERVAL', 600))
+# Микро-батчинг вложений BERT: максимальный размер батча и ожидание добора батча (мс)
+BERT_BATCH_MAX_SIZE = int(os.getenv('BERT_BATCH_MAX_SIZE', 16))
+BERT_BATCH_MAX_WAIT_MS = float(os.getenv('BERT_BATCH_MAX_WAIT_MS', 10))
+# Приближенный поиск (IVF) по вложениям базы знаний: порог включения, полнота/задержка и файл индекса
+KB_ANN_MIN_SIZE = int(os.getenv('KB_ANN_MIN_SIZE', 20000))
+KB_ANN_N_PROBE = int(os.getenv('KB_ANN_N_PROBE', 16))
+KB_ANN_INDEX_PATH = os.path.join(BASE_DIR, 'data', 'kb_ann_index.npz')
+# Интервал (секунды) фонового построения/переобучения IVF индекса и сохранения его изменений на диск
+KB_ANN_MAINTENANCE_INTERVAL = int(os.getenv('KB_ANN_MAINTENANCE_INTERVAL', 300))
+# Каскадный поиск по базе знаний: размер списка кандидатов TF-IDF, порог BERT (None - как у TF-IDF),
+# поиск по всем вложениям при промахе кандидатов (выключен: полный просмотр вложений на каждый промах TF-IDF)
+# и максимальное количество результатов
+KB_TFIDF_TOP_K = int(os.getenv('KB_TFIDF_TOP_K', 20))
+KB_BERT_THRESHOLD = None
+KB_DENSE_FALLBACK = False
+KB_RESULTS_LIMIT = 5
+# Максимальное количество записей кеша точных совпадений вопросов и время жизни записи (секунды):
+# ответы, обновленные другим процессом, остальные процессы перечитывают из базы не позже этого срока
+KB_EXACT_CACHE_SIZE = 10000
+KB_EXACT_CACHE_TTL = 300
+# Фоновое обновление ответов из интернета: интервал (секунды, 0 - отключено), возраст ответа и размер пачки
+KB_REFRESH_INTERVAL = int(os.getenv('KB_REFRESH_INTERVAL', 3600))
+KB_REFRESH_MAX_AGE = int(os.getenv('KB_REFRESH_MAX_AGE', 7 * 24 * 3600))
+KB_REFRESH_BATCH = 20
+# Движок предобработки текста: 'spacy' (ru_core_news_sm без parser/ner) или 'pymorphy' (regex + pymorphy3)
+NLP_PREPROCESSOR_BACKEND = os.getenv('NLP_PREPROCESSOR_BACKEND', 'spacy')
+NLP_LEMMA_CACHE_SIZE = 100000
+# Размер пула потоков для вычислений моделей и ORM в асинхронной обработке сообщений (ASGI, Telegram бот)
+AI_INFERENCE_WORKERS = int(os.getenv('AI_INFERENCE_WORKERS', 4))
+# Очередь генерации ответов: send_message сохраняет сообщение и задание и отвечает 202,
+# ответ генерируют обработчики команды run_answer_worker (количество потоков, пауза опроса очереди,
+# аренда задания в секундах - после нее задание упавшего обработчика выполняется повторно, число попыток)
+AI_ANSWER_QUEUE = os.getenv('AI_ANSWER_QUEUE', 'False').lower() in ('true', '1', 'yes')
+ANSWER_WORKERS = int(os.getenv('ANSWER_WORKERS', 4))
+ANSWER_WORKER_POLL_INTERVAL = 1
+ANSWER_JOB_LEASE = 300
+ANSWER_JOB_MAX_ATTEMPTS = 3
+# Поток новых сообщений беседы (SSE): интервал комментариев-пульса, время жизни соединения (секунды)
+# и интервал проверки сообщений других процессов центром оповещений (0 - только сообщения своего процесса)
+MESSAGE_STREAM_HEARTBEAT = 15
+MESSAGE_STREAM_MAX_AGE = 300
+MESSAGE_HUB_POLL_INTERVAL = 2
+# История сообщений беседы: размер страницы get_messages и страницы чата по умолчанию и максимальный размер страницы
+MESSAGE_PAGE_SIZE = 50
+MESSAGE_PAGE_MAX_SIZE = 200
+# Минимальный интервал между правками ответа Telegram бота промежуточными результатами (секунды)
+TELEGRAM_EDIT_INTERVAL = 1.0
+print("Настройки машинного обучения установлены")
+
+# Настройки поиска в интернете
+# Источники поиска: 'google', 'yandex' (разбор HTML), 'searchapi' (JSON API, SEARCHAPI_API_KEY),
+# 'stub' (локальная заглушка run_search_stub); переопределяется записью SystemSettings 'search_backends'
+SEARCH_BACKENDS = [name.strip() for name in os.getenv('SEARCH_BACKENDS', 'google,yandex').split(',') if name.strip()]
+SEARCH_BACKENDS_REFRESH = 30
+SEARCHAPI_URL = 'https://www.searchapi.io/api/v1/search'
+SEARCHAPI_ENGINE = os.getenv('SEARCHAPI_ENGINE', 'google')
+SEARCH_STUB_URL = os.getenv('SEARCH_STUB_URL', 'http://127.0.0.1:8765/api/v1/search')
+# Общий срок ожидания ответа поисковых систем и таймаут одного запроса (секунды)
+SEARCH_DEADLINE = float(os.getenv('SEARCH_DEADLINE', 8))
+SEARCH_ENGINE_TIMEOUT = float(os.getenv('SEARCH_ENGINE_TIMEOUT', 15))
+# Политика ожидания источников: 'first' - ответ по первым SEARCH_MIN_VALID_RESULTS валидным выдержкам,
+# 'merge' - объединение ответов, полученных до SEARCH_DEADLINE, 'all' - ожидание всех источников
+SEARCH_POLICY = os.getenv('SEARCH_POLICY', 'first')
+SEARCH_MIN_VALID_RESULTS = 3
+# Запас (секунды) сверх срока поиска, после которого синхронный вызов перестает ждать цикл поиска
+SEARCH_RESULT_TIMEOUT_MARGIN = 5
+# Пулы keep-alive соединений поисковых систем: размер пула, простаивающие соединения, их время жизни и HTTP/2
+SEARCH_POOL_MAX_CONNECTIONS = int(os.getenv('SEARCH_POOL_MAX_CONNECTIONS', 20))
+SEARCH_POOL_MAX_KEEPALIVE = int(os.getenv('SEARCH_POOL_MAX_KEEPALIVE', 10))
+SEARCH_POOL_KEEPALIVE_EXPIRY = float(os.getenv('SEARCH_POOL_KEEPALIVE_EXPIRY', 60))
+SEARCH_HTTP2 = True
+# Бюджет запросов к поисковым системам (запросов в секунду и пачка) и автоматический выключатель:
+# размыкание после failure_threshold ошибок 429/5xx/таймаутов подряд, пробный запрос через cooldown секунд
+SEARCH_RATE_LIMITS = {
+    'google': {'rate': 0.5, 'burst': 5, 'failure_threshold': 3, 'cooldown': 120, 'probe_timeout': 15},
+    'yandex': {'rate': 0.5, 'burst': 5, 'failure_threshold': 3, 'cooldown': 120, 'probe_timeout': 15},
+}
+SEARCH_RATE_LIMIT_DIR = os.path.join(BASE_DIR, 'data', 'rate_limit')
+# Объединение одновременных одинаковых запросов между процессами: каталог и число файлов блокировок, ожидание (секунды)
+SINGLE_FLIGHT_LOCK_DIR = os.path.join(BASE_DIR, 'data', 'locks')
+SINGLE_FLIGHT_LOCK_STRIPES = 4096
+SINGLE_FLIGHT_LOCK_TIMEOUT = 60
+# Кеш результатов поиска: время жизни (секунды), размер кеша процесса (байты) и общий файловый кеш
+SEARCH_CACHE_TTL = int(os.getenv('SEARCH_CACHE_TTL', 3600))
+# Время жизни (секунды) результатов, полученных до ответа всех источников (досрочная остановка политикой 'first')
+SEARCH_PARTIAL_CACHE_TTL = int(os.getenv('SEARCH_PARTIAL_CACHE_TTL', 300))
+SEARCH_CACHE_MAX_BYTES = 16 * 1024 * 1024
+# Время жизни записи о запросе без результатов (секунды): повторный поиск в течение этого времени не выполняется
+SEARCH_NEGATIVE_CACHE_TTL = int(os.getenv('SEARCH_NEGATIVE_CACHE_TTL', 120))
+SEARCH_CACHE_ALIAS = 'search'
+# Как часто (секунды) процесс проверяет поколение кеша поиска, измененное очисткой в другом процессе
+SEARCH_CACHE_GENERATION_CHECK = 5
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    SEARCH_CACHE_ALIAS: {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'data', 'search_cache'),
+        'TIMEOUT': SEARCH_CACHE_TTL,
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+}
+print("Настройки поиска установлены")
+
 # URL для аутентификации
 LOGIN_URL = 'login'
 LOGIN_REDIRECT_URL = 'dashboard'
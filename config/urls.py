@@ -25,9 +25,12 @@ urlpatterns = [
     path('conversations/', views.ConversationListView.as_view(), name='conversations'),
     path('chat/<int:conversation_id>/', views.chat, name='chat_detail'),
     path('chat/<int:conversation_id>/send/', views.send_message, name='send_message'),
+    path('chat/<int:conversation_id>/send/stream/', views.send_message_stream, name='send_message_stream'),
     path('chat/<int:conversation_id>/messages/', views.get_messages, name='get_messages'),
+    path('chat/<int:conversation_id>/stream/', views.stream_messages, name='stream_messages'),
     path('new-chat/', views.new_chat, name='new_chat'),
     path('delete-conversation/<int:pk>/', views.ConversationDeleteView.as_view(), name='delete_conversation'),
     path('users/', views.user_list, name='user_list'),
     path('api/response/', views.handle_response, name='handle_response'),
+    path('api/stats/', views.system_stats, name='system_stats'),
 ]
\ No newline at end of file